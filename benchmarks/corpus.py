@@ -0,0 +1,166 @@
+import io
+import os
+import sys
+import random
+import logging
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from data_extraction.fake_drive import FakeDriveService
+
+logger = logging.getLogger(__name__)
+
+# Relative frequency of each document type in the synthetic corpus
+MIME_MIX = {
+    'text/plain': 4,
+    'text/html': 2,
+    'application/pdf': 3,
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': 3,
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': 1,
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation': 1,
+    'application/vnd.google-apps.document': 2,
+}
+
+_EXTENSIONS = {
+    'text/plain': 'txt',
+    'text/html': 'html',
+    'application/pdf': 'pdf',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': 'docx',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': 'xlsx',
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation': 'pptx',
+    'application/vnd.google-apps.document': 'gdoc',
+}
+
+
+class SyntheticCorpus:
+    """
+    Deterministic corpus of mixed-type documents served from a FakeDriveService.
+
+    Documents are paragraphs of words drawn from a fixed vocabulary with a
+    Zipf-like distribution, plus part numbers so keyword queries have exact
+    matches. The same ``seed`` always produces the same corpus.
+
+    Args:
+        n_files (int): Number of documents
+        paragraphs (int): Average paragraphs per document
+        seed (int): Random seed
+        latency (float): Simulated latency of each Drive request, in seconds
+    """
+
+    def __init__(self, n_files, paragraphs=12, seed=0, latency=0.0):
+        self.n_files = n_files
+        self.paragraphs = paragraphs
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.vocabulary = [self._word(i) for i in range(5000)]
+        # Zipf-like weights so some words are common and most are rare
+        self.weights = [1.0 / (rank + 1) for rank in range(len(self.vocabulary))]
+        self.service = FakeDriveService(latency=latency)
+        self.bytes = 0
+        self.by_mime = {}
+        mimes = [mime for mime, weight in MIME_MIX.items() for _ in range(weight)]
+        for i in range(n_files):
+            mime_type = mimes[i % len(mimes)]
+            content = self.document(i, mime_type)
+            self.service.add_file(f"file-{i:06d}", f"doc-{i:06d}.{_EXTENSIONS[mime_type]}", mime_type, content,
+                                  modified_time='2024-01-01T00:00:00Z')
+            self.bytes += len(content)
+            self.by_mime[mime_type] = self.by_mime.get(mime_type, 0) + 1
+
+    def _word(self, i):
+        letters = 'abcdefghijklmnopqrstuvwxyz'
+        rng = random.Random(i)
+        return ''.join(rng.choice(letters) for _ in range(rng.randint(3, 10)))
+
+    def sentence(self, rng=None):
+        rng = rng or self.rng
+        words = rng.choices(self.vocabulary, self.weights, k=rng.randint(6, 20))
+        return ' '.join(words).capitalize() + '.'
+
+    def paragraph(self, i):
+        sentences = [self.sentence() for _ in range(self.rng.randint(3, 8))]
+        if self.rng.random() < 0.3:
+            sentences.append(f"See part PN-{i:06d}-{self.rng.randint(0, 99):02d}.")
+        return ' '.join(sentences)
+
+    def document(self, i, mime_type):
+        paragraphs = [self.paragraph(i) for _ in range(max(1, int(self.rng.gauss(self.paragraphs, 3))))]
+        if mime_type in ('text/plain', 'application/vnd.google-apps.document'):
+            # Google Docs are exported as plain text
+            return '\n\n'.join(paragraphs).encode('utf-8')
+        if mime_type == 'text/html':
+            body = ''.join(f"<p>{p}</p>" for p in paragraphs)
+            return f"<html><head><title>Doc {i}</title></head><body>{body}</body></html>".encode('utf-8')
+        if mime_type == 'application/pdf':
+            return _pdf(paragraphs)
+        if mime_type.endswith('wordprocessingml.document'):
+            import docx
+            document = docx.Document()
+            for p in paragraphs:
+                document.add_paragraph(p)
+            return _save(document)
+        if mime_type.endswith('spreadsheetml.sheet'):
+            import openpyxl
+            workbook = openpyxl.Workbook()
+            sheet = workbook.active
+            for row, p in enumerate(paragraphs):
+                sheet.append([f"PN-{i:06d}-{row:02d}", row * 1.5, p[:200]])
+            return _save(workbook)
+        if mime_type.endswith('presentationml.presentation'):
+            from pptx import Presentation
+            presentation = Presentation()
+            for n, p in enumerate(paragraphs):
+                slide = presentation.slides.add_slide(presentation.slide_layouts[1])
+                slide.shapes.title.text = f"Slide {n}"
+                slide.placeholders[1].text = p
+            return _save(presentation)
+        raise ValueError(f"Unsupported mime type {mime_type}")
+
+    def queries(self, n, seed=1):
+        """Query strings: mostly natural-language sentences, some part-number lookups."""
+        rng = random.Random(seed)
+        queries = []
+        for _ in range(n):
+            if rng.random() < 0.2:
+                queries.append(f"Where is part PN-{rng.randrange(self.n_files):06d}?")
+            else:
+                queries.append(self.sentence(rng))
+        return queries
+
+
+def _save(document):
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def _pdf(paragraphs):
+    # A minimal single-font PDF with one page per paragraph, so no PDF writer is needed
+    def escape(text):
+        return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+    objects = ['<< /Type /Catalog /Pages 2 0 R >>']
+    pages = len(paragraphs)
+    kids = ' '.join(f'{3 + 2 * i} 0 R' for i in range(pages))
+    objects.append(f'<< /Type /Pages /Kids [{kids}] /Count {pages} >>')
+    font = 3 + 2 * pages
+    for i, paragraph in enumerate(paragraphs):
+        words, lines = paragraph.split(), []
+        while words:
+            lines.append(' '.join(words[:12]))
+            words = words[12:]
+        text = ' '.join(f'({escape(line)}) Tj T*' for line in lines)
+        stream = f'BT /F1 10 Tf 14 TL 72 740 Td {text} ET'
+        objects.append(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R '
+                       f'/Resources << /Font << /F1 {font} 0 R >> >> >>')
+        objects.append(f'<< /Length {len(stream)} >>\nstream\n{stream}\nendstream')
+    objects.append('<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>')
+
+    out, offsets = '%PDF-1.4\n', []
+    for i, obj in enumerate(objects):
+        offsets.append(len(out))
+        out += f'{i + 1} 0 obj\n{obj}\nendobj\n'
+    xref = len(out)
+    out += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n' + ''.join(f'{o:010d} 00000 n \n' for o in offsets)
+    out += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'
+    return out.encode('latin-1')
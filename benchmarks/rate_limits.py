@@ -0,0 +1,130 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+logger = logging.getLogger(__name__)
+
+# How each run schedules requests against the rate-limited fakes:
+#   no-retry  every 429 drops its batch or file, as before requests were scheduled
+#   backoff   retries and adaptive concurrency only; the fake sends no rate-limit headers
+#   headers   limits are learned from the fake's x-ratelimit-* headers
+#   budgeted  requests and tokens per minute are configured up front
+CONFIGS = ('no-retry', 'backoff', 'headers', 'budgeted')
+
+
+def schedulers(config, options):
+    from rag_pipeline.rate_limit import RequestScheduler
+    if config == 'no-retry':
+        return (RequestScheduler(max_concurrency=options['max_in_flight'], max_retries=0, name='embeddings'),
+                RequestScheduler(max_concurrency=options['download_workers'], max_retries=0, name='drive'))
+    if config in ('backoff', 'headers'):
+        return (RequestScheduler(max_concurrency=options['max_in_flight'], name='embeddings'),
+                RequestScheduler(max_concurrency=options['download_workers'], name='drive'))
+    return (RequestScheduler(requests_per_minute=options['requests_per_minute'],
+                             tokens_per_minute=options['tokens_per_minute'],
+                             max_concurrency=options['max_in_flight'], name='embeddings'),
+            RequestScheduler(max_concurrency=options['download_workers'], name='drive'))
+
+
+def run_config(config, options, expected_chunks=None):
+    """Ingest the synthetic corpus against rate-limited fakes and report throughput and losses."""
+    from benchmarks.corpus import SyntheticCorpus
+    from data_extraction.gdrive_extraction import GoogleDriveClient
+    from preprocessing.preprocessing import Preprocessor
+    from rag_pipeline.embeddings import FakeEmbeddingBackend
+
+    corpus = SyntheticCorpus(options['files'], seed=options['seed'], latency=options['drive_latency'])
+    limited = config is not None
+    if limited:
+        corpus.service.error_rate = options['drive_error_rate']
+    backend = FakeEmbeddingBackend(latency=options['embed_latency'],
+                                   requests_per_minute=options['requests_per_minute'] if limited else None,
+                                   tokens_per_minute=options['tokens_per_minute'] if limited else None,
+                                   rate_limit_headers=config in ('headers', 'budgeted'))
+    embedding_scheduler, drive_scheduler = schedulers(config or 'headers', options)
+    workdir = tempfile.mkdtemp(prefix='docurag-ratelimit-')
+    try:
+        preprocessor = Preprocessor(os.path.join(workdir, 'faiss_index.index'), embedding_backend=backend,
+                                    drive_client=GoogleDriveClient(service=corpus.service),
+                                    use_embedding_cache=False, batch_size=options['batch_size'],
+                                    max_in_flight=options['max_in_flight'],
+                                    download_workers=options['download_workers'],
+                                    embedding_scheduler=embedding_scheduler, drive_scheduler=drive_scheduler)
+        # Stored vectors sampled at a fixed interval show whether throughput is steady
+        samples, done = [], threading.Event()
+
+        def sample():
+            while not done.wait(options['interval']):
+                samples.append(preprocessor.index_builder.ntotal)
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        start = time.perf_counter()
+        sampler.start()
+        preprocessor.run()
+        seconds = time.perf_counter() - start
+        done.set()
+        sampler.join()
+        chunks = preprocessor.index_builder.ntotal
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    rates = np.diff([0] + samples) / options['interval']
+    # The last partial interval and the ramp-up before the first batch are not steady state
+    steady = rates[1:-1] if len(rates) > 2 else rates
+    return {
+        'config': config or 'unlimited',
+        'seconds': round(seconds, 3),
+        'chunks': int(chunks),
+        'dropped_chunks': int(expected_chunks - chunks) if expected_chunks is not None else None,
+        'chunks_per_second': round(chunks / seconds, 2),
+        'interval_chunks_per_second': {
+            'p10': round(float(np.percentile(steady, 10)), 2) if len(steady) else None,
+            'median': round(float(np.median(steady)), 2) if len(steady) else None,
+            'max': round(float(steady.max()), 2) if len(steady) else None,
+        },
+        'embed_rejected': backend.rejected,
+        'drive_rejected': corpus.service.rejected,
+        'retries': embedding_scheduler.retries + drive_scheduler.retries,
+        'final_concurrency': round(embedding_scheduler.concurrency, 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Ingest against a fake embeddings API and Drive that answer 429s, with and without scheduling")
+    parser.add_argument('--files', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--requests-per-minute', type=float, default=600, help="Fake embeddings API request limit")
+    parser.add_argument('--tokens-per-minute', type=float, default=2_000_000, help="Fake embeddings API token limit")
+    parser.add_argument('--drive-error-rate', type=float, default=0.05, help="Fraction of Drive requests rejected")
+    parser.add_argument('--embed-latency', type=float, default=0.05)
+    parser.add_argument('--drive-latency', type=float, default=0.0)
+    parser.add_argument('--batch-size', type=int, default=16, help="Chunks per embedding request")
+    parser.add_argument('--max-in-flight', type=int, default=8)
+    parser.add_argument('--download-workers', type=int, default=4)
+    parser.add_argument('--interval', type=float, default=0.5, help="Seconds between throughput samples")
+    parser.add_argument('--configs', default=','.join(CONFIGS))
+    parser.add_argument('--output', help="Write the report to this JSON file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    options = {key.replace('-', '_'): value for key, value in vars(args).items()}
+    # An unlimited run gives the number of chunks a run without losses stores
+    reference = run_config(None, options)
+    results = [reference] + [run_config(config, options, reference['chunks'])
+                             for config in args.configs.split(',')]
+    report = {'options': options, 'results': results}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
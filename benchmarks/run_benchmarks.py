@@ -0,0 +1,215 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+logger = logging.getLogger(__name__)
+
+# Metrics compared between runs, and whether a larger value is better
+COMPARED_METRICS = {
+    'ingest.files_per_second': True,
+    'ingest.chunks_per_second': True,
+    'ingest.peak_rss_mb': False,
+    'query.p50_ms': False,
+    'query.p95_ms': False,
+    'query.p99_ms': False,
+    'answer.p50_ms': False,
+    'answer.p95_ms': False,
+    'answer.p99_ms': False,
+    'startup.seconds': False,
+}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def latency_summary(seconds):
+    ms = np.asarray(seconds) * 1000
+    return {
+        'count': len(ms),
+        'mean_ms': round(float(ms.mean()), 3),
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(ms, 95)), 3),
+        'p99_ms': round(float(np.percentile(ms, 99)), 3),
+        'max_ms': round(float(ms.max()), 3),
+    }
+
+
+def run_size(n_files, options):
+    """Ingest a corpus of ``n_files`` documents, then time queries and answers against it."""
+    logging.basicConfig(level=logging.WARNING)
+    from benchmarks.corpus import SyntheticCorpus
+    from data_extraction.gdrive_extraction import GoogleDriveClient
+    from preprocessing.preprocessing import Preprocessor
+    from rag_pipeline.agent import RAGAgent
+    from rag_pipeline.embeddings import FakeEmbeddingBackend
+    from rag_pipeline.fake_chat import FakeChatClient
+
+    corpus = SyntheticCorpus(n_files, seed=options['seed'], latency=options['drive_latency'])
+    client = GoogleDriveClient(service=corpus.service)
+    workdir = tempfile.mkdtemp(prefix='docurag-bench-')
+    faiss_index_path = os.path.join(workdir, 'faiss_index.index')
+    try:
+        preprocessor = Preprocessor(faiss_index_path,
+                                    embedding_backend=FakeEmbeddingBackend(latency=options['embed_latency']),
+                                    drive_client=client,
+                                    use_embedding_cache=False,
+                                    index_kind=options['index_kind'])
+        start = time.perf_counter()
+        preprocessor.run()
+        ingest_seconds = time.perf_counter() - start
+        chunks = preprocessor.index.ntotal
+        ingest_rss = peak_rss_mb()
+
+        start = time.perf_counter()
+        agent = RAGAgent(faiss_index_path,
+                         chat_client=FakeChatClient(latency=options['chat_latency']),
+                         embedding_backend=FakeEmbeddingBackend(latency=options['embed_latency']),
+                         drive_client=client,
+                         mmap_index=options['mmap'])
+        startup_seconds = time.perf_counter() - start
+
+        queries = corpus.queries(options['queries'], seed=options['seed'] + 1)
+        query_seconds = []
+        for query in queries:
+            start = time.perf_counter()
+            agent.faiss_query.query(query, k=options['k'])
+            query_seconds.append(time.perf_counter() - start)
+        answer_seconds = []
+        for query in queries[:options['answers']]:
+            start = time.perf_counter()
+            agent.answer_question(query, k=options['k'])
+            answer_seconds.append(time.perf_counter() - start)
+
+        return {
+            'files': n_files,
+            'chunks': chunks,
+            'corpus_mb': round(corpus.bytes / (1024 * 1024), 2),
+            'mime_types': corpus.by_mime,
+            'ingest': {
+                'seconds': round(ingest_seconds, 3),
+                'files_per_second': round(n_files / ingest_seconds, 2),
+                'chunks_per_second': round(chunks / ingest_seconds, 2),
+                'peak_rss_mb': ingest_rss,
+                'stages': preprocessor.stage_stats,
+            },
+            'startup': {'seconds': round(startup_seconds, 4)},
+            'query': latency_summary(query_seconds),
+            'answer': latency_summary(answer_seconds) if answer_seconds else None,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    import faiss
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'faiss': getattr(faiss, '__version__', None),
+        'commit': commit,
+    }
+
+
+def compare(previous, current, tolerance):
+    """Print per-metric changes against a previous run and return the regressed metrics."""
+    regressions = []
+    previous_by_size = {result['files']: result for result in previous['results']}
+    for result in current['results']:
+        before = previous_by_size.get(result['files'])
+        if before is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            old, new = _lookup(before, metric), _lookup(result, metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            regressed = change < -tolerance if higher_is_better else change > tolerance
+            print(f"files={result['files']:<7} {metric:<28} {old:>12.3f} -> {new:>12.3f} "
+                  f"({change:+.1%}){'  REGRESSION' if regressed else ''}", file=sys.stderr)
+            if regressed:
+                regressions.append((result['files'], metric))
+    return regressions
+
+
+def _lookup(result, metric):
+    value = result
+    for key in metric.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline ingest and query benchmarks on a synthetic corpus")
+    parser.add_argument('--sizes', default='50,200,800', help="Comma-separated corpus sizes, in files")
+    parser.add_argument('--queries', type=int, default=200, help="Queries timed per corpus size")
+    parser.add_argument('--answers', type=int, default=20, help="RAGAgent answers timed per corpus size")
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--embed-latency', type=float, default=0.0, help="Seconds per fake embeddings request")
+    parser.add_argument('--chat-latency', type=float, default=0.0, help="Seconds per fake chat completion")
+    parser.add_argument('--drive-latency', type=float, default=0.0, help="Seconds per fake Drive request")
+    parser.add_argument('--index-kind', default='auto')
+    parser.add_argument('--mmap', action='store_true', help="Memory-map the index when querying")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the JSON report here instead of stdout")
+    parser.add_argument('--compare', help="Previous JSON report to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="Relative change counted as a regression")
+    args = parser.parse_args()
+
+    options = {
+        'queries': args.queries,
+        'answers': args.answers,
+        'k': args.k,
+        'embed_latency': args.embed_latency,
+        'chat_latency': args.chat_latency,
+        'drive_latency': args.drive_latency,
+        'index_kind': args.index_kind,
+        'mmap': args.mmap,
+        'seed': args.seed,
+    }
+    results = []
+    for n_files in [int(size) for size in args.sizes.split(',')]:
+        # A fresh process per size, so peak RSS is that size's own
+        with multiprocessing.get_context('spawn').Pool(1) as pool:
+            results.append(pool.apply(run_size, (n_files, options)))
+        print(f"files={n_files} chunks={results[-1]['chunks']} "
+              f"ingest={results[-1]['ingest']['chunks_per_second']} chunks/s "
+              f"query p50={results[-1]['query']['p50_ms']}ms p99={results[-1]['query']['p99_ms']}ms",
+              file=sys.stderr)
+
+    report = {'environment': environment(), 'options': options, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            previous = json.load(f)
+        regressions = compare(previous, report, args.tolerance)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,125 @@
+import os
+import sys
+import json
+import shutil
+import logging
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Wall-clock budgets, in seconds, for a fresh interpreter on the query path
+IMPORT_BUDGETS = {
+    'rag_pipeline.query': 0.5,
+    'rag_pipeline.agent': 0.5,
+}
+COLD_START_BUDGET = 1.0
+
+# Modules the query path must not import until a code path actually needs them
+DEFERRED_MODULES = ('openai', 'pandas', 'docx', 'pptx', 'pypdf', 'bs4', 'openpyxl',
+                    'googleapiclient.discovery', 'google.oauth2.service_account')
+
+_IMPORT_SCRIPT = """
+import sys, time, json
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+import {module}
+print(json.dumps({{'seconds': time.perf_counter() - start}}))
+"""
+
+_COLD_START_SCRIPT = """
+import sys, time, json
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+from rag_pipeline.agent import RAGAgent
+from rag_pipeline.embeddings import FakeEmbeddingBackend
+imported = time.perf_counter()
+agent = RAGAgent({path!r}, embedding_backend=FakeEmbeddingBackend(), mmap_index={mmap!r})
+loaded = time.perf_counter()
+agent.faiss_query.query('where is the quarterly report', k=5)
+queried = time.perf_counter()
+print(json.dumps({{
+    'import_seconds': imported - start,
+    'load_seconds': loaded - imported,
+    'first_query_seconds': queried - loaded,
+    'seconds': queried - start,
+    'loaded_modules': [name for name in {deferred!r} if name in sys.modules],
+}}))
+"""
+
+
+def _run(script):
+    # A fresh interpreter each time, so nothing is already imported or cached in-process
+    output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def measure_imports(repeat=5):
+    """Median wall-clock import time of each budgeted module in a fresh interpreter."""
+    return {module: statistics.median(_run(_IMPORT_SCRIPT.format(root=ROOT, module=module))['seconds']
+                                      for _ in range(repeat))
+            for module in IMPORT_BUDGETS}
+
+
+def build_index(workdir, n_files=50):
+    """A small index built from the synthetic benchmark corpus with fake embeddings."""
+    from benchmarks.corpus import SyntheticCorpus
+    from data_extraction.gdrive_extraction import GoogleDriveClient
+    from preprocessing.preprocessing import Preprocessor
+    from rag_pipeline.embeddings import FakeEmbeddingBackend
+    logging.getLogger().setLevel(logging.WARNING)
+
+    faiss_index_path = os.path.join(workdir, 'faiss_index.index')
+    corpus = SyntheticCorpus(n_files)
+    Preprocessor(faiss_index_path, embedding_backend=FakeEmbeddingBackend(),
+                 drive_client=GoogleDriveClient(service=corpus.service), use_embedding_cache=False).run()
+    return faiss_index_path
+
+
+def measure_cold_start(faiss_index_path, mmap=True, repeat=5):
+    """Median time from a fresh interpreter to the first answered query, and what it imported."""
+    runs = [_run(_COLD_START_SCRIPT.format(root=ROOT, path=faiss_index_path, mmap=mmap, deferred=DEFERRED_MODULES))
+            for _ in range(repeat)]
+    result = {key: round(statistics.median(run[key] for run in runs), 4)
+              for key in ('import_seconds', 'load_seconds', 'first_query_seconds', 'seconds')}
+    result['loaded_modules'] = sorted({name for run in runs for name in run['loaded_modules']})
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check import time and cold start of the query path against budgets")
+    parser.add_argument('--index', help="Index to cold-start against; a small synthetic one is built if omitted")
+    parser.add_argument('--repeat', type=int, default=5, help="Fresh interpreters per measurement")
+    parser.add_argument('--no-mmap', action='store_true', help="Read the index into RAM instead of memory-mapping it")
+    args = parser.parse_args()
+
+    workdir = None
+    faiss_index_path = args.index
+    if faiss_index_path is None:
+        workdir = tempfile.mkdtemp(prefix='docurag-startup-')
+        faiss_index_path = build_index(workdir)
+    try:
+        imports = measure_imports(args.repeat)
+        cold_start = measure_cold_start(faiss_index_path, mmap=not args.no_mmap, repeat=args.repeat)
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    failures = [f"import {module}: {seconds:.3f}s > {IMPORT_BUDGETS[module]}s"
+                for module, seconds in imports.items() if seconds > IMPORT_BUDGETS[module]]
+    if cold_start['seconds'] > COLD_START_BUDGET:
+        failures.append(f"cold start: {cold_start['seconds']:.3f}s > {COLD_START_BUDGET}s")
+    if cold_start['loaded_modules']:
+        failures.append(f"query path imported {', '.join(cold_start['loaded_modules'])}")
+
+    print(json.dumps({'imports': {module: round(seconds, 4) for module, seconds in imports.items()},
+                      'cold_start': cold_start, 'failures': failures}, indent=2))
+    for failure in failures:
+        print(f"OVER BUDGET: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
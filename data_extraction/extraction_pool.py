@@ -0,0 +1,266 @@
+import os
+import io
+import sys
+import time
+import queue
+import logging
+import tempfile
+import threading
+import mimetypes
+import multiprocessing
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+logger = logging.getLogger(__name__)
+
+# Payloads up to this size are sent to workers directly instead of via a temp file
+MAX_INLINE_BYTES = 8 * 1024 * 1024
+
+
+class ExtractionError(Exception):
+    """Raised when a worker fails, crashes or times out on a file."""
+
+
+class _Worker:
+    def __init__(self, context, chunk_options, initializer=None, initargs=()):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main,
+                                       args=(child_conn, chunk_options, initializer, initargs), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+        self.ready = False
+
+    def wait_ready(self, timeout=None):
+        # Start-up (imports, tokenizer loading) is not charged to the first file's
+        # timeout; it has its own, and False means the worker did not start in time
+        if not self.ready:
+            if not self.conn.poll(timeout):
+                return False
+            self.conn.recv()
+            self.ready = True
+        return True
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class ExtractionPool:
+    """
+    Parses and chunks documents in separate processes so extraction uses every core.
+
+    Each call borrows one worker process, so calls can be made from several
+    threads at once (e.g. the ingest pipeline's extraction workers). A worker that
+    exceeds ``timeout`` or dies is killed and replaced; only the file it was
+    working on fails. So does a worker that does not start within
+    ``startup_timeout``; the file it was given fails.
+
+    Args:
+        workers (int): Worker processes; defaults to the CPU count
+        timeout (float): Seconds allowed per file
+        startup_timeout (float): Seconds allowed for a worker to start
+        chunk_options (dict): Keyword arguments for ``iter_chunks`` plus ``model``
+            for the token counter
+        max_tasks_per_worker (int): Recycle a worker after this many files to
+            bound leaks in the parsing libraries
+        initializer (callable): Called with ``initargs`` in each worker before it
+            takes files, e.g. to register extractors for more mime types; workers
+            are spawned, so it must be a module-level function
+        initargs (tuple): Arguments for ``initializer``
+    """
+
+    def __init__(self, workers=None, timeout=120.0, chunk_options=None, max_tasks_per_worker=500,
+                 startup_timeout=60.0, initializer=None, initargs=()):
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.startup_timeout = startup_timeout
+        self.chunk_options = dict(chunk_options or {})
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.initializer = initializer
+        self.initargs = tuple(initargs)
+        self.timeouts = 0
+        self.crashes = 0
+        # Spawned rather than forked: the parent runs pipeline threads
+        self._context = multiprocessing.get_context('spawn')
+        self._idle = queue.Queue()
+        self._all = []
+        self._lock = threading.Lock()
+        for _ in range(self.workers):
+            self._add_worker()
+
+    def _add_worker(self):
+        worker = _Worker(self._context, self.chunk_options, self.initializer, self.initargs)
+        with self._lock:
+            self._all.append(worker)
+        self._idle.put(worker)
+
+    def _retire(self, worker):
+        worker.kill()
+        with self._lock:
+            self._all.remove(worker)
+        self._add_worker()
+
+    def extract(self, file_stream, mime_type):
+        """
+        Extract and chunk one document in a worker process.
+
+        Args:
+            file_stream: Readable binary file object holding the document
+            mime_type (str): Mime type of the content
+
+        Returns:
+            list: ``Chunk`` tuples of (text, start, end)
+
+        Raises:
+            ExtractionError: If the worker raised, crashed or timed out
+        """
+        from rag_pipeline.chunking import Chunk
+
+        source, temp_path = self._prepare(file_stream)
+        worker = self._idle.get()
+        try:
+            try:
+                started = worker.wait_ready(self.startup_timeout)
+                if started:
+                    worker.conn.send((source, mime_type))
+            except (EOFError, OSError):
+                with self._lock:
+                    self.crashes += 1
+                self._retire(worker)
+                worker = None
+                raise ExtractionError("Extraction worker exited unexpectedly")
+            if not started:
+                with self._lock:
+                    self.timeouts += 1
+                self._retire(worker)
+                worker = None
+                raise ExtractionError(f"Extraction worker did not start within {self.startup_timeout:.0f}s")
+            if not worker.conn.poll(self.timeout):
+                with self._lock:
+                    self.timeouts += 1
+                self._retire(worker)
+                worker = None
+                raise ExtractionError(f"Extraction timed out after {self.timeout:.0f}s")
+            try:
+                status, result = worker.conn.recv()
+            except (EOFError, OSError):
+                with self._lock:
+                    self.crashes += 1
+                self._retire(worker)
+                worker = None
+                raise ExtractionError("Extraction worker crashed")
+        finally:
+            if worker is not None:
+                worker.tasks += 1
+                if self.max_tasks_per_worker and worker.tasks >= self.max_tasks_per_worker:
+                    self._retire(worker)
+                else:
+                    self._idle.put(worker)
+            if temp_path:
+                os.remove(temp_path)
+        if status == 'error':
+            raise ExtractionError(result)
+        return [Chunk(*chunk) for chunk in result]
+
+    def _prepare(self, file_stream):
+        # Small documents travel over the pipe; large ones through a named temp file
+        file_stream.seek(0, io.SEEK_END)
+        size = file_stream.tell()
+        file_stream.seek(0)
+        if size <= MAX_INLINE_BYTES:
+            return file_stream.read(), None
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            while True:
+                block = file_stream.read(1024 * 1024)
+                if not block:
+                    break
+                f.write(block)
+        return f.name, f.name
+
+    def close(self):
+        with self._lock:
+            workers, self._all = self._all, []
+        for worker in workers:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+            worker.process.join(timeout=1)
+            if worker.process.is_alive():
+                worker.kill()
+
+
+def _worker_main(conn, chunk_options, initializer=None, initargs=()):
+    from data_extraction.gdrive_extraction import GoogleDriveClient
+    from rag_pipeline.chunking import iter_chunks, get_token_counter
+
+    if initializer is not None:
+        initializer(*initargs)
+    extractor = GoogleDriveClient.for_extraction()
+    options = dict(chunk_options)
+    options['count_tokens'] = get_token_counter(options.pop('model', "text-embedding-ada-002"))
+    conn.send('ready')
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        source, mime_type = task
+        try:
+            stream = open(source, 'rb') if isinstance(source, str) else io.BytesIO(source)
+            with stream:
+                pieces = extractor.iter_text(stream, mime_type)
+                chunks = [tuple(chunk) for chunk in iter_chunks(pieces, **options)] if pieces is not None else []
+            conn.send(('ok', chunks))
+        except Exception as e:
+            conn.send(('error', f"{type(e).__name__}: {e}"))
+
+
+if __name__ == "__main__":
+    # Usage: python data_extraction/extraction_pool.py <directory of sample documents> [max workers]
+    # Reports extraction throughput for 1..max workers to check scaling across cores.
+    logging.basicConfig(level=logging.INFO)
+    sample_dir = sys.argv[1]
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    samples = []
+    for name in sorted(os.listdir(sample_dir)):
+        mime_type, _ = mimetypes.guess_type(name)
+        if mime_type:
+            with open(os.path.join(sample_dir, name), 'rb') as f:
+                samples.append((f.read(), mime_type))
+
+    workers = 1
+    while workers <= max_workers:
+        pool = ExtractionPool(workers=workers)
+        threads = []
+        tasks = queue.Queue()
+        for sample in samples:
+            tasks.put(sample)
+
+        def drain():
+            while True:
+                try:
+                    data, mime_type = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    pool.extract(io.BytesIO(data), mime_type)
+                except ExtractionError as e:
+                    logger.warning(str(e))
+
+        # Warm up so process start-up is not counted
+        pool.extract(io.BytesIO(samples[0][0]), samples[0][1])
+        start = time.perf_counter()
+        for _ in range(workers):
+            threads.append(threading.Thread(target=drain))
+            threads[-1].start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        print(f"workers={workers} files={len(samples)} seconds={elapsed:.2f} files_per_second={len(samples) / elapsed:.1f}")
+        pool.close()
+        workers *= 2
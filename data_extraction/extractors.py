@@ -0,0 +1,166 @@
+import io
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Extracted text is yielded in pieces of roughly this many characters or rows
+TEXT_BLOCK_CHARS = 64 * 1024
+PARAGRAPHS_PER_BLOCK = 200
+ROWS_PER_BLOCK = 500
+
+# mime type -> extractor; filled by register_extractor below
+_EXTRACTORS = {}
+
+
+def register_extractor(mime_types, extractor=None):
+    """
+    Register ``extractor(file_stream, mime_type)`` for ``mime_types``.
+
+    An extractor returns an iterable of text pieces (pages, slides, row blocks,
+    ...) read from a binary file object. Extractors import their parsing
+    libraries when first called, so registering one costs nothing at import
+    time. Usable as a decorator; a later registration for a mime type replaces
+    the earlier one.
+    """
+    if isinstance(mime_types, str):
+        mime_types = [mime_types]
+
+    def register(fn):
+        for mime_type in mime_types:
+            _EXTRACTORS[mime_type] = fn
+        return fn
+
+    return register(extractor) if extractor is not None else register
+
+
+def get_extractor(mime_type):
+    return _EXTRACTORS.get(mime_type)
+
+
+def supported_mime_types():
+    return sorted(_EXTRACTORS)
+
+
+def iter_text(file_stream, mime_type):
+    """
+    Yield a document's text in pieces (pages, slides, row blocks, ...).
+
+    Returns None for unsupported mime types.
+    """
+    extractor = _EXTRACTORS.get(mime_type)
+    if extractor is None:
+        logger.warning(f"Unsupported mime type: {mime_type}")
+        return None
+    return extractor(file_stream, mime_type)
+
+
+@register_extractor('application/pdf')
+def iter_pdf(file_stream, mime_type='application/pdf'):
+    """Yield the text of a PDF page by page."""
+    import pypdf
+    reader = pypdf.PdfReader(file_stream)
+    for page in reader.pages:
+        yield (page.extract_text() or '') + "\n"
+
+
+@register_extractor(['application/msword',
+                     'application/vnd.openxmlformats-officedocument.wordprocessingml.document'])
+def iter_word(file_stream, mime_type=None):
+    """Yield the paragraphs of a Word document in blocks."""
+    import docx
+    doc = docx.Document(file_stream)
+    block = []
+    for paragraph in doc.paragraphs:
+        block.append(paragraph.text)
+        if len(block) >= PARAGRAPHS_PER_BLOCK:
+            yield "\n".join(block) + "\n"
+            block = []
+    if block:
+        yield "\n".join(block) + "\n"
+
+
+@register_extractor(['application/vnd.ms-excel',
+                     'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'])
+def iter_excel(file_stream, mime_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'):
+    """Yield each sheet of a workbook in blocks of rows."""
+    if mime_type == 'application/vnd.ms-excel':
+        # Legacy .xls has no streaming reader, so each sheet is loaded by pandas
+        import pandas as pd
+        for sheet_name, df in pd.read_excel(file_stream, sheet_name=None).items():
+            for start in range(0, max(len(df), 1), ROWS_PER_BLOCK):
+                yield f"Sheet: {sheet_name}\n{df.iloc[start:start + ROWS_PER_BLOCK].to_string()}\n"
+        return
+    # openpyxl's read-only mode streams rows without loading the whole workbook
+    from openpyxl import load_workbook
+    workbook = load_workbook(file_stream, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            block = []
+            for row in sheet.iter_rows(values_only=True):
+                if any(cell is not None for cell in row):
+                    block.append("\t".join('' if cell is None else str(cell) for cell in row))
+                if len(block) >= ROWS_PER_BLOCK:
+                    yield f"Sheet: {sheet.title}\n" + "\n".join(block) + "\n"
+                    block = []
+            if block:
+                yield f"Sheet: {sheet.title}\n" + "\n".join(block) + "\n"
+    finally:
+        workbook.close()
+
+
+@register_extractor(['application/vnd.ms-powerpoint',
+                     'application/vnd.openxmlformats-officedocument.presentationml.presentation'])
+def iter_powerpoint(file_stream, mime_type=None):
+    """Yield the text of a presentation slide by slide."""
+    from pptx import Presentation
+    prs = Presentation(file_stream)
+    for slide in prs.slides:
+        texts = [shape.text for shape in slide.shapes if hasattr(shape, "text")]
+        if texts:
+            yield "\n".join(texts) + "\n"
+
+
+# JSON is indexed as its raw text so it can be chunked like any other document
+@register_extractor(['text/plain', 'text/csv', 'text/markdown', 'application/json'])
+def iter_plain_text(file_stream, mime_type=None):
+    """Decode a text file incrementally."""
+    reader = io.TextIOWrapper(file_stream, encoding='utf-8', errors='ignore')
+    try:
+        while True:
+            block = reader.read(TEXT_BLOCK_CHARS)
+            if not block:
+                break
+            yield block
+    finally:
+        # Leave the underlying stream open for its owner to close
+        reader.detach()
+
+
+@register_extractor('application/xml')
+def iter_xml(file_stream, mime_type=None):
+    """Yield the text of an XML document as it is parsed, in document order."""
+    import xml.sax
+    collected = []
+    handler = xml.sax.handler.ContentHandler()
+    handler.characters = collected.append
+    parser = xml.sax.make_parser()
+    parser.setContentHandler(handler)
+    while True:
+        data = file_stream.read(TEXT_BLOCK_CHARS)
+        if not data:
+            break
+        parser.feed(data)
+        if collected:
+            yield ''.join(collected)
+            collected.clear()
+    parser.close()
+    if collected:
+        yield ''.join(collected)
+
+
+@register_extractor('text/html')
+def iter_html(file_stream, mime_type=None):
+    """Yield the text of an HTML document."""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(file_stream, 'html.parser')
+    yield soup.get_text()
@@ -0,0 +1,154 @@
+import re
+import time
+import random
+import threading
+from datetime import datetime, timezone
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from data_extraction.gdrive_extraction import FOLDER_MIME_TYPE
+
+
+class FakeDriveService:
+    """
+    In-memory stand-in for the Drive v3 service returned by ``googleapiclient``.
+
+    Supports the calls GoogleDriveClient makes: paginated ``files().list``,
+    ``files().get_media`` (downloaded through MediaIoBaseDownload with HTTP range
+    requests) and ``files().export``. Pass it as ``GoogleDriveClient(service=...)``
+    to run ingest offline.
+
+    ``error_rate`` is the fraction of requests answered with a 429 and a short
+    ``retry-after``, as Drive does when a quota is exceeded.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        self.files_by_id = {}
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self.rejected = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def add_file(self, file_id, name, mime_type, content=b'', parents=None, modified_time=None):
+        """Add a file (or a folder, with ``FOLDER_MIME_TYPE``) to the fake drive."""
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        self.files_by_id[file_id] = {
+            'id': file_id,
+            'name': name,
+            'mimeType': mime_type,
+            'parents': list(parents or []),
+            'modifiedTime': modified_time or datetime.now(timezone.utc).isoformat(),
+            'content': content,
+        }
+        return self.files_by_id[file_id]
+
+    def remove_file(self, file_id):
+        self.files_by_id.pop(file_id, None)
+
+    def files(self):
+        return _FakeFilesResource(self)
+
+    def _simulate_request(self):
+        """Count and delay one request; returns a 429 response if it is rejected."""
+        with self._lock:
+            self.requests += 1
+            rejected = self.error_rate and self._random.random() < self.error_rate
+            if rejected:
+                self.rejected += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if rejected:
+            return httplib2.Response({'status': 429, 'retry-after': '0.05'})
+        return None
+
+    def _execute(self, fn, uri):
+        rejected = self._simulate_request()
+        if rejected is not None:
+            raise HttpError(rejected, b'{"error": {"message": "Rate Limit Exceeded"}}', uri=uri)
+        return fn()
+
+
+class _FakeFilesResource:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def list(self, q=None, pageSize=100, pageToken=None, fields=None, **kwargs):
+        return _FakeRequest(self.drive, lambda: self._list_page(q, pageSize, pageToken))
+
+    def get_media(self, fileId, **kwargs):
+        return _FakeMediaRequest(self.drive, fileId)
+
+    def export(self, fileId, mimeType, **kwargs):
+        return _FakeRequest(self.drive, lambda: self.drive.files_by_id[fileId]['content'])
+
+    def _list_page(self, q, page_size, page_token):
+        files = [f for f in self.drive.files_by_id.values() if _matches(f, q)]
+        start = int(page_token or 0)
+        page = files[start:start + page_size]
+        result = {'files': [_file_resource(f) for f in page]}
+        if start + page_size < len(files):
+            result['nextPageToken'] = str(start + page_size)
+        return result
+
+
+def _file_resource(file):
+    resource = {k: v for k, v in file.items() if k != 'content'}
+    resource['size'] = str(len(file['content']))
+    return resource
+
+
+def _matches(file, q):
+    # Only the query clauses GoogleDriveClient issues are understood
+    if not q:
+        return True
+    parent = re.search(r"'([^']+)' in parents", q)
+    if parent and parent.group(1) not in file['parents']:
+        return False
+    return True
+
+
+class _FakeRequest:
+    def __init__(self, drive, fn):
+        self.drive = drive
+        self.fn = fn
+
+    def execute(self, num_retries=0):
+        return self.drive._execute(self.fn, 'fake://drive/files')
+
+
+class _FakeMediaRequest:
+    """Looks enough like an HttpRequest for MediaIoBaseDownload to drive it."""
+
+    def __init__(self, drive, file_id):
+        self.drive = drive
+        self.file_id = file_id
+        self.uri = f'fake://drive/files/{file_id}?alt=media'
+        self.headers = {}
+        self.http = _FakeHttp(drive, file_id)
+
+    def execute(self, num_retries=0):
+        return self.drive._execute(lambda: self.drive.files_by_id[self.file_id]['content'], self.uri)
+
+
+class _FakeHttp:
+    def __init__(self, drive, file_id):
+        self.drive = drive
+        self.file_id = file_id
+
+    def request(self, uri, method='GET', headers=None, **kwargs):
+        rejected = self.drive._simulate_request()
+        if rejected is not None:
+            return rejected, b'{"error": {"message": "Rate Limit Exceeded"}}'
+        content = self.drive.files_by_id[self.file_id]['content']
+        start, end = 0, len(content) - 1
+        match = re.match(r'bytes=(\d+)-(\d+)', (headers or {}).get('range', ''))
+        if match:
+            start, end = int(match.group(1)), min(int(match.group(2)), len(content) - 1)
+        if not content:
+            return httplib2.Response({'status': 416, 'content-range': 'bytes */0'}), b''
+        body = content[start:end + 1]
+        return httplib2.Response({'status': 206, 'content-range': f'bytes {start}-{end}/{len(content)}'}), body
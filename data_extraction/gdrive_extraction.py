@@ -1,31 +1,79 @@
 import os
 import io
+import sys
 import logging
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
 from googleapiclient.errors import HttpError
 from dotenv import load_dotenv
-import PyPDF2
-from io import BytesIO
-import docx
-import pandas as pd
-from bs4 import BeautifulSoup
-import pypdf
-import xml.etree.ElementTree as ET
+import tempfile
 import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from rag_pipeline import metrics
+# Parsers are imported by each extractor on first use, not with this module
+from data_extraction import extractors
+from data_extraction.extractors import TEXT_BLOCK_CHARS, PARAGRAPHS_PER_BLOCK, ROWS_PER_BLOCK
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Export formats for Google Docs Editors files, which cannot be downloaded directly
+EXPORT_MIME_TYPES = {
+    'application/vnd.google-apps.document': 'text/plain',
+    'application/vnd.google-apps.spreadsheet': 'text/csv',
+    'application/vnd.google-apps.presentation': 'application/pdf',
+}
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+# Only the file fields ingest needs, so listing pages stay small
+LIST_FIELDS = "nextPageToken, files(id, name, mimeType, parents, size, modifiedTime, md5Checksum)"
+
+# Downloads larger than this spill from memory to a temporary file
+DEFAULT_MAX_IN_MEMORY_BYTES = 16 * 1024 * 1024
+DOWNLOAD_CHUNK_BYTES = 4 * 1024 * 1024
+
+
 class GoogleDriveClient:
-    def __init__(self, service_account_file, scopes):
+    def __init__(self, service_account_file=None, scopes=None, service=None,
+                 max_in_memory_bytes=DEFAULT_MAX_IN_MEMORY_BYTES, scheduler=None):
         self.service_account_file = service_account_file
         self.scopes = scopes
-        self.service = self.authenticate()
+        self.max_in_memory_bytes = max_in_memory_bytes
+        # Optional RequestScheduler that throttles and retries Drive requests
+        self.scheduler = scheduler
+        # An already-built Drive service (or a fake one) can be injected directly
+        self.service = service if service is not None else self.authenticate()
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        """A client authenticated with the SERVICE_ACCOUNT_FILE and SCOPES environment variables."""
+        load_dotenv()
+        return cls(os.getenv("SERVICE_ACCOUNT_FILE"), os.getenv("SCOPES").split(','), **kwargs)
+
+    @classmethod
+    def for_extraction(cls, max_in_memory_bytes=DEFAULT_MAX_IN_MEMORY_BYTES):
+        """A client that only parses content it is given and never contacts Drive."""
+        client = cls.__new__(cls)
+        client.service_account_file = None
+        client.scopes = None
+        client.max_in_memory_bytes = max_in_memory_bytes
+        client.scheduler = None
+        client.service = None
+        return client
+
+    def _call(self, fn, *args):
+        # Each Drive request, including every chunk of a download, goes through the scheduler
+        if self.scheduler is None:
+            return fn(*args)
+        return self.scheduler.call(fn, *args)
 
     def authenticate(self):
+        from google.oauth2 import service_account
+        from googleapiclient.discovery import build
         logger.info("Authenticating with service account file: %s", self.service_account_file)
         credentials = service_account.Credentials.from_service_account_file(
             self.service_account_file, scopes=self.scopes)
@@ -33,8 +81,7 @@ class GoogleDriveClient:
 
     def list_files(self, page_size=100):
         logger.info("Listing files with page size: %d", page_size)
-        results = self.service.files().list(pageSize=page_size, fields="nextPageToken, files(id, name, mimeType)").execute()
-        items = results.get('files', [])
+        items = list(self.iter_files(page_size=page_size))
 
         if not items:
             logger.info('No files found.')
@@ -44,34 +91,75 @@ class GoogleDriveClient:
                 logger.info("%s (%s)", item['name'], item['id'])
         return items
 
+    def iter_files(self, folder_id=None, recursive=True, page_size=1000, fields=LIST_FIELDS):
+        """
+        Lazily yield every non-folder file, following all result pages.
+
+        The next page is requested in the background while the current one is
+        being consumed, so callers can start work on the first page early.
+
+        Args:
+            folder_id (str): Only list files under this folder; None lists the whole drive
+            recursive (bool): Also walk subfolders of ``folder_id``
+            page_size (int): Files requested per page
+            fields (str): Partial-response field selector
+
+        Yields:
+            dict: File resources with the fields in ``fields``
+        """
+        folders = deque([folder_id])
+        seen = set()
+        while folders:
+            current = folders.popleft()
+            query = "trashed = false"
+            if current is not None:
+                query += f" and '{current}' in parents"
+            for item in self._iter_pages(query, page_size, fields):
+                if item.get('mimeType') == FOLDER_MIME_TYPE:
+                    # A drive-wide listing already includes files in subfolders
+                    if current is not None and recursive and item['id'] not in seen:
+                        seen.add(item['id'])
+                        folders.append(item['id'])
+                    continue
+                yield item
+
+    def _iter_pages(self, query, page_size, fields):
+        def fetch(page_token):
+            return self._call(self.service.files().list(q=query, pageSize=page_size, pageToken=page_token,
+                                                        fields=fields).execute)
+
+        with ThreadPoolExecutor(max_workers=1) as prefetcher:
+            results = fetch(None)
+            while True:
+                page_token = results.get('nextPageToken')
+                next_page = prefetcher.submit(fetch, page_token) if page_token else None
+                yield from results.get('files', [])
+                if next_page is None:
+                    break
+                results = next_page.result()
+
     def download_file(self, file_id, file_name):
         logger.info("Downloading file with ID: %s to %s", file_id, file_name)
+        from googleapiclient.http import MediaIoBaseDownload
         request = self.service.files().get_media(fileId=file_id)
         fh = io.FileIO(file_name, 'wb')
         downloader = MediaIoBaseDownload(fh, request)
         done = False
         while not done:
-            status, done = downloader.next_chunk()
-            logger.info("Download %d%%.", int(status.progress() * 100))
+            status, done = self._call(downloader.next_chunk)
+            logger.debug("Download %d%%.", int(status.progress() * 100))
 
     def get_file_content(self, file_id):
         try:
             # Attempt to download the file content
-            request = self.service.files().get_media(fileId=file_id)
-            fh = io.BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
-            done = False
-            while not done:
-                status, done = downloader.next_chunk()
-                logger.info("Download %d%%.", int(status.progress() * 100))
-            fh.seek(0)
-            return fh.read().decode('utf-8')
+            with self.download_to_file(file_id) as fh:
+                return ''.join(extractors.iter_plain_text(fh))
         except HttpError as error:
             if error.resp.status == 403 and 'fileNotDownloadable' in str(error):
                 # Handle Google Docs Editors files by exporting them
                 logger.info("File is not directly downloadable. Attempting to export.")
                 request = self.service.files().export(fileId=file_id, mimeType='text/plain')
-                response = request.execute()
+                response = self._call(request.execute)
                 return response.decode('utf-8')
             else:
                 logger.error("An error occurred: %s", error)
@@ -79,133 +167,109 @@ class GoogleDriveClient:
 
     def get_pdf_text_content(self, file_id):
         try:
-            # Download the PDF file content
-            request = self.service.files().get_media(fileId=file_id)
-            fh = io.BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
-            done = False
-            while not done:
-                status, done = downloader.next_chunk()
-                logger.info("Download %d%%.", int(status.progress() * 100))
-            fh.seek(0)
-            
-            # Extract text from the PDF file
-            reader = PyPDF2.PdfFileReader(fh)
-            text_content = ""
-            for page_num in range(reader.numPages):
-                page = reader.getPage(page_num)
-                text_content += page.extract_text()
-            return text_content
+            # Download the PDF to a spooled file and extract it page by page
+            with self.download_to_file(file_id) as fh:
+                return ''.join(extractors.iter_pdf(fh))
         except HttpError as error:
             logger.error("An error occurred while downloading or processing the PDF file %s: %s", file_id, error)
             return None
 
     def export_file(self, file_id, mime_type):
         try:
-            if mime_type == 'application/vnd.google-apps.document':
-                export_mime_type = 'text/plain'
-            elif mime_type == 'application/vnd.google-apps.spreadsheet':
-                export_mime_type = 'text/csv'
-            elif mime_type == 'application/vnd.google-apps.presentation':
-                export_mime_type = 'application/pdf'
-            else:
-                export_mime_type = 'application/pdf'  # Default export type
-
+            export_mime_type = EXPORT_MIME_TYPES.get(mime_type, 'application/pdf')  # PDF is the default export type
             request = self.service.files().export(fileId=file_id, mimeType=export_mime_type)
-            response = request.execute()
+            response = self._call(request.execute)
             return response.decode('utf-8')
         except HttpError as error:
             logger.error("An error occurred while exporting file %s: %s", file_id, error)
             return None
 
-    def list_files_in_folder(self, folder_id):
+    def list_files_in_folder(self, folder_id, recursive=True):
         logger.info("Listing files in folder with ID: %s", folder_id)
-        results = self.service.files().list(q=f"'{folder_id}' in parents", fields="files(id, name)").execute()
-        items = results.get('files', [])
+        items = list(self.iter_files(folder_id=folder_id, recursive=recursive))
         if not items:
             logger.info('No files found.')
         else:
             logger.info('Files:')
             for item in items:
                 logger.info("%s (%s)", item['name'], item['id'])
+        return items
+
+    def download_bytes(self, file_id):
+        """Download a file's raw content into memory."""
+        with self.download_to_file(file_id) as fh:
+            return fh.read()
+
+    def download_to_file(self, file_id):
+        """
+        Download a file into a spooled temporary file, rewound to the start.
+
+        Content stays in memory up to ``max_in_memory_bytes`` and spills to disk
+        beyond that. Closing the returned file deletes any spilled data.
+        """
+        from googleapiclient.http import MediaIoBaseDownload
+        request = self.service.files().get_media(fileId=file_id)
+        fh = tempfile.SpooledTemporaryFile(max_size=self.max_in_memory_bytes)
+        try:
+            with metrics.span('drive_download'):
+                downloader = MediaIoBaseDownload(fh, request, chunksize=DOWNLOAD_CHUNK_BYTES)
+                done = False
+                while not done:
+                    status, done = self._call(downloader.next_chunk)
+                    metrics.inc('drive_requests', kind='download')
+        except BaseException:
+            fh.close()
+            metrics.inc('drive_errors', kind='download')
+            raise
+        metrics.inc('drive_downloaded_bytes', fh.tell(), kind='download')
+        fh.seek(0)
+        return fh
+
+    def fetch_file(self, file_id, mime_type):
+        """
+        Fetch a file's content, exporting Google Docs Editors files.
+
+        Returns:
+            tuple: (file object positioned at the start, mime type of its content).
+                The caller closes the file object.
+        """
+        if mime_type.startswith('application/vnd.google-apps'):
+            export_mime_type = EXPORT_MIME_TYPES.get(mime_type, 'application/pdf')
+            request = self.service.files().export(fileId=file_id, mimeType=export_mime_type)
+            # Drive caps exports at 10MB, so these are small enough to hold in memory
+            with metrics.span('drive_export'):
+                content = self._call(request.execute)
+            metrics.inc('drive_requests', kind='export')
+            metrics.inc('drive_downloaded_bytes', len(content), kind='export')
+            return io.BytesIO(content), export_mime_type
+        return self.download_to_file(file_id), mime_type
 
     def extract_text(self, file_id, mime_type):
         """Extract text from various file formats."""
         try:
-            # Download the file content
-            request = self.service.files().get_media(fileId=file_id)
-            file_content = io.BytesIO()
-            downloader = MediaIoBaseDownload(file_content, request)
-            done = False
-            while not done:
-                status, done = downloader.next_chunk()
-            file_content.seek(0)
-            
-            # Handle different file types
-            if mime_type == 'application/pdf':
-                return self._extract_pdf(file_content)
-            elif mime_type in ['application/msword', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document']:
-                return self._extract_word(file_content)
-            elif mime_type in ['application/vnd.ms-excel', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet']:
-                return self._extract_excel(file_content)
-            elif mime_type in ['application/vnd.ms-powerpoint', 'application/vnd.openxmlformats-officedocument.presentationml.presentation']:
-                return self._extract_powerpoint(file_content)
-            elif mime_type in ['text/plain', 'text/csv', 'text/markdown']:
-                return file_content.getvalue().decode('utf-8', errors='ignore')
-            elif mime_type == 'application/json':
-                return json.loads(file_content.getvalue())
-            elif mime_type == 'application/xml':
-                return self._extract_xml(file_content)
-            elif mime_type == 'text/html':
-                return self._extract_html(file_content)
-
-            
-            logger.warning(f"Unsupported mime type: {mime_type}")
-            return None
-            
+            with self.download_to_file(file_id) as fh:
+                return self.join_text(self.iter_text(fh, mime_type))
         except Exception as error:
             logger.error(f"Error extracting text from file {file_id}: {error}")
             return None
 
-    def _extract_pdf(self, file_stream):
-        """Extract text from PDF."""
-        reader = pypdf.PdfReader(file_stream)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
-        return text
-
-    def _extract_word(self, file_stream):
-        """Extract text from Word documents."""
-        doc = docx.Document(file_stream)
-        return "\n".join([paragraph.text for paragraph in doc.paragraphs])
-
-    def _extract_excel(self, file_stream):
-        """Extract text from Excel files."""
-        df = pd.read_excel(file_stream)
-        return df.to_string()
-
-    def _extract_powerpoint(self, file_stream):
-        """Extract text from PowerPoint files."""
-        from pptx import Presentation
-        prs = Presentation(file_stream)
-        text = ""
-        for slide in prs.slides:
-            for shape in slide.shapes:
-                if hasattr(shape, "text"):
-                    text += shape.text + "\n"
-        return text
-
-    def _extract_xml(self, file_stream):
-        """Extract text from XML files."""
-        tree = ET.parse(file_stream)
-        return ET.tostring(tree.getroot(), encoding='unicode', method='text')
-
-    def _extract_html(self, file_stream):
-        """Extract text from HTML files."""
-        soup = BeautifulSoup(file_stream, 'html.parser')
-        return soup.get_text()
+    def extract_bytes(self, data, mime_type):
+        """Extract text from a file's raw bytes based on its mime type."""
+        return self.join_text(self.iter_text(io.BytesIO(data), mime_type))
+
+    @staticmethod
+    def join_text(pieces):
+        pieces = list(pieces) if pieces is not None else None
+        return ''.join(pieces) if pieces else None
+
+    def iter_text(self, file_stream, mime_type):
+        """
+        Yield a document's text in pieces (pages, slides, row blocks, ...).
 
+        Returns None for unsupported mime types. Parsers come from the
+        ``data_extraction.extractors`` registry.
+        """
+        return extractors.iter_text(file_stream, mime_type)
 
 if __name__ == '__main__':
     load_dotenv()
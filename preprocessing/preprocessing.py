@@ -1,17 +1,28 @@
 import os
+import time
+import uuid
 import faiss
 import numpy as np
 import sys
-import json
-from openai import OpenAI
 from dotenv import load_dotenv
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from data_extraction.gdrive_extraction import GoogleDriveClient
-from dotenv import load_dotenv
+from rag_pipeline.embeddings import (BatchEmbedder, OpenAIEmbeddingBackend, ScheduledEmbeddingBackend,
+                                     EMBEDDING_DIMENSION)
+from rag_pipeline.rate_limit import RequestScheduler
+from rag_pipeline.ingest_pipeline import IngestPipeline
+from rag_pipeline.manifest import IndexManifest
+from rag_pipeline.embedding_cache import EmbeddingCache, CachedEmbeddingBackend
+from rag_pipeline.index_factory import IndexBuilder, default_params, load_params, pending_path
+from rag_pipeline.metadata_store import MetadataStore
+from rag_pipeline.lexical_index import LexicalIndex
+from rag_pipeline.sharding import in_partition
+from rag_pipeline.chunking import iter_chunks, get_token_counter
+from data_extraction.extraction_pool import ExtractionPool
+from rag_pipeline import metrics
 from googleapiclient.errors import HttpError
 import logging
 
@@ -19,23 +30,132 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class Preprocessor:
-    def __init__(self, faiss_index_path):
+    def __init__(self, faiss_index_path, embedding_backend=None, batch_size=128,
+                 max_batch_tokens=8000, max_in_flight=4, drive_client=None,
+                 download_workers=4, extract_workers=2, queue_size=32, embedding_cache=None,
+                 use_embedding_cache=True, index_kind='auto', index_params=None, index_storage='float32',
+                 chunk_tokens=256, chunk_overlap_tokens=32, memory_budget_bytes=None,
+                 extraction_processes=0, extraction_timeout=120.0, checkpoint_chunks=20000,
+                 checkpoint_seconds=300.0, embedding_scheduler=None, drive_scheduler=None):
         load_dotenv()
-        service_account_file = os.getenv("SERVICE_ACCOUNT_FILE")
-        scopes = os.getenv("SCOPES").split(',')
-        self.client = GoogleDriveClient(service_account_file, scopes)
+        # Rate limits, retries and concurrency of embedding and Drive requests; pass a
+        # RequestScheduler with requests/tokens per minute to stay within a known quota
+        self.embedding_scheduler = embedding_scheduler or RequestScheduler(max_concurrency=max_in_flight,
+                                                                           name='embeddings')
+        self.drive_scheduler = drive_scheduler or RequestScheduler(max_concurrency=download_workers + 1,
+                                                                   name='drive')
+        # Drive is authenticated by the first call that lists or downloads files
+        self._client = drive_client
+        if self._client is not None and getattr(self._client, 'scheduler', None) is None:
+            self._client.scheduler = self.drive_scheduler
+        self.max_in_memory_bytes = None
         self.faiss_index_path = faiss_index_path
-        self.index = self.load_or_create_faiss_index()
-        self.current_index = 0
-        self.metadata = {}
+        self.manifest = IndexManifest(IndexManifest.path_for(faiss_index_path))
+        self.index_kind = index_kind
+        self.index_params = index_params or {}
+        self.index_storage = index_storage
+        self.metadata = self.load_metadata()
+        # BM25 index over the same chunks, for hybrid retrieval in FaissQuery
+        self.lexical = LexicalIndex.for_index(faiss_index_path)
+        self.index_builder = self.load_or_create_faiss_index()
+        self.discard_uncommitted()
+        if len(self.metadata) and not len(self.lexical):
+            self.rebuild_lexical_index()
+        # The scheduler retries failed requests, so the OpenAI client does not retry them itself
+        backend = ScheduledEmbeddingBackend(embedding_backend or OpenAIEmbeddingBackend(max_retries=0),
+                                            self.embedding_scheduler)
+        self.embedding_cache = None
+        if use_embedding_cache:
+            # Shared with FaissQuery; repeated chunks are only ever embedded once per model
+            self.embedding_cache = embedding_cache or EmbeddingCache.for_index(faiss_index_path)
+            backend = CachedEmbeddingBackend(backend, self.embedding_cache)
+        # Chunks are packed into multi-input embedding requests, several in flight at once
+        self.embedder = BatchEmbedder(backend,
+                                      batch_size=batch_size,
+                                      max_batch_tokens=max_batch_tokens,
+                                      max_in_flight=max_in_flight)
+        # Chunks are sized in the embedding model's tokens
+        self.chunk_tokens = chunk_tokens
+        self.chunk_overlap_tokens = chunk_overlap_tokens
+        self.count_tokens = get_token_counter(self.embedder.model)
+        self.download_workers = download_workers
+        self.extract_workers = extract_workers
+        # Optional process pool for the CPU-bound parsers; each extraction thread drives one process
+        self.extraction_processes = extraction_processes
+        self.extraction_timeout = extraction_timeout
+        self.extraction_pool = None
+        if extraction_processes:
+            self.extract_workers = max(extract_workers, extraction_processes)
+        self.queue_size = queue_size
+        self.stage_stats = []
+        # A checkpoint is written after this many stored chunks or seconds, whichever comes first
+        self.checkpoint_chunks = checkpoint_chunks
+        self.checkpoint_seconds = checkpoint_seconds
+        if memory_budget_bytes:
+            # Every queued or in-progress download may hold up to its spool size in RAM
+            slots = download_workers + extract_workers + queue_size
+            self.max_in_memory_bytes = max(1024 * 1024, memory_budget_bytes // slots)
+            if self._client is not None:
+                self._client.max_in_memory_bytes = self.max_in_memory_bytes
+
+    @property
+    def client(self):
+        if self._client is None:
+            options = {'max_in_memory_bytes': self.max_in_memory_bytes} if self.max_in_memory_bytes else {}
+            self._client = GoogleDriveClient.from_env(scheduler=self.drive_scheduler, **options)
+        return self._client
 
     def load_or_create_faiss_index(self):
         if os.path.exists(self.faiss_index_path):
             logger.info("Loading existing FAISS index from %s", self.faiss_index_path)
-            return faiss.read_index(self.faiss_index_path)
-        else:
-            logger.info("Creating new FAISS index")
-            return faiss.IndexFlatL2(1536)  # OpenAI's text-embedding-ada-002 outputs 1536-dimensional vectors
+            index = faiss.read_index(self.faiss_index_path)
+            if isinstance(index, faiss.IndexIDMap2) and os.path.exists(self.manifest.path):
+                return IndexBuilder(load_params(self.faiss_index_path), index)
+            # Indexes written before the manifest existed use positional IDs that
+            # cannot be mapped back to files, so they are rebuilt once
+            logger.warning("Index at %s has no manifest; rebuilding it", self.faiss_index_path)
+        elif os.path.exists(pending_path(self.faiss_index_path)) and os.path.exists(self.manifest.path):
+            # An interrupted run checkpointed before it had enough vectors to train the index
+            logger.info("Resuming untrained FAISS index from %s", pending_path(self.faiss_index_path))
+            return IndexBuilder.load_pending(self.faiss_index_path)
+        # A new index starts from an empty manifest and no metadata
+        self.manifest.files, self.manifest.next_id = {}, 0
+        self.metadata.clear()
+        self.lexical.clear()
+        logger.info("Creating new %s FAISS index", self.index_kind)
+        # Trainable index types are built once enough vectors have arrived
+        params = dict(default_params(self.index_kind, dimension=EMBEDDING_DIMENSION, storage=self.index_storage),
+                      **self.index_params)
+        # A fresh build ID invalidates answers cached against the previous index
+        params['build_id'] = uuid.uuid4().hex
+        return IndexBuilder(params)
+
+    def discard_uncommitted(self):
+        # Anything with an ID the manifest has not allocated was stored after the
+        # last checkpoint of an interrupted run; the files it came from are indexed again
+        start = self.manifest.next_id
+        removed = self.index_builder.remove_ids_from(start)
+        ids = self.metadata.ids_from(start)
+        if not removed and not ids:
+            return
+        logger.warning("Discarding %d vectors stored after the last checkpoint", max(removed, len(ids)))
+        records = self.metadata.get_many(ids)
+        self.lexical.delete_many((i, record['text']) for i, record in zip(ids, records) if record)
+        self.metadata.delete_ids(ids)
+        self.save_metadata()
+
+    @property
+    def index(self):
+        return self.index_builder.index
+
+    def load_metadata(self):
+        # Opens the SQLite store without reading it; a legacy JSON file is migrated once
+        return MetadataStore.for_index(self.faiss_index_path)
+
+    def rebuild_lexical_index(self):
+        # Indexes built before the lexical index existed are backfilled from the stored chunk text
+        logger.info("Building lexical index from %d stored chunks", len(self.metadata))
+        self.lexical.rebuild(self.metadata.iter_texts())
 
     def preprocess_file(self, content):
         # Convert the content to a vector using OpenAI's API
@@ -43,84 +163,220 @@ class Preprocessor:
         return vector
 
     def text_to_vector(self, text):
-        # Use OpenAI API to get the embeddings
-        response = client.embeddings.create(input=text, model="text-embedding-ada-002")
-        vector = response.data[0].embedding
-        return vector
+        # Single-text embedding; run() embeds in batches instead
+        return self.embedder.embed_batch([text])[0]
 
-    def chunk_text(self, text, chunk_size=1024):
-        # Split text into chunks of specified size
-        print(len([text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]))
-        return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+    def chunk_text(self, text):
+        # Lazily split text (or an iterable of text pieces) on paragraph/sentence boundaries
+        return iter_chunks(text, max_tokens=self.chunk_tokens, overlap_tokens=self.chunk_overlap_tokens,
+                           count_tokens=self.count_tokens)
 
     def store_in_faiss(self, vector):
-        self.index.add(np.array([vector]))
+        ids = self.manifest.allocate_ids(1)
+        self.index_builder.add_with_ids(np.array([vector], dtype='float32'), np.array(ids, dtype='int64'))
+        return ids[0]
+
+    def store_batch_in_faiss(self, vectors):
+        # One bulk add per embedding batch
+        ids = self.manifest.allocate_ids(len(vectors))
+        self.index_builder.add_with_ids(vectors, np.array(ids, dtype='int64'))
+        return ids
+
+    def remove_vectors(self, ids):
+        if not ids:
+            return
+        self.index_builder.remove_ids(np.array(ids, dtype='int64'))
+        # The lexical index finds a chunk's postings from its text, so it goes before the metadata
+        records = self.metadata.get_many(ids)
+        self.lexical.delete_many((i, record['text']) for i, record in zip(ids, records) if record)
+        self.metadata.delete_ids(ids)
 
     def save_faiss_index(self):
-        faiss.write_index(self.index, self.faiss_index_path)
+        # Build parameters are persisted so FaissQuery can tune its search
+        self.index_builder.finish()
+        self.index_builder.save(self.faiss_index_path)
 
     def handle_file(self, file_id, mime_type):
         try:
-            if mime_type == 'application/pdf':
-                content = self.client.get_pdf_text_content(file_id)
-            elif mime_type.startswith('application/vnd.google-apps'):
-                # Handle Google Docs Editors files by exporting them
-                content = self.client.export_file(file_id, mime_type)
-            else:
-                # Handle other file types if necessary
-                content = self.client.get_file_content(file_id)
-            return content
+            file_stream, content_mime_type = self.client.fetch_file(file_id, mime_type)
+            with file_stream:
+                return self.client.join_text(self.client.iter_text(file_stream, content_mime_type))
         except HttpError as error:
             logger.error("An error occurred while handling file %s: %s", file_id, error)
             return None
 
+    def download_file(self, file):
+        # Download stage: a spooled file plus the mime type it should be parsed as
+        return self.client.fetch_file(file['id'], file['mimeType'])
+
+    def extract_chunks(self, file, payload):
+        # Extraction stage: parse the download piece by piece and chunk it as it streams
+        file_stream, mime_type = payload
+        produced = 0
+        with file_stream:
+            if self.extraction_pool is not None:
+                chunks = self.extraction_pool.extract(file_stream, mime_type)
+            else:
+                pieces = self.client.iter_text(file_stream, mime_type)
+                chunks = self.chunk_text(pieces) if pieces is not None else ()
+            for chunk in chunks:
+                produced += 1
+                yield chunk
+        # All of the file's chunks are queued; it is complete once as many are stored
+        self._extracted[file['id']] = produced
+
+    def store_batch(self, batch, vectors):
+        # Store the batch's vectors first, then its metadata under the same IDs
+        with metrics.span('store_batch'):
+            self._store_batch(batch, vectors)
+        metrics.inc('ingest_chunks_stored', len(batch))
+        self._since_checkpoint += len(batch)
+        if self.checkpoint_due():
+            self.checkpoint()
+
+    def _store_batch(self, batch, vectors):
+        ids = self.store_batch_in_faiss(vectors)
+        records = []
+        for vector_id, (chunk, file) in zip(ids, batch):
+            if file['id'] not in self._refreshed:
+                self._refreshed.add(file['id'])
+                self.manifest.reset_file(file, root=self._root)
+            self.manifest.add_ids(file['id'], [vector_id])
+            self._stored[file['id']] = self._stored.get(file['id'], 0) + 1
+            records.append((vector_id, {
+                'text': chunk.text,
+                'file_id': file['id'],
+                'mime_type': file['mimeType'],
+                'start': chunk.start,
+                'end': chunk.end
+            }))
+        self.metadata.add_many(records)
+        self.lexical.add_many((vector_id, record['text']) for vector_id, record in records)
+
     def save_metadata(self):
-        metadata_path = os.path.splitext(self.faiss_index_path)[0] + '_metadata.json'
-        with open(metadata_path, 'w') as f:
-            # Convert integer keys to strings for JSON serialization
-            metadata_str_keys = {str(k): v for k, v in self.metadata.items()}
-            json.dump(metadata_str_keys, f)
-
-    def run(self):
-        files = self.client.list_files()
+        self.metadata.commit()
+        self.lexical.commit()
+
+    def checkpoint_due(self):
+        if self.checkpoint_chunks and self._since_checkpoint >= self.checkpoint_chunks:
+            return True
+        return bool(self.checkpoint_seconds) and time.monotonic() - self._last_checkpoint >= self.checkpoint_seconds
+
+    def checkpoint(self):
+        """
+        Make everything stored so far durable, so an interrupted run resumes from here.
+
+        Files whose chunks have all been stored are committed: the vectors they
+        replace are removed and their manifest entries become final. Files still
+        in progress are recorded as incomplete, so a restarted run indexes them
+        again. The index, metadata and lexical index are written first and the
+        manifest last; a crash before the manifest is replaced leaves the
+        previous checkpoint in force, and whatever was stored after it is
+        discarded on startup.
+        """
+        with metrics.span('ingest_checkpoint'):
+            committed = [f for f, n in self._stored.items() if self._extracted.get(f) == n]
+            self.remove_vectors([vector_id for file_id in committed for vector_id in self._stale.get(file_id, [])])
+            for file_id in committed:
+                if self._stale.get(file_id):
+                    self._stale[file_id] = []
+                del self._stored[file_id], self._extracted[file_id]
+            incomplete = {file_id: self._stale.get(file_id, []) for file_id in self._stored}
+            self.index_builder.save(self.faiss_index_path)
+            self.save_metadata()
+            self.manifest.save(incomplete)
+        self._since_checkpoint = 0
+        self._last_checkpoint = time.monotonic()
+        metrics.inc('ingest_checkpoints')
+        logger.info("Checkpoint: %d vectors stored, %d files in progress", self.index_builder.ntotal,
+                    len(incomplete))
+
+    def changed_files(self, files, stale, seen, partition=None):
+        """Yield only new or changed files, remembering the vectors they replace."""
         for file in files:
-            try:
-                content = self.handle_file(file['id'], file['mimeType'])
-                if not content:
-                    continue
-                
-                chunks = self.chunk_text(content)
-                for chunk in chunks:
-                    try:
-                        # Process and store both vector and metadata atomically
-                        vector = self.preprocess_file(chunk)
-                        if vector is None:
-                            continue
-                            
-                        # Try storing in FAISS first
-                        self.store_in_faiss(vector)
-                        
-                        # If FAISS storage succeeds, store metadata
-                        self.metadata[self.current_index] = {
-                            'text': chunk,
-                            'file_id': file['id'],
-                            'mime_type': file['mimeType']
-                        }
-                        self.current_index += 1
-                        
-                    except Exception as e:
-                        logger.error(f"Failed to process chunk from file {file['id']}: {str(e)}")
-                        # Skip to next chunk if either storage fails
-                        continue
-                        
-            except Exception as e:
-                logger.error(f"Failed to process file {file['id']}: {str(e)}")
+            if not in_partition(file['id'], partition):
                 continue
-                
-        # Save both indices only if we have processed at least one file
-        if self.current_index > 0:
-            self.save_faiss_index()
-            self.save_metadata()
+            seen.add(file['id'])
+            if self.manifest.is_unchanged(file):
+                continue
+            stale[file['id']] = self.manifest.ids_of(file['id'])
+            yield file
+        # Deletions are only detected from a listing that ran to completion
+        seen.add(None)
+
+    def run(self, folder_id=None, partition=None):
+        """
+        Index new and changed files under ``folder_id`` and drop deleted ones.
+
+        ``partition`` is an ``(index, count)`` pair restricting the run to one
+        hash partition of the folder, as used for size-based shards.
+        """
+        self._root = folder_id
+        self._refreshed = set()
+        stale, seen = {}, set()
+        # Checkpoint bookkeeping: chunks extracted and stored per file not yet committed
+        self._stale, self._extracted, self._stored = stale, {}, {}
+        self._since_checkpoint, self._last_checkpoint = 0, time.monotonic()
+        # Listing is streamed, so downloads start while later pages are still being fetched
+        files = self.changed_files(self.client.iter_files(folder_id=folder_id), stale, seen, partition)
+        pipeline = IngestPipeline(self.download_file, self.extract_chunks, self.embedder, self.store_batch,
+                                  download_workers=self.download_workers,
+                                  extract_workers=self.extract_workers,
+                                  embed_workers=self.embedder.max_in_flight,
+                                  queue_size=self.queue_size,
+                                  text_of=lambda chunk: chunk.text)
+        if self.extraction_processes:
+            self.extraction_pool = ExtractionPool(workers=self.extraction_processes,
+                                                  timeout=self.extraction_timeout,
+                                                  chunk_options={'max_tokens': self.chunk_tokens,
+                                                                 'overlap_tokens': self.chunk_overlap_tokens,
+                                                                 'model': self.embedder.model})
+        try:
+            with metrics.span('ingest_pipeline'):
+                self.stage_stats = pipeline.run(files)
+        finally:
+            if self.extraction_pool is not None:
+                self.extraction_pool.close()
+                self.extraction_pool = None
+        for stats in self.stage_stats:
+            logger.info("Stage %(stage)s: %(items_in)d in, %(items_out)d out, %(errors)d errors, "
+                        "%(throughput_per_second).2f/s", stats)
+
+        # Drop the old vectors of changed files (those committed by a checkpoint
+        # are already gone); files that produced no new vectors are forgotten so
+        # they are retried on the next run. IDs are removed in one call, as an
+        # HNSW index is rebuilt to remove anything
+        removed = [vector_id for old_ids in stale.values() for vector_id in old_ids]
+        for file_id in stale:
+            if file_id not in self._refreshed:
+                self.manifest.remove(file_id)
+        deleted = []
+        if None in seen:
+            deleted = [file_id for file_id in self.manifest.files_under(folder_id) if file_id not in seen]
+            for file_id in deleted:
+                removed.extend(self.manifest.remove(file_id))
+        self.remove_vectors(removed)
+        # Files that lost chunks to requests that failed even after retries, or
+        # whose extraction failed partway through, are kept without a checksum,
+        # so the next run indexes them again
+        incomplete = {file_id: [] for file_id, stored in self._stored.items()
+                      if self._extracted.get(file_id) != stored}
+        if incomplete:
+            logger.warning("%d files were not fully embedded; they will be indexed again on the next run",
+                           len(incomplete))
+        logger.info("Re-indexed %d files, removed %d deleted files", len(stale), len(deleted))
+        metrics.inc('ingest_files_reindexed', len(stale))
+        metrics.inc('ingest_files_deleted', len(deleted))
+        metrics.inc('ingest_files_incomplete', len(incomplete))
+        if self.embedding_cache is not None:
+            logger.info("Embedding cache hit rate: %.1f%%", self.embedding_cache.hit_rate * 100)
+
+        if stale or deleted:
+            with metrics.span('ingest_save'):
+                self.save_faiss_index()
+                self.save_metadata()
+                self.manifest.save(incomplete)
+        metrics.set_gauge('index_vectors', self.index_builder.ntotal)
 
 if __name__ == "__main__":
     faiss_index_path = './vector_store/faiss_index.index'
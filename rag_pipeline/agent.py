@@ -2,9 +2,9 @@ import os
 import logging
 import sys
 from dotenv import load_dotenv
-from openai import OpenAI
 import truststore
 import json
+import numpy as np
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 # Configure logging
@@ -16,6 +16,10 @@ load_dotenv()
 
 # Import the FaissQuery class
 from rag_pipeline.query import FaissQuery
+from rag_pipeline.document_cache import DocumentCache
+from rag_pipeline.answer_cache import AnswerCache
+from rag_pipeline.context_packing import ContextPacker, format_context
+from rag_pipeline import metrics
 
 class RAGAgent:
     """
@@ -23,53 +27,158 @@ class RAGAgent:
     by retrieving relevant documents from a FAISS index and using them as context for LLM responses.
     """
     
-    def __init__(self, faiss_index_path, model="gpt-4o"):
+    def __init__(self, faiss_index_path, model="gpt-4o", fetch_full_documents=False,
+                 document_cache_chars=64 * 1024 * 1024, fetch_workers=4, mmap_index=False,
+                 chat_client=None, embedding_backend=None, drive_client=None, trace_requests=False,
+                 use_answer_cache=False, answer_cache=None, answer_cache_threshold=0.95,
+                 context_tokens=3000, mmr_lambda=0.7, duplicate_threshold=0.95):
         """
         Initialize the RAG Agent.
         
         Args:
             faiss_index_path (str): Path to the FAISS index file
             model (str): The OpenAI model to use for generating responses
+            fetch_full_documents (bool): Put the start of each source document in the
+                context instead of the matching chunk; requires downloads from Drive
+            document_cache_chars (int): Size bound of the fetched-document cache
+            fetch_workers (int): Concurrent document fetches
+            mmap_index (bool): Memory-map the index read-only so startup time does not
+                depend on its size and worker processes share its pages
+            chat_client: OpenAI-compatible client for completions, e.g. a FakeChatClient
+            embedding_backend: Query embedding backend passed to FaissQuery
+            drive_client (GoogleDriveClient): Drive client passed to FaissQuery
+            trace_requests (bool): Record a per-stage timing breakdown of every
+                answer in ``last_trace`` and log it at debug level
+            use_answer_cache (bool): Reuse the answer to a near-identical earlier
+                question when it retrieves the same chunks
+            answer_cache (AnswerCache): Cache to use instead of the one next to the index
+            answer_cache_threshold (float): Cosine similarity at which two questions
+                count as the same for the default answer cache
+            context_tokens (int): Token budget of the retrieved context; None pastes
+                every result as before, without deduplication or merging
+            mmr_lambda (float): Relevance versus diversity trade-off when choosing
+                what fits the budget; 1.0 keeps the retrieval order
+            duplicate_threshold (float): Cosine similarity at which two retrieved
+                chunks count as duplicates
         """
-        # Initialize OpenAI client
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        # The OpenAI client is created when the first answer needs it
+        self._client = chat_client
         self.model = model
         
         # Initialize the FAISS query object
-        self.faiss_query = FaissQuery(faiss_index_path)
+        self.faiss_query = FaissQuery(faiss_index_path, embedding_backend=embedding_backend, mmap=mmap_index,
+                                      drive_client=drive_client)
+
+        # Full documents are only fetched on request, through a local LRU cache
+        self.fetch_full_documents = fetch_full_documents
+        self.document_cache = None
+        if fetch_full_documents:
+            self.document_cache = DocumentCache(self.faiss_query.get_file_content,
+                                                max_chars=document_cache_chars,
+                                                max_workers=fetch_workers)
         
+        self.trace_requests = trace_requests
+        self.last_trace = None
+
+        # Answers are cached per index build, so a rebuilt index starts with an empty cache
+        self.answer_cache = None
+        if use_answer_cache or answer_cache is not None:
+            self.answer_cache = answer_cache or AnswerCache.for_index(faiss_index_path,
+                                                                      index_version=self.faiss_query.index_version,
+                                                                      threshold=answer_cache_threshold)
+
+        # Context is packed to a token budget, deduplicated and merged per document
+        self.context_packer = None
+        if context_tokens is not None:
+            self.context_packer = ContextPacker(max_tokens=context_tokens, model=model, mmr_lambda=mmr_lambda,
+                                                duplicate_threshold=duplicate_threshold)
+        self.last_context_report = None
+
         # Inject truststore for SSL certificate handling
         truststore.inject_into_ssl()
     
-    def _format_context(self, results, distances):
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self._create_chat_client()
+        return self._client
+
+    def _create_chat_client(self):
+        from openai import OpenAI
+        return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+    def _format_context(self, results, distances, vector=None):
         """
         Format the retrieved documents into a context string for the LLM.
         
+        Uses the chunk text stored in the metadata, so no document is downloaded
+        unless the agent was created with ``fetch_full_documents=True``. With a
+        context packer, near-duplicates are dropped, overlapping chunks of a
+        document are merged and the rest is fitted to the token budget; the
+        outcome is kept in ``last_context_report``.
+        
         Args:
             results (list): List of document metadata and content
             distances (list): List of similarity scores
+            vector (array-like): The question's embedding, used to diversify the context
             
         Returns:
             str: Formatted context string
         """
-        context = "Here are the most relevant documents to help answer the question:\n\n"
-        
-        for i, (result, distance) in enumerate(zip(results, distances)):
-            # Get file content if available
-            file_id = result.get('file_id')
-            mime_type = result.get('mime_type')
-            
-            if file_id and mime_type:
-                file_content = self.faiss_query.get_file_content(file_id, mime_type)
-                if file_content:
-                    # Add document metadata and content to context
-                    context += f"Document {i+1} (Relevance: {1.0 - distance:.2f}):\n"
-                    context += f"Title: {result.get('title', 'Unknown')}\n"
-                    context += f"Type: {mime_type}\n"
-                    context += f"Content: {file_content[:1000]}...\n\n"  # Truncate long content
-        
+        if self.fetch_full_documents:
+            # Fetch every missing document at once instead of one after another
+            keys = [(result.get('file_id'), result.get('mime_type')) for result in results]
+            keys = [key for key in keys if all(key)]
+            documents = dict(zip(keys, self.document_cache.get_many(keys)))
+
+        passages = []
+        for result, distance in zip(results, distances):
+            passage = dict(result, distance=distance)
+            if self.fetch_full_documents:
+                file_content = documents.get((result.get('file_id'), result.get('mime_type')))
+                passage['text'] = f"{file_content[:1000]}..." if file_content else None  # Truncate long content
+                # The start of a document is not the chunk's span, so it is never merged
+                passage['start'] = passage['end'] = None
+            passages.append(passage)
+
+        if self.context_packer is None:
+            return format_context([passage for passage in passages if passage.get('text')])
+        vectors = self.faiss_query.vectors_of(results) if vector is not None and results else None
+        context, self.last_context_report = self.context_packer.pack(passages, query_vector=vector, vectors=vectors)
         return context
     
+    def retrieve(self, question, k=5, vector=None):
+        """Return ``(distances, results)`` for the ``k`` chunks most relevant to ``question``."""
+        results, _ = self._search(question, k, vector=vector)
+        return self.faiss_query.distances_of(results), results
+
+    def _search(self, question, k, vector=None):
+        # Returns the results and the question's vector, embedded by the search itself
+        vectors = None if vector is None else np.asarray(vector, dtype='float32').reshape(1, -1)
+        results, vectors = self.faiss_query.query_many([question], k=k, vectors=vectors, return_vectors=True)
+        return results[0], vectors[0]
+
+    def _retrieve_for_answer(self, question, k):
+        # The vector the search embedded is reused by the answer cache and context packing
+        results, vector = self._search(question, k)
+        cached = None
+        if self.answer_cache is not None:
+            cached = self.answer_cache.get(self.model, vector, [result['id'] for result in results])
+        return self.faiss_query.distances_of(results), results, vector, cached
+
+    def _cache_answer(self, vector, results, answer):
+        if vector is not None and self.answer_cache is not None:
+            self.answer_cache.put(self.model, vector, [result['id'] for result in results], answer)
+
+    def _build_prompt(self, question, context):
+        return [
+            {"role": "system", "content": "You are a helpful assistant that answers questions based on the provided context. "
+                                         "If the context doesn't contain relevant information to answer the question, "
+                                         "acknowledge that and provide a general response based on your knowledge. "
+                                         "Always cite your sources when using information from the context."},
+            {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {question}\n\nPlease provide a comprehensive answer based on the context provided."}
+        ]
+    
     def answer_question(self, question, k=5, temperature=0.7):
         """
         Answer a user question using RAG.
@@ -82,33 +191,49 @@ class RAGAgent:
         Returns:
             str: The agent's response
         """
+        if not self.trace_requests:
+            return self._answer(question, k, temperature)
+        with metrics.trace('answer') as trace:
+            answer = self._answer(question, k, temperature)
+        self.last_trace = trace.as_dict()
+        logger.debug("Answer trace: %s", json.dumps(trace.breakdown()))
+        return answer
+
+    def _answer(self, question, k, temperature):
         try:
             # Retrieve relevant documents
-            distances, results = self.faiss_query.query(question, k=k)
+            with metrics.span('retrieve'):
+                distances, results, vector, cached = self._retrieve_for_answer(question, k)
+            if cached is not None:
+                return cached
             
             # Format context from retrieved documents
-            context = self._format_context(results, distances)
+            with metrics.span('format_context'):
+                context = self._format_context(results, distances, vector)
             
             # Create prompt for the LLM
-            prompt = [
-                {"role": "system", "content": "You are a helpful assistant that answers questions based on the provided context. "
-                                             "If the context doesn't contain relevant information to answer the question, "
-                                             "acknowledge that and provide a general response based on your knowledge. "
-                                             "Always cite your sources when using information from the context."},
-                {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {question}\n\nPlease provide a comprehensive answer based on the context provided."}
-            ]
+            prompt = self._build_prompt(question, context)
             
             # Generate response using OpenAI
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=prompt,
-                temperature=temperature,
-                max_tokens=1000
-            )
+            with metrics.span('chat_completion', model=self.model):
+                response = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=prompt,
+                    temperature=temperature,
+                    max_tokens=1000
+                )
+            usage = getattr(response, 'usage', None)
+            if usage is not None:
+                metrics.inc('chat_prompt_tokens', usage.prompt_tokens, model=self.model)
+                metrics.inc('chat_completion_tokens', usage.completion_tokens, model=self.model)
+            metrics.inc('answers')
             
-            return response.choices[0].message.content
+            answer = response.choices[0].message.content
+            self._cache_answer(vector, results, answer)
+            return answer
             
         except Exception as e:
+            metrics.inc('answer_errors')
             logger.error(f"Error answering question: {e}")
             return f"I encountered an error while trying to answer your question: {str(e)}"
     
@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+import numpy as np
+
+from rag_pipeline import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class AnswerCache:
+    """
+    Cache of generated answers, looked up by question embedding.
+
+    A question hits when its embedding is within ``threshold`` cosine similarity
+    of a cached question's, for the same model, and retrieval returned the same
+    chunk IDs as when the answer was generated, so a changed context never
+    serves a stale answer. Entries expire ``ttl`` seconds after they were
+    written, and beyond ``max_entries`` the least recently used are evicted.
+
+    Answers are stored in SQLite; the question vectors are also kept in memory
+    as one matrix, so a lookup is a single matrix-vector product. The matrix
+    grows by doubling, and hits record their use in memory; the times are
+    written with the next ``put``, so a lookup never writes to disk. Everything is
+    dropped when the cache is opened for a different ``index_version``, i.e.
+    after the index was rebuilt.
+
+    Args:
+        path (str): SQLite database file
+        index_version (str): Identifies the index build the answers came from
+        threshold (float): Minimum cosine similarity of a hit
+        ttl (float): Seconds an answer stays valid; None for no expiry
+        max_entries (int): Upper bound on the cached answers
+    """
+
+    def __init__(self, path, index_version=None, threshold=0.95, ttl=24 * 3600, max_entries=10000):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "id INTEGER PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, chunk_ids TEXT NOT NULL, "
+            "answer TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'index_version'").fetchone()
+        if index_version is not None and (row is None or row[0] != index_version):
+            if row is not None:
+                logger.info("Index changed; clearing %s", path)
+            self._conn.execute("DELETE FROM answers")
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('index_version', ?)", (index_version,))
+        self._conn.commit()
+        self._load()
+
+    @staticmethod
+    def path_for(faiss_index_path):
+        return os.path.splitext(os.path.normpath(faiss_index_path))[0] + '_answers.sqlite'
+
+    @classmethod
+    def for_index(cls, faiss_index_path, index_version=None, **kwargs):
+        return cls(cls.path_for(faiss_index_path), index_version=index_version, **kwargs)
+
+    def _load(self):
+        rows = self._conn.execute("SELECT id, vector FROM answers ORDER BY id").fetchall()
+        self._size = len(rows)
+        self._all_ids = np.array([row[0] for row in rows], dtype='int64')
+        self._matrix = (np.vstack([np.frombuffer(row[1], dtype='float32') for row in rows]) if rows
+                        else np.zeros((0, 0), dtype='float32'))
+        # Last use of entries hit since the last write, by entry ID
+        self._touched = {}
+
+    @property
+    def _ids(self):
+        return self._all_ids[:self._size]
+
+    @property
+    def _vectors(self):
+        return self._matrix[:self._size]
+
+    def _append(self, entry_id, vector):
+        if self._matrix.shape[1] != len(vector):
+            self._size = 0
+            self._all_ids = np.zeros(16, dtype='int64')
+            self._matrix = np.zeros((16, len(vector)), dtype='float32')
+        elif self._size == len(self._matrix):
+            # Capacity doubles, so appending is amortized O(1)
+            capacity = max(16, 2 * self._size)
+            self._all_ids = np.resize(self._all_ids, capacity)
+            matrix = np.zeros((capacity, self._matrix.shape[1]), dtype='float32')
+            matrix[:self._size] = self._vectors
+            self._matrix = matrix
+        self._all_ids[self._size] = entry_id
+        self._matrix[self._size] = vector
+        self._size += 1
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def hit_rate(self):
+        with self._lock:
+            hits, lookups = self.hits, self.hits + self.misses
+        return hits / lookups if lookups else 0.0
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype='float32').ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, model, vector, chunk_ids):
+        """Return the cached answer for a similar question with the same retrieved chunks, or None."""
+        vector = self._normalize(vector)
+        chunk_ids = json.dumps([int(chunk_id) for chunk_id in chunk_ids])
+        with self._lock:
+            answer = None
+            if len(self._ids) and self._vectors.shape[1] == len(vector):
+                similarities = self._vectors @ vector
+                candidates = np.flatnonzero(similarities >= self.threshold)
+                # Closest first; several candidates may share a question but not its chunks
+                for row in candidates[np.argsort(-similarities[candidates])][:8]:
+                    answer = self._lookup(int(self._ids[row]), model, chunk_ids)
+                    if answer is not None:
+                        break
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        metrics.inc('answer_cache_misses' if answer is None else 'answer_cache_hits')
+        return answer
+
+    def _lookup(self, entry_id, model, chunk_ids):
+        row = self._conn.execute("SELECT model, chunk_ids, answer, created FROM answers WHERE id = ?",
+                                 (entry_id,)).fetchone()
+        if row is None or row[0] != model or row[1] != chunk_ids:
+            return None
+        now = time.time()
+        if self.ttl is not None and now - row[3] > self.ttl:
+            # Expired rows are deleted from disk by the next put
+            self._forget([entry_id])
+            return None
+        self._touched[entry_id] = now
+        return row[2]
+
+    def put(self, model, vector, chunk_ids, answer):
+        vector = self._normalize(vector)
+        now = time.time()
+        with self._lock:
+            if len(self._ids) and self._vectors.shape[1] != len(vector):
+                # The embedding model changed dimension; old vectors cannot be compared
+                self._conn.execute("DELETE FROM answers")
+                self._load()
+            self._flush_touched()
+            cursor = self._conn.execute(
+                "INSERT INTO answers (model, vector, chunk_ids, answer, created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (model, vector.tobytes(), json.dumps([int(chunk_id) for chunk_id in chunk_ids]), answer, now, now))
+            self._append(cursor.lastrowid, vector)
+            self._evict(now)
+            self._conn.commit()
+
+    def _flush_touched(self):
+        if self._touched:
+            self._conn.executemany("UPDATE answers SET last_used = ? WHERE id = ?",
+                                   [(used, entry_id) for entry_id, used in self._touched.items()])
+            self._touched = {}
+
+    def _evict(self, now):
+        expired = []
+        if self.ttl is not None:
+            expired = [row[0] for row in self._conn.execute("SELECT id FROM answers WHERE created < ?",
+                                                             (now - self.ttl,))]
+        stored = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        excess = stored - len(expired) - self.max_entries
+        if excess > 0:
+            expired += [row[0] for row in self._conn.execute(
+                "SELECT id FROM answers WHERE created >= ? ORDER BY last_used LIMIT ?",
+                (now - self.ttl if self.ttl is not None else 0, excess))]
+        if expired:
+            self._delete(expired)
+
+    def _delete(self, entry_ids):
+        self._conn.executemany("DELETE FROM answers WHERE id = ?", [(entry_id,) for entry_id in entry_ids])
+        self._forget(entry_ids)
+
+    def _forget(self, entry_ids):
+        # Compacts the in-memory rows in place, keeping the spare capacity
+        keep = np.flatnonzero(~np.isin(self._ids, entry_ids))
+        self._all_ids[:len(keep)] = self._all_ids[keep]
+        self._matrix[:len(keep)] = self._matrix[keep]
+        self._size = len(keep)
+        for entry_id in entry_ids:
+            self._touched.pop(entry_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+            self._load()
+
+    def close(self):
+        with self._lock:
+            self._flush_touched()
+            self._conn.commit()
+            self._conn.close()
@@ -0,0 +1,186 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import contextvars
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from rag_pipeline.agent import RAGAgent
+from rag_pipeline import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRAGAgent(RAGAgent):
+    """
+    Asyncio RAG agent that streams answers token by token.
+
+    Retrieval and document fetches are blocking (FAISS, SQLite, Drive), so they
+    run on a shared thread pool while the event loop keeps streaming other
+    answers; the chat completion is streamed through an async client. One agent
+    serves any number of concurrent questions on one event loop.
+
+    Usage::
+
+        agent = AsyncRAGAgent(faiss_index_path)
+        async for text in agent.stream_answer(question):
+            print(text, end='', flush=True)
+
+    ``answer_question`` keeps the synchronous signature of RAGAgent and runs the
+    streamed answer on its own event loop; within a coroutine, await
+    ``answer_question_async`` instead.
+
+    Args:
+        faiss_index_path (str): Path to the FAISS index file
+        model (str): The OpenAI model to use for generating responses
+        chat_client: Async OpenAI-compatible client, e.g. an AsyncFakeChatClient;
+            defaults to ``AsyncOpenAI``
+        retrieval_workers (int): Threads shared by all in-flight retrievals
+        max_tokens (int): Upper bound on the tokens of each answer
+        **options: Passed to RAGAgent (fetch_full_documents, mmap_index, ...)
+    """
+
+    def __init__(self, faiss_index_path, model="gpt-4o", chat_client=None, retrieval_workers=8, max_tokens=1000,
+                 **options):
+        super().__init__(faiss_index_path, model=model, chat_client=chat_client, **options)
+        self.max_tokens = max_tokens
+        self._executor = ThreadPoolExecutor(max_workers=retrieval_workers, thread_name_prefix='rag-retrieval')
+
+    def _create_chat_client(self):
+        from openai import AsyncOpenAI
+        return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+    async def _run_blocking(self, fn, *args):
+        # The copied context carries the caller's trace into the worker thread
+        call = partial(contextvars.copy_context().run, fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    async def stream_answer(self, question, k=5, temperature=0.7):
+        """
+        Answer a question, yielding the response text as it is generated.
+
+        Args:
+            question (str): The user's question
+            k (int): Number of documents to retrieve
+            temperature (float): Temperature for response generation
+
+        Yields:
+            str: Successive pieces of the answer
+
+        Raises:
+            Exception: Whatever retrieval or the completion raised; pieces already
+                yielded are then a partial answer and are not cached
+        """
+        start = time.perf_counter()
+        try:
+            with metrics.span('retrieve'):
+                distances, results, vector, cached = await self._run_blocking(self._retrieve_for_answer,
+                                                                              question, k)
+            if cached is not None:
+                metrics.observe('answer_first_token', time.perf_counter() - start, model=self.model)
+                yield cached
+                return
+            # Full documents, if enabled, are fetched concurrently by the document cache
+            with metrics.span('format_context'):
+                context = await self._run_blocking(self._format_context, results, distances, vector)
+            prompt = self._build_prompt(question, context)
+            completion_start = time.perf_counter()
+            stream = await self.client.chat.completions.create(
+                model=self.model,
+                messages=prompt,
+                temperature=temperature,
+                max_tokens=self.max_tokens,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            parts = []
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    metrics.inc('chat_prompt_tokens', chunk.usage.prompt_tokens, model=self.model)
+                    metrics.inc('chat_completion_tokens', chunk.usage.completion_tokens, model=self.model)
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                if not parts:
+                    metrics.observe('answer_first_token', time.perf_counter() - start, model=self.model)
+                parts.append(chunk.choices[0].delta.content)
+                yield parts[-1]
+            metrics.observe('chat_completion', time.perf_counter() - completion_start, model=self.model)
+            metrics.inc('answers')
+            if self.answer_cache is not None:
+                await self._run_blocking(self._cache_answer, vector, results, ''.join(parts))
+        except Exception as e:
+            metrics.inc('answer_errors')
+            logger.error(f"Error answering question: {e}")
+            raise
+
+    async def answer_question_async(self, question, k=5, temperature=0.7):
+        """
+        Answer a question and return the whole response; see ``stream_answer``.
+
+        Like ``RAGAgent.answer_question``, an error is returned as the answer
+        instead of raised, and no partial answer is returned with it.
+        """
+        if not self.trace_requests:
+            return await self._collect_answer(question, k, temperature)
+        with metrics.trace('answer') as trace:
+            answer = await self._collect_answer(question, k, temperature)
+        self.last_trace = trace.as_dict()
+        return answer
+
+    async def _collect_answer(self, question, k, temperature):
+        try:
+            return ''.join([text async for text in self.stream_answer(question, k=k, temperature=temperature)])
+        except Exception as e:
+            return f"I encountered an error while trying to answer your question: {str(e)}"
+
+    def answer_question(self, question, k=5, temperature=0.7):
+        """
+        Answer a question from synchronous code, on a new event loop.
+
+        Args:
+            question (str): The user's question
+            k (int): Number of documents to retrieve
+            temperature (float): Temperature for response generation
+
+        Returns:
+            str: The agent's response
+        """
+        return asyncio.run(self.answer_question_async(question, k=k, temperature=temperature))
+
+    async def answer_many(self, questions, k=5, temperature=0.7):
+        """Answer several questions concurrently, returning the answers in order."""
+        return await asyncio.gather(*(self.answer_question_async(question, k=k, temperature=temperature)
+                                      for question in questions))
+
+    async def interactive_session(self):
+        """
+        Run an interactive session, printing each answer as it streams in.
+        """
+        print("RAG Agent initialized. Ask a question or type 'exit' to quit.")
+        while True:
+            question = await asyncio.get_running_loop().run_in_executor(None, input, "\nYour question: ")
+            if question.lower() in ['exit', 'quit', 'bye']:
+                print("Goodbye!")
+                break
+            print("\nAnswer: ", end='', flush=True)
+            try:
+                async for text in self.stream_answer(question):
+                    print(text, end='', flush=True)
+            except Exception as e:
+                print(f"\n[I encountered an error while trying to answer your question: {str(e)}]", end='')
+            print()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    # Path to the FAISS index
+    faiss_index_path = './vector_store/faiss_index.index'
+
+    agent = AsyncRAGAgent(faiss_index_path)
+    asyncio.run(agent.interactive_session())
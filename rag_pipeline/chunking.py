@@ -0,0 +1,222 @@
+import re
+import logging
+from collections import namedtuple
+
+from rag_pipeline.embeddings import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# A chunk of document text and its [start, end) character offsets in the document
+Chunk = namedtuple('Chunk', ['text', 'start', 'end'])
+
+# Ends of sentences, lines and paragraphs; a unit runs up to and including one
+_BOUNDARY = re.compile(r'\n\s*\n\s*|\n\s*|(?<=[.!?])\s+')
+_PARAGRAPH_END = re.compile(r'\n\s*\n\s*$')
+_WORD = re.compile(r'\S+\s*')
+
+_token_counters = {}
+
+
+def get_token_counter(model="text-embedding-ada-002"):
+    """
+    Return a function counting tokens the way ``model`` does.
+
+    Uses tiktoken when it is installed and its encoding can be loaded, and falls
+    back to the ~4 characters per token estimate otherwise.
+    """
+    if model not in _token_counters:
+        try:
+            import tiktoken
+            encoding = tiktoken.encoding_for_model(model)
+            _token_counters[model] = lambda text: len(encoding.encode(text, disallowed_special=()))
+        except Exception as e:
+            logger.info(f"Using estimated token counts for {model}: {str(e)}")
+            _token_counters[model] = estimate_tokens
+    return _token_counters[model]
+
+
+class _Unit:
+    __slots__ = ('text', 'start', 'tokens')
+
+    def __init__(self, text, start, tokens):
+        self.text = text
+        self.start = start
+        self.tokens = tokens
+
+
+def iter_chunks(document, max_tokens=256, overlap_tokens=32, count_tokens=None, max_buffer_chars=1 << 20):
+    """
+    Lazily split a document into chunks on paragraph and sentence boundaries.
+
+    Sentences are packed into chunks of at most ``max_tokens`` tokens, closing a
+    chunk early at a paragraph break once it is half full. Each chunk repeats up
+    to ``overlap_tokens`` of trailing sentences from the previous one. A sentence
+    longer than ``max_tokens`` is split on words, and a single over-long word on
+    characters.
+
+    Args:
+        document (str or iterable): The text, or pieces of it (e.g. pages) in order
+        max_tokens (int): Token limit per chunk
+        overlap_tokens (int): Tokens carried over between consecutive chunks
+        count_tokens (callable): Token counter; defaults to the embedding model's
+        max_buffer_chars (int): Text held without a boundary before forcing a split
+
+    Yields:
+        Chunk: Chunk text with its character offsets in the whole document
+    """
+    count_tokens = count_tokens or get_token_counter()
+    pieces = [document] if isinstance(document, str) else document
+    current, current_tokens = [], 0
+    # Whether ``current`` holds text that has not been emitted yet
+    fresh = False
+
+    def flush():
+        nonlocal current, current_tokens, fresh
+        fresh = False
+        chunk = _make_chunk(current)
+        # Carry trailing units over as overlap, never the whole chunk
+        carried, carried_tokens = [], 0
+        for unit in reversed(current[1:]):
+            if carried_tokens + unit.tokens > overlap_tokens:
+                break
+            carried.insert(0, unit)
+            carried_tokens += unit.tokens
+        current, current_tokens = carried, _count_units(carried, count_tokens)
+        return chunk
+
+    for unit in _iter_units(pieces, count_tokens, max_tokens, max_buffer_chars):
+        tokens = _joined_tokens(current, current_tokens, unit, count_tokens, max_tokens)
+        if current and tokens > max_tokens:
+            chunk = flush()
+            if chunk:
+                yield chunk
+            # Drop overlap that would not leave room for the new unit
+            tokens = _joined_tokens(current, current_tokens, unit, count_tokens, max_tokens)
+            while current and tokens > max_tokens:
+                current.pop(0)
+                current_tokens = _count_units(current, count_tokens)
+                tokens = _joined_tokens(current, current_tokens, unit, count_tokens, max_tokens)
+        current.append(unit)
+        current_tokens = tokens
+        fresh = True
+        if current_tokens >= max_tokens // 2 and _PARAGRAPH_END.search(unit.text):
+            chunk = flush()
+            if chunk:
+                yield chunk
+    # The final chunk may consist only of overlap already emitted
+    if fresh:
+        chunk = _make_chunk(current)
+        if chunk:
+            yield chunk
+
+
+def _count_units(units, count_tokens):
+    return count_tokens(''.join(unit.text for unit in units)) if units else 0
+
+
+def _joined_tokens(units, units_tokens, unit, count_tokens, max_tokens):
+    """
+    Upper bound on the tokens of ``units`` followed by ``unit``.
+
+    Joining two texts adds at most about a token to the sum of their counts, so
+    the sum plus one per join is used while it is within ``max_tokens``; past it,
+    the joined text is counted exactly.
+    """
+    if not units:
+        return unit.tokens
+    bound = units_tokens + unit.tokens + 1
+    if bound <= max_tokens:
+        return bound
+    return count_tokens(''.join(u.text for u in units) + unit.text)
+
+
+def _make_chunk(units):
+    text = ''.join(unit.text for unit in units).rstrip()
+    if not text.strip():
+        return None
+    return Chunk(text, units[0].start, units[0].start + len(text))
+
+
+def _iter_units(pieces, count_tokens, max_tokens, max_buffer_chars):
+    """Yield sentence-level units with absolute offsets, splitting over-long ones."""
+    # ``tail`` is where the buffer's trailing whitespace starts. Text before it
+    # holds no boundary (one would have been split off already), so each piece
+    # is scanned from there rather than from the start of the buffer.
+    buffer, buffer_start, tail = '', 0, 0
+    for piece in pieces:
+        if not piece:
+            continue
+        scan_from, previous_end = tail, len(buffer)
+        buffer += piece
+        tail = len(buffer)
+        while tail > previous_end and buffer[tail - 1].isspace():
+            tail -= 1
+        if tail == previous_end:
+            tail = scan_from
+        # Everything up to the last boundary is complete; the rest waits for more text
+        last_end = 0
+        for match in _BOUNDARY.finditer(buffer, scan_from):
+            if match.end() < len(buffer):
+                last_end = match.end()
+        if not last_end and len(buffer) > max_buffer_chars:
+            last_end = buffer.rfind(' ', 0, max_buffer_chars) + 1 or max_buffer_chars
+        if last_end:
+            yield from _split(buffer[:last_end], buffer_start, count_tokens, max_tokens)
+            buffer, buffer_start = buffer[last_end:], buffer_start + last_end
+            tail = max(0, tail - last_end)
+    if buffer:
+        yield from _split(buffer, buffer_start, count_tokens, max_tokens)
+
+
+def _split(text, offset, count_tokens, max_tokens):
+    start = 0
+    for match in _BOUNDARY.finditer(text):
+        yield from _sized_units(text[start:match.end()], offset + start, count_tokens, max_tokens)
+        start = match.end()
+    if start < len(text):
+        yield from _sized_units(text[start:], offset + start, count_tokens, max_tokens)
+
+
+def _sized_units(text, offset, count_tokens, max_tokens):
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        yield _Unit(text, offset, tokens)
+        return
+    # An over-long sentence is cut into word runs; an over-long word into slices
+    run, run_start, run_tokens = '', 0, 0
+    for match in _WORD.finditer(text):
+        word = match.group()
+        word_tokens = count_tokens(word)
+        if word_tokens > max_tokens:
+            if run:
+                yield _Unit(run, offset + run_start, run_tokens)
+                run, run_tokens = '', 0
+            yield from _slices(word, offset + match.start(), count_tokens, max_tokens)
+            continue
+        tokens = word_tokens
+        if run:
+            tokens = _joined_tokens([_Unit(run, run_start, run_tokens)], run_tokens,
+                                    _Unit(word, match.start(), word_tokens), count_tokens, max_tokens)
+            if tokens > max_tokens:
+                yield _Unit(run, offset + run_start, run_tokens)
+                run, tokens = '', word_tokens
+        if not run:
+            run_start = match.start()
+        run += word
+        run_tokens = tokens
+    if run:
+        yield _Unit(run, offset + run_start, run_tokens)
+
+
+def _slices(word, offset, count_tokens, max_tokens):
+    # Dense text (digits, symbols, other scripts) can take more than a token per
+    # two characters, so a slice is halved until it fits
+    i = 0
+    while i < len(word):
+        step = max_tokens * 2
+        tokens = count_tokens(word[i:i + step])
+        while step > 1 and tokens > max_tokens:
+            step //= 2
+            tokens = count_tokens(word[i:i + step])
+        yield _Unit(word[i:i + step], offset + i, tokens)
+        i += step
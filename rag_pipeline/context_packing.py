@@ -0,0 +1,229 @@
+import re
+import logging
+
+import numpy as np
+
+from rag_pipeline.chunking import get_token_counter
+from rag_pipeline import metrics
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_INTRO = "Here are the most relevant documents to help answer the question:\n\n"
+
+_WHITESPACE = re.compile(r'\s+')
+# A word cut short at the end of a truncated passage
+_LAST_WORD = re.compile(r'\S+$')
+
+
+def format_document(number, passage):
+    """One document of the prompt context, as the agent has always laid it out."""
+    distance = passage.get('distance')
+    # Keyword-only hits from hybrid search have no vector distance
+    relevance = f"{1.0 - distance:.2f}" if distance is not None and not np.isnan(distance) else "keyword match"
+    return (f"Document {number} (Relevance: {relevance}):\n"
+            f"Title: {passage.get('title', 'Unknown')}\n"
+            f"Type: {passage.get('mime_type')}\n"
+            f"Content: {passage['text']}\n\n")
+
+
+def format_context(passages):
+    return CONTEXT_INTRO + ''.join(format_document(i + 1, passage) for i, passage in enumerate(passages))
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype='float32')
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _overlaps(block, passage):
+    # Same document and touching or overlapping character spans
+    return (block['file_id'] == passage.get('file_id') and block['start'] is not None
+            and passage.get('start') is not None
+            and passage['start'] <= block['end'] and block['start'] <= passage['end'])
+
+
+def _join(pieces):
+    """Text of ``(start, end, text)`` spans of one document, sorted and chained, without repeating overlaps."""
+    pieces = sorted(pieces, key=lambda piece: piece[0])
+    start, end, text = pieces[0]
+    for piece_start, piece_end, piece_text in pieces[1:]:
+        if piece_end > end:
+            text += piece_text[end - piece_start:]
+            end = piece_end
+    return start, end, text
+
+
+class ContextPacker:
+    """
+    Builds the prompt context from retrieved chunks within a token budget.
+
+    Exact and near-duplicate chunks (cosine similarity of their vectors at or
+    above ``duplicate_threshold``, or a span contained in another chunk of the
+    same file) are dropped first. The rest are ordered by maximal marginal
+    relevance, trading similarity to the question against similarity to the
+    chunks already chosen, and added in that order while they fit in
+    ``max_tokens``. Chunks of the same document whose spans touch or overlap
+    are merged into one passage, so the overlap between consecutive chunks is
+    paid for once. If not even the first passage fits, it is cut to the budget
+    rather than leaving the context empty.
+
+    Args:
+        max_tokens (int): Token budget of the whole context
+        model (str): Chat model whose tokenizer counts the tokens
+        mmr_lambda (float): 1.0 ranks by relevance only; lower values favour diversity
+        duplicate_threshold (float): Cosine similarity at which two chunks count as duplicates
+    """
+
+    def __init__(self, max_tokens=3000, model="gpt-4o", mmr_lambda=0.7, duplicate_threshold=0.95):
+        self.max_tokens = max_tokens
+        self.mmr_lambda = mmr_lambda
+        self.duplicate_threshold = duplicate_threshold
+        self.model = model
+
+    @property
+    def count_tokens(self):
+        # The tokenizer is loaded by the first context packed, not at agent startup
+        return get_token_counter(self.model)
+
+    def pack(self, passages, query_vector=None, vectors=None):
+        """
+        Choose, merge and format passages for the prompt.
+
+        Args:
+            passages (list): Result dicts, best first, with ``text`` set to the
+                content to show; ``start``/``end`` enable merging
+            query_vector (array-like): The question's embedding
+            vectors (array-like): One embedding per passage; without them (or the
+                question's) passages keep their retrieval order and only exact
+                duplicates are dropped
+
+        Returns:
+            tuple: (context string, report dict). ``tokens_saved`` counts the
+                tokens removed by dropping duplicates and merging overlaps, and
+                ``tokens_dropped`` those left out or cut to fit the budget
+        """
+        keep = [i for i, passage in enumerate(passages) if passage.get('text')]
+        passages = [passages[i] for i in keep]
+        unpacked_tokens = self.count_tokens(format_context(passages))
+        similarity = relevance = None
+        if vectors is not None and query_vector is not None and len(passages):
+            unit = _normalize(np.asarray(vectors, dtype='float32')[keep])
+            similarity = unit @ unit.T
+            relevance = unit @ _normalize(np.asarray(query_vector, dtype='float32').ravel())
+
+        candidates = self._drop_duplicates(passages, similarity)
+        order = self._mmr_order(candidates, relevance, similarity)
+        blocks, used, over_budget, merged, truncated, dropped = [], self.count_tokens(CONTEXT_INTRO), 0, 0, 0, 0
+        for rank, i in enumerate(order):
+            passage = passages[i]
+            joined = [block for block in blocks if _overlaps(block, passage)]
+            block = self._block(passage, rank, joined)
+            block['tokens'] = self.count_tokens(format_document(len(blocks) + 1, block))
+            # A merged passage only costs what it adds to the blocks it replaces; a new
+            # document costs a token more for joining it onto the others
+            added = block['tokens'] - sum(other['tokens'] for other in joined)
+            cost = added + (0 if joined else 1)
+            if used + cost > self.max_tokens and not blocks:
+                cut = self._truncate(block, self.max_tokens - used - 1)
+                if cut is not None:
+                    dropped += block['tokens'] - cut['tokens']
+                    truncated += 1
+                    block = cut
+                    added = block['tokens']
+                    cost = added + 1
+            if used + cost > self.max_tokens:
+                over_budget += 1
+                dropped += added
+                continue
+            blocks = [other for other in blocks if all(other is not j for j in joined)] + [block]
+            merged += len(joined)
+            used += cost
+        # Blocks are listed in the order their best passage was chosen
+        blocks.sort(key=lambda block: block['rank'])
+        context = format_context(blocks)
+        tokens = self.count_tokens(context)
+        report = {
+            'candidates': len(passages),
+            'duplicates': len(passages) - len(candidates),
+            'merged': merged,
+            'over_budget': over_budget,
+            'truncated': truncated,
+            'passages': len(blocks),
+            'tokens': tokens,
+            'unpacked_tokens': unpacked_tokens,
+            'tokens_saved': max(0, unpacked_tokens - tokens - dropped),
+            'tokens_dropped': dropped,
+        }
+        metrics.inc('context_tokens', tokens)
+        metrics.inc('context_tokens_saved', report['tokens_saved'])
+        metrics.inc('context_tokens_dropped', dropped)
+        return context, report
+
+    def _truncate(self, block, budget):
+        # The longest prefix of the block's text, ending at a word, whose document fits ``budget``
+        text = block['text']
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count_tokens(format_document(1, dict(block, text=text[:middle]))) <= budget:
+                low = middle
+            else:
+                high = middle - 1
+        cut = text[:low]
+        if low < len(text) and not text[low].isspace():
+            cut = _LAST_WORD.sub('', cut) or cut
+        cut = cut.rstrip()
+        if not cut:
+            return None
+        block = dict(block, text=cut)
+        if block['start'] is not None:
+            block['end'] = block['start'] + len(cut)
+        block['tokens'] = self.count_tokens(format_document(1, block))
+        return block
+
+    def _block(self, passage, rank, joined):
+        # A passage on its own, or merged with the blocks of its document it touches
+        distances = [distance for distance in [passage.get('distance')] + [other['distance'] for other in joined]
+                     if distance is not None and not np.isnan(distance)]
+        block = {key: passage.get(key) for key in ('file_id', 'mime_type', 'start', 'end', 'text')}
+        block['title'] = passage.get('title', 'Unknown')
+        block['distance'] = min(distances) if distances else None
+        block['rank'] = min([rank] + [other['rank'] for other in joined])
+        if joined:
+            pieces = [(passage['start'], passage['end'], passage['text'])]
+            pieces += [(other['start'], other['end'], other['text']) for other in joined]
+            block['start'], block['end'], block['text'] = _join(pieces)
+        return block
+
+    def _drop_duplicates(self, passages, similarity):
+        kept, seen_texts = [], set()
+        for i, passage in enumerate(passages):
+            text = _WHITESPACE.sub(' ', passage['text']).strip()
+            if text in seen_texts:
+                continue
+            if similarity is not None and any(similarity[i, j] >= self.duplicate_threshold for j in kept):
+                continue
+            # A span inside a chunk already kept from the same file adds nothing
+            if passage.get('start') is not None and any(
+                    passages[j].get('file_id') == passage.get('file_id') and passages[j].get('start') is not None
+                    and passages[j]['start'] <= passage['start'] and passage['end'] <= passages[j]['end']
+                    for j in kept):
+                continue
+            seen_texts.add(text)
+            kept.append(i)
+        return kept
+
+    def _mmr_order(self, candidates, relevance, similarity):
+        if relevance is None:
+            order = list(candidates)
+        else:
+            order, remaining = [], list(candidates)
+            while remaining:
+                if order:
+                    redundancy = similarity[np.ix_(remaining, order)].max(axis=1)
+                else:
+                    redundancy = np.zeros(len(remaining), dtype='float32')
+                scores = self.mmr_lambda * relevance[remaining] - (1 - self.mmr_lambda) * redundancy
+                order.append(remaining.pop(int(np.argmax(scores))))
+        return order
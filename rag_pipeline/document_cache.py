@@ -0,0 +1,82 @@
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentCache:
+    """
+    Size-bounded LRU cache of extracted document text.
+
+    Misses are fetched on a thread pool, and concurrent requests for the same
+    document share one fetch. Documents are evicted least recently used first
+    once the cached text exceeds ``max_chars``.
+
+    Args:
+        fetch (callable): ``fetch(file_id, mime_type) -> str or None``
+        max_chars (int): Upper bound on the total cached text length
+        max_workers (int): Concurrent fetches
+    """
+
+    def __init__(self, fetch, max_chars=64 * 1024 * 1024, max_workers=4):
+        self.fetch = fetch
+        self.max_chars = max_chars
+        self.total_chars = 0
+        self.hits = 0
+        self.misses = 0
+        self._documents = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def get(self, file_id, mime_type):
+        return self.get_many([(file_id, mime_type)])[0]
+
+    def get_many(self, keys):
+        """Return the text for each ``(file_id, mime_type)`` key, fetching misses concurrently."""
+        pending = [self._lookup(key) for key in keys]
+        results = []
+        for item in pending:
+            try:
+                results.append(item.result() if isinstance(item, Future) else item)
+            except Exception as e:
+                logger.error(f"Failed to fetch document: {str(e)}")
+                results.append(None)
+        return results
+
+    def _lookup(self, key):
+        with self._lock:
+            if key in self._documents:
+                self.hits += 1
+                self._documents.move_to_end(key)
+                return self._documents[key]
+            self.misses += 1
+            if key not in self._in_flight:
+                self._in_flight[key] = self._executor.submit(self._fetch, key)
+            return self._in_flight[key]
+
+    def _fetch(self, key):
+        text = None
+        try:
+            text = self.fetch(*key)
+        finally:
+            # Store before clearing the in-flight entry so no caller sees neither
+            with self._lock:
+                if text is not None:
+                    self._store(key, text)
+                self._in_flight.pop(key, None)
+        return text
+
+    def _store(self, key, text):
+        if key in self._documents or len(text) > self.max_chars:
+            return
+        self._documents[key] = text
+        self.total_chars += len(text)
+        while self.total_chars > self.max_chars:
+            _, evicted = self._documents.popitem(last=False)
+            self.total_chars -= len(evicted)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,193 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+import numpy as np
+
+from rag_pipeline import metrics
+from rag_pipeline.sharding import is_sharded
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE = 'embedding_cache.sqlite'
+
+# SQLite limits the number of bound parameters per statement
+_LOOKUP_BATCH = 500
+# Hits' last use is held in memory until this many have piled up or this many seconds passed
+_MAX_TOUCHED = 10000
+_TOUCH_FLUSH_SECONDS = 60.0
+
+
+class EmbeddingCache:
+    """
+    On-disk, content-addressed cache of embedding vectors.
+
+    Entries are keyed by SHA-256 of the model name and the text, and vectors are
+    stored as raw float32 or float16 bytes. When the stored vectors exceed
+    ``max_bytes`` the least recently used entries are evicted. Hits only note
+    their use in memory; the times are written with the next ``put_many``, or
+    once many have piled up or a minute has passed, so lookups rarely write to disk.
+
+    Args:
+        path (str): SQLite database file
+        max_bytes (int): Upper bound on the total size of stored vectors
+        dtype (str): 'float32' or 'float16' storage precision
+    """
+
+    def __init__(self, path, max_bytes=2 * 1024 ** 3, dtype='float32'):
+        if dtype not in ('float32', 'float16'):
+            raise ValueError(f"Unsupported cache dtype: {dtype}")
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.dtype = np.dtype(dtype)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Last use of keys hit since the last write
+        self._touched = {}
+        self._flushed_at = time.monotonic()
+        # Shard ingest processes write to the same cache, so writers may wait on each other
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key BLOB PRIMARY KEY, dtype TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self.total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def path_for(faiss_index_path):
+        """
+        Cache file for an index: next to a plain index file, and at the root of a
+        sharded store for the store and each of its shards, live or staged.
+        """
+        path = os.path.normpath(faiss_index_path)
+        if is_sharded(path):
+            return os.path.join(path, CACHE_FILE)
+        directory = os.path.dirname(path)
+        store = os.path.dirname(directory)
+        return os.path.join(store if directory and is_sharded(store) else directory, CACHE_FILE)
+
+    @classmethod
+    def for_index(cls, faiss_index_path, **kwargs):
+        """The cache shared by everything that reads or writes ``faiss_index_path``."""
+        return cls(cls.path_for(faiss_index_path), **kwargs)
+
+    @staticmethod
+    def key(model, text):
+        return hashlib.sha256(model.encode('utf-8') + b'\0' + text.encode('utf-8')).digest()
+
+    @property
+    def hit_rate(self):
+        with self._lock:
+            hits, lookups = self.hits, self.hits + self.misses
+        return hits / lookups if lookups else 0.0
+
+    def get_many(self, model, texts):
+        """Return a float32 vector for each cached text and None for each miss."""
+        keys = [self.key(model, text) for text in texts]
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), _LOOKUP_BATCH):
+                batch = keys[i:i + _LOOKUP_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT key, dtype, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch).fetchall()
+                for key, dtype, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=dtype).astype('float32')
+            if found:
+                now = time.time()
+                self._touched.update((key, now) for key in found)
+                if (len(self._touched) >= _MAX_TOUCHED
+                        or time.monotonic() - self._flushed_at >= _TOUCH_FLUSH_SECONDS):
+                    self._flush_touched()
+                    self._conn.commit()
+            # Lookups come from several threads (ingest, server, async retrieval)
+            results = [found.get(key) for key in keys]
+            hits = sum(result is not None for result in results)
+            self.hits += hits
+            self.misses += len(results) - hits
+        metrics.inc('embedding_cache_hits', hits)
+        metrics.inc('embedding_cache_misses', len(results) - hits)
+        return results
+
+    def put_many(self, model, texts, vectors):
+        now = time.time()
+        rows = []
+        for text, vector in zip(texts, vectors):
+            blob = np.asarray(vector, dtype=self.dtype).tobytes()
+            rows.append((self.key(model, text), self.dtype.name, blob, now))
+        with self._lock:
+            for key, _, blob, _ in rows:
+                previous = self._conn.execute("SELECT LENGTH(vector) FROM embeddings WHERE key = ?",
+                                              (key,)).fetchone()
+                self.total_bytes += len(blob) - (previous[0] if previous else 0)
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            for key, _, _, _ in rows:
+                self._touched.pop(key, None)
+            self._flush_touched()
+            self._evict()
+            self._conn.commit()
+
+    def _flush_touched(self):
+        self._flushed_at = time.monotonic()
+        if self._touched:
+            self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                   [(used, key) for key, used in self._touched.items()])
+            self._touched = {}
+
+    def _evict(self):
+        # Drop least recently used entries until the cache is back under 90% of its budget
+        if self.total_bytes <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        evicted = 0
+        while self.total_bytes > target:
+            rows = self._conn.execute(
+                "SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used LIMIT ?", (_LOOKUP_BATCH,)).fetchall()
+            if not rows:
+                self.total_bytes = 0
+                break
+            for key, size in rows:
+                if self.total_bytes <= target:
+                    break
+                self._conn.execute("DELETE FROM embeddings WHERE key = ?", (key,))
+                self.total_bytes -= size
+                evicted += 1
+        logger.info("Evicted %d cached embeddings", evicted)
+
+    def close(self):
+        with self._lock:
+            self._flush_touched()
+            self._conn.commit()
+            self._conn.close()
+
+
+class CachedEmbeddingBackend:
+    """Wraps an embedding backend so only texts missing from the cache are sent to it."""
+
+    def __init__(self, backend, cache):
+        self.backend = backend
+        self.cache = cache
+
+    @property
+    def model(self):
+        return self.backend.model
+
+    def embed(self, texts):
+        texts = list(texts)
+        vectors = self.cache.get_many(self.model, texts)
+        # Identical texts within the same request are embedded once
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            fresh = dict(zip(missing, self.backend.embed(missing)))
+            self.cache.put_many(self.model, missing, [fresh[text] for text in missing])
+            vectors = [fresh[text] if vector is None else vector for text, vector in zip(texts, vectors)]
+        return vectors
@@ -0,0 +1,212 @@
+import os
+import time
+import hashlib
+import logging
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from rag_pipeline import metrics
+from rag_pipeline.rate_limit import RequestError, TokenBucket, report_headers
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBEDDING_MODEL = "text-embedding-ada-002"
+EMBEDDING_DIMENSION = 1536  # OpenAI's text-embedding-ada-002 outputs 1536-dimensional vectors
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token) used for request packing."""
+    return max(1, len(text) // 4)
+
+
+class OpenAIEmbeddingBackend:
+    """
+    Embeds a list of texts with a single OpenAI embeddings request.
+
+    ``max_retries`` is the OpenAI client's own retry count; set it to 0 when a
+    RequestScheduler already retries the calls.
+    """
+
+    def __init__(self, client=None, model=DEFAULT_EMBEDDING_MODEL, max_retries=2):
+        self._client = client
+        self.model = model
+        self.max_retries = max_retries
+
+    @property
+    def client(self):
+        # Importing openai and building the client is deferred to the first request
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=self.max_retries)
+        return self._client
+
+    def embed(self, texts):
+        raw = self.client.embeddings.with_raw_response.create(input=list(texts), model=self.model)
+        # Rate-limit headers keep a scheduler in step with the server's budget
+        report_headers(raw.headers)
+        response = raw.parse()
+        # The API may return items out of order; sort by the index it echoes back
+        data = sorted(response.data, key=lambda item: item.index)
+        return [item.embedding for item in data]
+
+
+class FakeEmbeddingBackend:
+    """
+    Deterministic in-process embedding backend for offline runs.
+
+    Each text maps to a unit vector seeded from its SHA-256 digest, so identical
+    text always yields identical vectors.
+
+    With ``requests_per_minute`` or ``tokens_per_minute`` it behaves like a
+    rate-limited API: requests over budget fail with a 429 RequestError carrying
+    ``retry-after-ms``, and every response reports OpenAI-style
+    ``x-ratelimit-*`` headers unless ``rate_limit_headers`` is False, as behind
+    a proxy that strips them.
+    """
+
+    def __init__(self, dimension=EMBEDDING_DIMENSION, model="fake-embedding", latency=0.0,
+                 requests_per_minute=None, tokens_per_minute=None, rate_limit_headers=True):
+        self.dimension = dimension
+        self.model = model
+        self.latency = latency
+        self.calls = 0
+        self.rejected = 0
+        self.request_limit = TokenBucket(requests_per_minute)
+        self.token_limit = TokenBucket(tokens_per_minute)
+        self.rate_limit_headers = rate_limit_headers
+
+    def _admit(self, tokens):
+        admitted = self.request_limit.take(1) and self.token_limit.take(tokens)
+        headers = {}
+        for kind, bucket, amount in (('requests', self.request_limit, 1), ('tokens', self.token_limit, tokens)):
+            if bucket.rate and self.rate_limit_headers:
+                headers[f'x-ratelimit-limit-{kind}'] = str(int(bucket.rate))
+                headers[f'x-ratelimit-remaining-{kind}'] = str(max(0, int(bucket.tokens)))
+                headers[f'x-ratelimit-reset-{kind}'] = f"{int(bucket.seconds_until(bucket.capacity) * 1000)}ms"
+        if not admitted:
+            self.rejected += 1
+            wait = max(self.request_limit.seconds_until(1), self.token_limit.seconds_until(tokens))
+            headers['retry-after-ms'] = str(int(wait * 1000) + 1)
+            raise RequestError("Rate limit exceeded", 429, headers)
+        return headers
+
+    def embed(self, texts):
+        headers = self._admit(sum(estimate_tokens(text) for text in texts))
+        if self.latency:
+            time.sleep(self.latency)
+        self.calls += 1
+        report_headers(headers)
+        vectors = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+            vector = np.random.default_rng(seed).standard_normal(self.dimension).astype('float32')
+            vectors.append(vector / np.linalg.norm(vector))
+        return vectors
+
+
+class ScheduledEmbeddingBackend:
+    """Wraps an embedding backend so its requests are throttled and retried by a RequestScheduler."""
+
+    def __init__(self, backend, scheduler):
+        self.backend = backend
+        self.scheduler = scheduler
+
+    @property
+    def model(self):
+        return getattr(self.backend, 'model', DEFAULT_EMBEDDING_MODEL)
+
+    def embed(self, texts):
+        texts = list(texts)
+        return self.scheduler.call(self.backend.embed, texts, tokens=sum(estimate_tokens(text) for text in texts))
+
+
+class BatchEmbedder:
+    """
+    Packs texts into embedding requests and keeps several requests in flight.
+
+    A batch is closed when it reaches ``batch_size`` texts or when adding the next
+    text would exceed ``max_batch_tokens``. Up to ``max_in_flight`` batches are
+    embedded concurrently, and results are yielded in submission order.
+    """
+
+    def __init__(self, backend, batch_size=128, max_batch_tokens=8000, max_in_flight=4):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_in_flight = max_in_flight
+
+    @property
+    def model(self):
+        return getattr(self.backend, 'model', DEFAULT_EMBEDDING_MODEL)
+
+    def batches(self, items, text_of=lambda item: item):
+        """Group items into lists that respect the batch size and token budget."""
+        batch, batch_tokens = [], 0
+        for item in items:
+            tokens = estimate_tokens(text_of(item))
+            if batch and (len(batch) >= self.batch_size or batch_tokens + tokens > self.max_batch_tokens):
+                yield batch
+                batch, batch_tokens = [], 0
+            batch.append(item)
+            batch_tokens += tokens
+        if batch:
+            yield batch
+
+    def embed_batch(self, texts):
+        """Embed one batch of texts and return a float32 matrix."""
+        with metrics.span('embed_request', model=self.model):
+            vectors = self.backend.embed(texts)
+        metrics.inc('embed_requests', model=self.model)
+        metrics.inc('embed_texts', len(texts), model=self.model)
+        metrics.inc('embed_estimated_tokens', sum(estimate_tokens(text) for text in texts), model=self.model)
+        if len(vectors) != len(texts):
+            raise ValueError(f"Embedding backend returned {len(vectors)} vectors for {len(texts)} texts")
+        return np.asarray(vectors, dtype='float32')
+
+    def embed(self, texts):
+        """Embed an arbitrary number of texts, returning one matrix in input order."""
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype='float32')
+        matrices = []
+        for _, vectors in self.embed_batches(texts):
+            if vectors is None:
+                raise RuntimeError("Embedding request failed")
+            matrices.append(vectors)
+        return np.vstack(matrices)
+
+    def embed_batches(self, items, text_of=lambda item: item, max_in_flight=None):
+        """
+        Embed items batch by batch with bounded concurrency.
+
+        Args:
+            items (iterable): Items to embed, consumed lazily
+            text_of (callable): Returns the text to embed for an item
+            max_in_flight (int): Requests in flight for this call; defaults to ``self.max_in_flight``
+
+        Yields:
+            tuple: (list of items, float32 matrix of their vectors), in input order.
+                The matrix is None if that batch's request failed.
+        """
+        max_in_flight = max_in_flight or self.max_in_flight
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            for batch in self.batches(items, text_of):
+                # Run in a copy of the caller's context so spans reach the caller's trace
+                pending.append((batch, executor.submit(contextvars.copy_context().run, self.embed_batch,
+                                                       [text_of(item) for item in batch])))
+                if len(pending) >= max_in_flight:
+                    yield self._collect(*pending.popleft())
+            while pending:
+                yield self._collect(*pending.popleft())
+
+    def _collect(self, batch, future):
+        # A failed request drops only its own batch; the caller sees None vectors
+        try:
+            return batch, future.result()
+        except Exception as e:
+            logger.error(f"Failed to embed batch of {len(batch)} chunks: {str(e)}")
+            return batch, None
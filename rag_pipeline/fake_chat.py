@@ -0,0 +1,88 @@
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from types import SimpleNamespace
+
+
+class FakeChatClient:
+    """
+    Deterministic in-process stand-in for the OpenAI client's chat completions.
+
+    ``client.chat.completions.create(model=..., messages=...)`` returns a
+    response shaped like the OpenAI one, with a reply of ``response_words``
+    words seeded from the messages, after sleeping ``latency`` seconds. Pass it
+    as ``RAGAgent(chat_client=...)`` to run the agent offline.
+    """
+
+    def __init__(self, latency=0.0, response_words=150):
+        self.latency = latency
+        self.response_words = response_words
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, **kwargs):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        content = self.reply(messages)
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(index=0, message=SimpleNamespace(role='assistant', content=content),
+                                     finish_reason='stop')],
+            usage=self.usage(messages))
+
+    def usage(self, messages):
+        prompt_words = sum(len(message['content'].split()) for message in messages)
+        return SimpleNamespace(prompt_tokens=prompt_words, completion_tokens=self.response_words,
+                               total_tokens=prompt_words + self.response_words)
+
+    def reply(self, messages):
+        digest = hashlib.sha256(repr([message['content'] for message in messages]).encode('utf-8')).digest()
+        rng = random.Random(digest)
+        return ' '.join(f"word{rng.randrange(1000)}" for _ in range(self.response_words))
+
+
+class AsyncFakeChatClient(FakeChatClient):
+    """
+    Asyncio counterpart of FakeChatClient, shaped like ``openai.AsyncOpenAI``.
+
+    ``await client.chat.completions.create(..., stream=True)`` returns an async
+    iterator of chunks with ``choices[0].delta.content``, the first after
+    ``latency`` seconds and each further word after ``token_latency`` seconds.
+    With ``stream_options={'include_usage': True}`` a last chunk carries usage.
+    Waits never block the event loop, so concurrent requests overlap.
+    """
+
+    def __init__(self, latency=0.0, response_words=150, token_latency=0.0):
+        super().__init__(latency=latency, response_words=response_words)
+        self.token_latency = token_latency
+
+    async def create(self, model, messages, stream=False, stream_options=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+        if not stream:
+            await asyncio.sleep(self.latency + self.token_latency * self.response_words)
+            return SimpleNamespace(
+                model=model,
+                choices=[SimpleNamespace(index=0, message=SimpleNamespace(role='assistant',
+                                                                          content=self.reply(messages)),
+                                         finish_reason='stop')],
+                usage=self.usage(messages))
+        include_usage = bool(stream_options and stream_options.get('include_usage'))
+        return self._stream(model, messages, include_usage)
+
+    async def _stream(self, model, messages, include_usage):
+        await asyncio.sleep(self.latency)
+        words = self.reply(messages).split(' ')
+        for i, word in enumerate(words):
+            if i and self.token_latency:
+                await asyncio.sleep(self.token_latency)
+            yield SimpleNamespace(model=model, usage=None, choices=[SimpleNamespace(
+                index=0, delta=SimpleNamespace(content=word if i == 0 else ' ' + word),
+                finish_reason='stop' if i == len(words) - 1 else None)])
+        if include_usage:
+            yield SimpleNamespace(model=model, choices=[], usage=self.usage(messages))
@@ -0,0 +1,488 @@
+import os
+import sys
+import json
+import math
+import time
+import logging
+
+import faiss
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from rag_pipeline.embeddings import EMBEDDING_DIMENSION
+from rag_pipeline.manifest import replace_durably
+
+logger = logging.getLogger(__name__)
+
+INDEX_KINDS = ('auto', 'flat', 'ivf', 'hnsw', 'ivfpq')
+
+# How flat, IVF and HNSW indexes store vectors: full precision, or scalar-quantized
+# to half (fp16) or a quarter (int8) of the memory. IVF-PQ always stores PQ codes.
+STORAGE_TYPES = ('float32', 'fp16', 'int8')
+_SQ_CODES = {'fp16': 'SQfp16', 'int8': 'SQ8'}
+
+# Below this many vectors an exact scan is fast enough and needs no training
+FLAT_MAX_VECTORS = 50_000
+# Above this many vectors full-precision IVF lists no longer fit comfortably in RAM
+IVF_MAX_VECTORS = 2_000_000
+# An 'auto' index is re-planned once the list count suited to its size has grown this much
+REPLAN_NLIST_GROWTH = 2
+# Vectors reconstructed at a time while an index is rebuilt
+_REBUILD_BLOCK = 65536
+
+
+def choose_index_kind(n_vectors):
+    """Pick an index type from the corpus size."""
+    if n_vectors < FLAT_MAX_VECTORS:
+        return 'flat'
+    if n_vectors < IVF_MAX_VECTORS:
+        return 'ivf'
+    return 'ivfpq'
+
+
+def default_params(kind='auto', n_vectors=0, dimension=EMBEDDING_DIMENSION, storage='float32'):
+    """
+    Build parameters for an index of ``kind`` holding about ``n_vectors`` vectors.
+
+    With ``n_vectors`` unknown (0), the kind and list count are decided by
+    IndexBuilder once enough vectors have been buffered, and revised as the
+    index grows. HNSW is never chosen automatically because removing vectors
+    from it means rebuilding its graph, which incremental re-indexing does often.
+    """
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"Unknown index kind {kind!r}; expected one of {INDEX_KINDS}")
+    if storage not in STORAGE_TYPES:
+        raise ValueError(f"Unknown storage type {storage!r}; expected one of {STORAGE_TYPES}")
+    auto = kind == 'auto'
+    if auto and n_vectors:
+        kind = choose_index_kind(n_vectors)
+    # The usual rule of thumb for the number of IVF lists is ~4 * sqrt(N)
+    nlist = int(min(65536, max(16, 4 * math.sqrt(max(n_vectors, 1)))))
+    if n_vectors:
+        # FAISS wants ~39 training points per list; more only slows training down
+        train_size = min(n_vectors, 64 * nlist)
+    else:
+        train_size = FLAT_MAX_VECTORS
+    return {
+        'kind': kind,
+        'auto': auto,
+        'storage': storage,
+        'dimension': dimension,
+        'n_vectors': n_vectors,
+        'nlist': nlist,
+        'hnsw_m': 32,
+        'ef_construction': 200,
+        'pq_m': 64,
+        'pq_nbits': 8,
+        'nprobe': max(1, nlist // 16),
+        'ef_search': 64,
+        'train_size': train_size,
+    }
+
+
+def factory_string(params):
+    kind = params['kind']
+    codes = _SQ_CODES.get(params.get('storage', 'float32'))
+    if kind == 'flat':
+        body = codes or 'Flat'
+    elif kind == 'ivf':
+        body = f"IVF{params['nlist']},{codes or 'Flat'}"
+    elif kind == 'hnsw':
+        body = f"HNSW{params['hnsw_m']}" + (f"_{codes}" if codes else '')
+    elif kind == 'ivfpq':
+        body = f"IVF{params['nlist']},PQ{params['pq_m']}x{params['pq_nbits']}"
+    else:
+        raise ValueError(f"Unknown index kind {kind!r}")
+    # Always ID-mapped so vector IDs match metadata keys
+    return f"IDMap2,{body}"
+
+
+def create_index(params):
+    index = faiss.index_factory(params['dimension'], factory_string(params), faiss.METRIC_L2)
+    if params['kind'] == 'hnsw':
+        faiss.downcast_index(index.index).hnsw.efConstruction = params['ef_construction']
+    return index
+
+
+def params_path(faiss_index_path):
+    return os.path.splitext(faiss_index_path)[0] + '_params.json'
+
+
+def load_params(faiss_index_path):
+    path = params_path(faiss_index_path)
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            return json.load(f)
+    # Indexes built before parameters were persisted are flat
+    return default_params('flat')
+
+
+def save_params(faiss_index_path, params):
+    path = params_path(faiss_index_path)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(params, f, indent=2)
+    replace_durably(tmp_path, path)
+
+
+def pending_path(faiss_index_path):
+    # Vectors checkpointed before the index they belong to was trained
+    return os.path.splitext(faiss_index_path)[0] + '_pending.npz'
+
+
+def load_index(faiss_index_path, params=None, mmap=False):
+    """
+    Read an index, optionally memory-mapped read-only.
+
+    A memory-mapped index loads in time independent of its size, and processes
+    mapping the same file share its pages. FAISS maps the inverted lists of IVF
+    indexes and the code arrays of flat/HNSW indexes through different flags;
+    builds that support neither fall back to a full read.
+    """
+    if not mmap:
+        return faiss.read_index(faiss_index_path)
+    params = params or load_params(faiss_index_path)
+    if params.get('kind') in ('ivf', 'ivfpq'):
+        flag = faiss.IO_FLAG_MMAP
+    else:
+        flag = getattr(faiss, 'IO_FLAG_MMAP_IFC', None)
+    if flag is not None:
+        try:
+            return faiss.read_index(faiss_index_path, flag | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError as e:
+            logger.warning(f"Cannot memory-map {faiss_index_path}, reading it fully: {str(e)}")
+    return faiss.read_index(faiss_index_path)
+
+
+def search_parameters(index, nprobe=None, ef_search=None):
+    """
+    Per-call search parameters for ``index``, or None to use its own settings.
+
+    Unlike ``set_search_params`` these leave the index untouched, so concurrent
+    searches with different overrides do not interfere.
+    """
+    if nprobe is not None and faiss.try_extract_index_ivf(index) is not None:
+        return faiss.SearchParametersIVF(nprobe=int(nprobe))
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if ef_search is not None and isinstance(inner, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=int(ef_search))
+    return None
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """Apply query-time search parameters to whichever index type ``index`` wraps."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and nprobe is not None:
+        ivf.nprobe = nprobe
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexHNSW) and ef_search is not None:
+        inner.hnsw.efSearch = ef_search
+
+
+class IndexBuilder:
+    """
+    Owns the index during ingest and trains it once enough vectors have arrived.
+
+    Indexes that need training (IVF, IVF-PQ) or whose kind is still 'auto' buffer
+    incoming vectors until ``train_size`` of them exist, then train on a random
+    sample and add the buffer. ``finish`` trains on whatever was buffered, so a
+    small corpus with kind 'auto' ends up as a flat index.
+
+    The first plan of an 'auto' index only sees the buffered vectors, so it is
+    revisited as vectors are added: once the corpus calls for another kind, or
+    for at least ``REPLAN_NLIST_GROWTH`` times as many IVF lists, the index is
+    retrained and rebuilt from its own vectors. An IVF-PQ index is not re-planned,
+    as its PQ codes are not the original vectors.
+    """
+
+    def __init__(self, params, index=None):
+        self.params = dict(params)
+        self.index = index
+        self._pending_vectors = []
+        self._pending_ids = []
+        if self.index is None and params['kind'] in ('flat', 'hnsw'):
+            # Neither needs training unless int8-quantized, so vectors go straight in
+            index = create_index(params)
+            if index.is_trained:
+                self.index = index
+
+    @property
+    def ntotal(self):
+        pending = sum(len(ids) for ids in self._pending_ids)
+        return pending + (self.index.ntotal if self.index is not None else 0)
+
+    def add_with_ids(self, vectors, ids):
+        vectors = np.ascontiguousarray(vectors, dtype='float32')
+        ids = np.asarray(ids, dtype='int64')
+        if self.index is not None:
+            self.index.add_with_ids(vectors, ids)
+            self._replan_if_outgrown()
+            return
+        self._pending_vectors.append(vectors)
+        self._pending_ids.append(ids)
+        if self.ntotal >= self.params['train_size']:
+            self._build()
+
+    def remove_ids(self, ids):
+        ids = np.asarray(ids, dtype='int64')
+        if self.index is not None and self._removes_by_refill():
+            self._refill(~np.isin(faiss.vector_to_array(self.index.id_map), ids))
+        elif self.index is not None:
+            self.index.remove_ids(ids)
+        keep = [~np.isin(batch, ids) for batch in self._pending_ids]
+        self._pending_vectors = [v[k] for v, k in zip(self._pending_vectors, keep)]
+        self._pending_ids = [i[k] for i, k in zip(self._pending_ids, keep)]
+
+    @classmethod
+    def load_pending(cls, faiss_index_path):
+        """Resume an untrained build from the vectors its last checkpoint buffered."""
+        builder = cls(load_params(faiss_index_path))
+        with np.load(pending_path(faiss_index_path)) as pending:
+            if len(pending['ids']):
+                builder.add_with_ids(pending['vectors'], pending['ids'])
+        return builder
+
+    def remove_ids_from(self, start):
+        """Remove every vector with an ID of at least ``start``; returns how many there were."""
+        removed = 0
+        if self.index is not None:
+            ids = faiss.vector_to_array(self.index.id_map)
+            if (ids >= start).any() and self._removes_by_refill():
+                removed += self._refill(ids < start)
+            elif (ids >= start).any():
+                removed += self.index.remove_ids(faiss.IDSelectorRange(int(start), 2 ** 63 - 1))
+        keep = [batch < start for batch in self._pending_ids]
+        removed += sum(int((~k).sum()) for k in keep)
+        self._pending_vectors = [v[k] for v, k in zip(self._pending_vectors, keep)]
+        self._pending_ids = [i[k] for i, k in zip(self._pending_ids, keep)]
+        return removed
+
+    def _removes_by_refill(self):
+        # HNSW graphs cannot drop nodes, and IVF lists keep their internal IDs when
+        # IndexIDMap2 renumbers its positions, so IDs would no longer line up
+        inner = faiss.downcast_index(self.index.index)
+        return isinstance(inner, faiss.IndexHNSW) or faiss.try_extract_index_ivf(inner) is not None
+
+    def _refill(self, keep):
+        # The index is emptied and given back the vectors it keeps; its training
+        # (IVF centroids, PQ codebooks, fp16/int8 ranges) is left as it was
+        if keep.all():
+            return 0
+        ids = faiss.vector_to_array(self.index.id_map)
+        vectors = self.index.index.reconstruct_n(0, self.index.ntotal)
+        logger.info("Rebuilding %s index from %d of its %d vectors", self.params['kind'], int(keep.sum()), len(ids))
+        self.index.reset()
+        if keep.any():
+            self.index.add_with_ids(vectors[keep], ids[keep])
+        return int((~keep).sum())
+
+    def _replan_if_outgrown(self):
+        if not self.params.get('auto') or self.params['kind'] == 'ivfpq':
+            return
+        planned = default_params('auto', self.index.ntotal, self.params['dimension'])
+        if planned['kind'] == self.params['kind'] and (
+                planned['kind'] == 'flat' or planned['nlist'] < REPLAN_NLIST_GROWTH * self.params['nlist']):
+            return
+        logger.info("Index grew to %d vectors; re-planning it as %s with %d lists", self.index.ntotal,
+                    planned['kind'], planned['nlist'])
+        for key in ('kind', 'n_vectors', 'nlist', 'nprobe', 'train_size'):
+            self.params[key] = planned[key]
+        self._rebuild()
+
+    def _rebuild(self):
+        # Trains a new index on a sample of the current one, then moves the vectors
+        # over a block at a time so only one block is ever copied out
+        old, inner = self.index, self.index.index
+        ids = faiss.vector_to_array(old.id_map)
+        index = create_index(self.params)
+        if not index.is_trained:
+            rng = np.random.default_rng(0)
+            sampled = np.zeros(len(ids), dtype=bool)
+            sampled[rng.choice(len(ids), min(len(ids), self.params['train_size']), replace=False)] = True
+            sample = np.vstack([inner.reconstruct_n(start, min(_REBUILD_BLOCK, len(ids) - start))[
+                sampled[start:start + _REBUILD_BLOCK]] for start in range(0, len(ids), _REBUILD_BLOCK)])
+            start = time.perf_counter()
+            index.train(sample)
+            logger.info("Trained index on %d vectors in %.1fs", len(sample), time.perf_counter() - start)
+        for start in range(0, len(ids), _REBUILD_BLOCK):
+            count = min(_REBUILD_BLOCK, len(ids) - start)
+            index.add_with_ids(inner.reconstruct_n(start, count), ids[start:start + count])
+        self.index = index
+
+    def save(self, faiss_index_path):
+        """
+        Persist the index and its parameters without finishing the build.
+
+        Each file is written next to its target, flushed to disk and renamed over
+        it, so a crash or power loss leaves either the previous or the new version. Until the index is trained
+        the buffered vectors are saved instead, and reloaded by ``load_pending``.
+        """
+        save_params(faiss_index_path, self.params)
+        pending = pending_path(faiss_index_path)
+        if self.index is not None:
+            tmp_path = faiss_index_path + '.tmp'
+            faiss.write_index(self.index, tmp_path)
+            replace_durably(tmp_path, faiss_index_path)
+            if os.path.exists(pending):
+                os.remove(pending)
+            return
+        dimension = self.params['dimension']
+        vectors = np.vstack(self._pending_vectors) if self._pending_vectors else \
+            np.zeros((0, dimension), dtype='float32')
+        ids = np.concatenate(self._pending_ids) if self._pending_ids else np.zeros(0, dtype='int64')
+        # Keep the concatenated copy rather than holding both
+        self._pending_vectors, self._pending_ids = [vectors], [ids]
+        tmp_path = pending + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, vectors=vectors, ids=ids)
+        replace_durably(tmp_path, pending)
+        if os.path.exists(faiss_index_path):
+            # An index file left from before this build is not what the manifest now describes
+            os.remove(faiss_index_path)
+
+    def finish(self):
+        """Train and fill the index from any buffered vectors, then return it."""
+        if self.index is None:
+            self._build()
+        return self.index
+
+    def _build(self):
+        vectors = np.vstack(self._pending_vectors) if self._pending_vectors else \
+            np.zeros((0, self.params['dimension']), dtype='float32')
+        ids = np.concatenate(self._pending_ids) if self._pending_ids else np.zeros(0, dtype='int64')
+        if not self.params['n_vectors']:
+            # Size the index (and resolve 'auto') from the vectors seen so far
+            sized = default_params(self.params['kind'], len(vectors), self.params['dimension'])
+            for key in ('kind', 'n_vectors', 'nlist', 'nprobe', 'train_size'):
+                self.params[key] = sized[key]
+        min_training = {'ivf': self.params['nlist'],
+                        'ivfpq': max(self.params['nlist'], 2 ** self.params['pq_nbits'])}
+        if self.params['kind'] == 'auto' or len(vectors) < min_training.get(self.params['kind'], 0):
+            # Too few vectors to train the requested number of clusters
+            self.params['kind'] = 'flat'
+            logger.warning("Only %d vectors to train on; falling back to a flat index", len(vectors))
+        if self.params.get('storage') == 'int8' and not len(vectors):
+            # int8 ranges are learned from data; an empty index keeps full precision
+            self.params['storage'] = 'float32'
+        logger.info("Building %s index (%s) from %d vectors", self.params['kind'],
+                    factory_string(self.params), len(vectors))
+        self.index = create_index(self.params)
+        if not self.index.is_trained:
+            rng = np.random.default_rng(0)
+            sample = vectors[rng.choice(len(vectors), min(len(vectors), self.params['train_size']), replace=False)]
+            start = time.perf_counter()
+            self.index.train(sample)
+            logger.info("Trained index on %d vectors in %.1fs", len(sample), time.perf_counter() - start)
+        if len(vectors):
+            self.index.add_with_ids(vectors, ids)
+        self._pending_vectors, self._pending_ids = [], []
+
+
+def recall_report(index, vectors, ids, queries, k=10, nprobes=(1, 4, 16, 64), ef_searches=(16, 64, 256)):
+    """
+    Measure recall@k and latency of ``index`` against an exact flat search.
+
+    Args:
+        index: The approximate index to evaluate
+        vectors (np.ndarray): Exact vectors stored in the index
+        ids (np.ndarray): Vector IDs of ``vectors``
+        queries (np.ndarray): Query vectors
+        k (int): Number of neighbours compared
+        nprobes, ef_searches: Search settings swept for IVF and HNSW indexes
+
+    Returns:
+        list: One dict per setting with recall, mean latency per query and QPS
+    """
+    queries = np.ascontiguousarray(queries, dtype='float32')
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(np.ascontiguousarray(vectors, dtype='float32'))
+    start = time.perf_counter()
+    _, exact_positions = exact.search(queries, k)
+    exact_seconds = time.perf_counter() - start
+    truth = np.asarray(ids)[exact_positions]
+
+    if faiss.try_extract_index_ivf(index) is not None:
+        settings = [{'nprobe': nprobe} for nprobe in nprobes]
+    elif isinstance(faiss.downcast_index(getattr(index, 'index', index)), faiss.IndexHNSW):
+        settings = [{'ef_search': ef} for ef in ef_searches]
+    else:
+        settings = [{}]
+
+    report = [_report_row('exact', 1.0, exact_seconds, len(queries))]
+    for setting in settings:
+        set_search_params(index, **setting)
+        start = time.perf_counter()
+        _, found = index.search(queries, k)
+        seconds = time.perf_counter() - start
+        hits = sum(len(set(row) & set(expected)) for row, expected in zip(found, truth))
+        label = ','.join(f"{key}={value}" for key, value in setting.items()) or 'default'
+        report.append(_report_row(label, hits / truth.size, seconds, len(queries)))
+    return report
+
+
+def storage_report(vectors, ids, queries, k=10, params=None, storages=STORAGE_TYPES):
+    """
+    Compare recall, latency and size of the same index built with each storage type.
+
+    Args:
+        vectors (np.ndarray): Full-precision vectors to index
+        ids (np.ndarray): Vector IDs of ``vectors``
+        queries (np.ndarray): Query vectors
+        k (int): Number of neighbours compared
+        params (dict): Index parameters; defaults to a flat index sized for ``vectors``
+        storages (tuple): Storage types to compare
+
+    Returns:
+        list: ``recall_report`` rows, each tagged with its storage type and index size in bytes
+    """
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    params = dict(params or default_params('flat', len(vectors), vectors.shape[1]))
+    rows = []
+    for storage in storages:
+        index = create_index(dict(params, storage=storage))
+        if not index.is_trained:
+            rng = np.random.default_rng(0)
+            index.train(vectors[rng.choice(len(vectors), min(len(vectors), params['train_size']), replace=False)])
+        index.add_with_ids(vectors, np.asarray(ids, dtype='int64'))
+        size = faiss.serialize_index(index).size
+        for row in recall_report(index, vectors, ids, queries, k=k, nprobes=(params['nprobe'],),
+                                 ef_searches=(params['ef_search'],))[1:]:
+            rows.append(dict(row, storage=storage, bytes=int(size)))
+    return rows
+
+
+def _report_row(setting, recall, seconds, n_queries):
+    return {
+        'setting': setting,
+        'recall': round(recall, 4),
+        'latency_ms': round(1000 * seconds / n_queries, 3),
+        'qps': round(n_queries / seconds, 1) if seconds else None,
+    }
+
+
+if __name__ == "__main__":
+    # Usage: python rag_pipeline/index_factory.py [faiss_index_path] [n_queries]
+    # Prints the index's recall at several search settings, then how the same
+    # vectors fare with float32, fp16 and int8 storage.
+    logging.basicConfig(level=logging.INFO)
+    faiss_index_path = sys.argv[1] if len(sys.argv) > 1 else './vector_store/faiss_index.index'
+    n_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    index = faiss.read_index(faiss_index_path)
+    ids = faiss.vector_to_array(index.id_map)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    # Reconstructed vectors are exact except for PQ codes, whose recall is then optimistic
+    vectors = np.vstack([index.reconstruct(int(vector_id)) for vector_id in ids])
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)]
+    for row in recall_report(index, vectors, ids, queries):
+        print(json.dumps(row))
+    params = load_params(faiss_index_path)
+    if params['kind'] == 'ivfpq':
+        # PQ codes cannot be stored any other way; compare storage types on IVF instead
+        params = dict(params, kind='ivf')
+    for row in storage_report(vectors, ids, queries, params=params):
+        print(json.dumps(row))
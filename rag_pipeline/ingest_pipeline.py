@@ -0,0 +1,289 @@
+import time
+import queue
+import logging
+import threading
+
+from rag_pipeline import metrics
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of a stage's input
+_DONE = object()
+
+# How often a worker blocked on a full or empty queue checks whether the run was stopped
+_POLL_SECONDS = 0.1
+
+
+class StageStats:
+    """Counters for one pipeline stage, safe to update from its worker threads."""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items_in = 0
+        self.items_out = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def record(self, busy_seconds, items_in=1, items_out=1, error=False):
+        with self._lock:
+            self.items_in += items_in
+            self.items_out += items_out
+            self.busy_seconds += busy_seconds
+            if error:
+                self.errors += 1
+        metrics.inc('ingest_stage_items_in', items_in, stage=self.name)
+        metrics.inc('ingest_stage_items_out', items_out, stage=self.name)
+        metrics.inc('ingest_stage_busy_seconds', busy_seconds, stage=self.name)
+        if error:
+            metrics.inc('ingest_stage_errors', stage=self.name)
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    @property
+    def throughput(self):
+        """Items completed per wall-clock second since the stage started."""
+        return self.items_in / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def utilization(self):
+        """Fraction of the stage's worker capacity that was busy."""
+        capacity = self.elapsed * self.workers
+        return self.busy_seconds / capacity if capacity else 0.0
+
+    def as_dict(self):
+        return {
+            'stage': self.name,
+            'workers': self.workers,
+            'items_in': self.items_in,
+            'items_out': self.items_out,
+            'errors': self.errors,
+            'elapsed_seconds': round(self.elapsed, 3),
+            'throughput_per_second': round(self.throughput, 2),
+            'utilization': round(self.utilization, 3),
+        }
+
+
+class IngestPipeline:
+    """
+    Staged producer/consumer ingest: download -> extract -> embed.
+
+    Each stage runs on its own worker threads and hands work to the next stage
+    through a bounded queue, so a slow stage blocks its producers instead of
+    letting work pile up in memory. Downloads, parsing and embedding requests
+    therefore overlap instead of running one file at a time.
+
+    Args:
+        download (callable): ``download(file) -> payload``; runs on download workers
+        extract (callable): ``extract(file, payload) -> iterable of chunks``
+        embedder (BatchEmbedder): Batches chunks; ``embed_workers`` is used in place of
+            its ``max_in_flight``
+        sink (callable): ``sink(batch, vectors)`` with ``batch`` a list of
+            ``(chunk, file)`` pairs; always called from a single thread
+        download_workers (int): Concurrent downloads
+        extract_workers (int): Concurrent extractions
+        embed_workers (int): Embedding requests in flight
+        queue_size (int): Capacity of each inter-stage queue
+        text_of (callable): Returns the text to embed for a chunk; defaults to the
+            chunk itself
+    """
+
+    def __init__(self, download, extract, embedder, sink, download_workers=4,
+                 extract_workers=2, embed_workers=4, queue_size=32, text_of=None):
+        self.download = download
+        self.extract = extract
+        self.text_of = text_of or (lambda chunk: chunk)
+        self.embedder = embedder
+        self.sink = sink
+        self.queue_size = queue_size
+        self.stats = {
+            'download': StageStats('download', download_workers),
+            'extract': StageStats('extract', extract_workers),
+            'embed': StageStats('embed', embed_workers),
+        }
+
+    def run(self, files):
+        """
+        Push every file through the pipeline and return per-stage stats.
+
+        If storing stops early (an exception from the embedder, ``text_of`` or the
+        sink, or KeyboardInterrupt), the workers are stopped and the queues drained
+        before the exception propagates, so no worker is left blocked.
+        """
+        self._stop = threading.Event()
+        download_q = queue.Queue(self.queue_size)
+        extract_q = queue.Queue(self.queue_size)
+        chunk_q = queue.Queue(self.queue_size * 8)
+        self.queues = {'download': download_q, 'extract': extract_q, 'embed': chunk_q}
+
+        download_workers = self.stats['download'].workers
+        extract_workers = self.stats['extract'].workers
+        for stats in self.stats.values():
+            stats.started_at = time.perf_counter()
+
+        threads = [threading.Thread(target=self._feed, args=(files, download_q, download_workers),
+                                    name='ingest-feed', daemon=True)]
+        done_downloading = _Countdown(download_workers, lambda: self._close(extract_q, extract_workers))
+        for i in range(download_workers):
+            threads.append(threading.Thread(target=self._download_worker,
+                                            args=(download_q, extract_q, done_downloading),
+                                            name=f'ingest-download-{i}', daemon=True))
+        done_extracting = _Countdown(extract_workers, lambda: self._close(chunk_q, 1))
+        for i in range(extract_workers):
+            threads.append(threading.Thread(target=self._extract_worker,
+                                            args=(extract_q, chunk_q, done_extracting),
+                                            name=f'ingest-extract-{i}', daemon=True))
+        for thread in threads:
+            thread.start()
+
+        # Batching and storage run on the calling thread so the sink is single-writer
+        try:
+            self._embed(chunk_q)
+        finally:
+            # Workers still running only get here if storing stopped early; unblock
+            # them and discard whatever they queued
+            self._stop.set()
+            for thread in threads:
+                while thread.is_alive():
+                    self._drain()
+                    thread.join(_POLL_SECONDS)
+            self._drain()
+            for stage in self.queues:
+                metrics.set_gauge('ingest_queue_depth', 0, stage=stage)
+        return self.report()
+
+    def report(self):
+        return [stats.as_dict() for stats in self.stats.values()]
+
+    def _put(self, q, item):
+        # Blocks while the queue is full, but gives up once the run is stopped
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        # Blocks while the queue is empty; a stopped run reads as the end of input
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _drain(self):
+        for q in self.queues.values():
+            while True:
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    break
+
+    def _feed(self, files, download_q, workers):
+        try:
+            for file in files:
+                if not self._put(download_q, file):
+                    break
+        except Exception as e:
+            logger.error(f"Failed to list files: {str(e)}")
+        finally:
+            self._close(download_q, workers)
+
+    def _close(self, q, consumers):
+        for _ in range(consumers):
+            self._put(q, _DONE)
+
+    def _download_worker(self, download_q, extract_q, done):
+        stats = self.stats['download']
+        while True:
+            file = self._get(download_q)
+            if file is _DONE:
+                break
+            metrics.set_gauge('ingest_queue_depth', download_q.qsize(), stage='download')
+            start = time.perf_counter()
+            try:
+                payload = self.download(file)
+            except Exception as e:
+                logger.error(f"Failed to download file {file['id']}: {str(e)}")
+                stats.record(time.perf_counter() - start, items_out=0, error=True)
+                continue
+            stats.record(time.perf_counter() - start)
+            if payload is not None and not self._put(extract_q, (file, payload)):
+                break
+        stats.finished_at = time.perf_counter()
+        done.tick()
+
+    def _extract_worker(self, extract_q, chunk_q, done):
+        stats = self.stats['extract']
+        while True:
+            item = self._get(extract_q)
+            if item is _DONE:
+                break
+            metrics.set_gauge('ingest_queue_depth', extract_q.qsize(), stage='extract')
+            file, payload = item
+            start = time.perf_counter()
+            produced, failed = 0, False
+            try:
+                for chunk in self.extract(file, payload) or ():
+                    if not self._put(chunk_q, (chunk, file)):
+                        break
+                    produced += 1
+            except Exception as e:
+                logger.error(f"Failed to process file {file['id']}: {str(e)}")
+                failed = True
+            stats.record(time.perf_counter() - start, items_out=produced, error=failed)
+        stats.finished_at = time.perf_counter()
+        done.tick()
+
+    def _embed(self, chunk_q):
+        stats = self.stats['embed']
+
+        def chunks():
+            while True:
+                item = chunk_q.get()
+                if item is _DONE:
+                    return
+                metrics.set_gauge('ingest_queue_depth', chunk_q.qsize(), stage='embed')
+                yield item
+
+        # Busy time here includes waiting on in-flight embedding requests
+        start = time.perf_counter()
+        for batch, vectors in self.embedder.embed_batches(chunks(), text_of=lambda item: self.text_of(item[0]),
+                                                          max_in_flight=stats.workers):
+            stored = False
+            if vectors is not None:
+                try:
+                    self.sink(batch, vectors)
+                    stored = True
+                except Exception as e:
+                    logger.error(f"Failed to store batch of {len(batch)} chunks: {str(e)}")
+            stats.record(time.perf_counter() - start, items_in=len(batch),
+                         items_out=len(batch) if stored else 0, error=not stored)
+            start = time.perf_counter()
+        stats.finished_at = time.perf_counter()
+
+
+class _Countdown:
+    """Runs a callback once ``count`` workers have called ``tick``."""
+
+    def __init__(self, count, callback):
+        self.count = count
+        self.callback = callback
+        self._lock = threading.Lock()
+
+    def tick(self):
+        with self._lock:
+            self.count -= 1
+            finished = self.count == 0
+        if finished:
+            self.callback()
@@ -0,0 +1,268 @@
+import os
+import re
+import math
+import heapq
+import sqlite3
+import logging
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Okapi BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Terms in more than this share of chunks carry almost no signal and have the
+# longest posting lists, so they are skipped when a query has rarer terms
+MAX_DF_RATIO = 0.25
+
+# Posting weights are stored as integers with this resolution
+_WEIGHT_SCALE = 1000
+
+# SQLite limits the number of bound parameters per statement
+_LOOKUP_BATCH = 500
+
+# Identifiers such as "AB-1234", "v2.3.1" or "foo_bar" are kept whole and also split into parts
+_TOKEN = re.compile(r'\w+(?:[-./:]\w+)*')
+_PART = re.compile(r'[^\W_]+')
+
+
+def tokenize(text):
+    """Lowercased terms of ``text``: whole identifiers plus their alphanumeric parts."""
+    terms = []
+    for match in _TOKEN.finditer(text.lower()):
+        token = match.group()
+        terms.append(token)
+        parts = _PART.findall(token)
+        if len(parts) > 1:
+            terms.extend(parts)
+    return terms
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over chunk text, stored in SQLite and keyed by FAISS vector ID.
+
+    Postings are integer ``(term_id, weight, chunk_id)`` rows clustered by term
+    and ordered by weight, the chunk's BM25 term-frequency component scaled to
+    an integer. A query reads only the ``postings_per_term`` best postings of
+    each of its terms, so its cost does not grow with the corpus. Weights use
+    the average chunk length at the time a chunk is written; ``rebuild`` from
+    the chunk text renormalises them. Chunks are removed by re-tokenising
+    their text, so the index stores nothing per chunk beyond its postings.
+
+    Writes are batched into a transaction that is made durable by ``commit``.
+
+    Args:
+        path (str): SQLite database file
+        read_only (bool): Open without write access, e.g. for query processes
+        postings_per_term (int): Postings read per query term
+    """
+
+    def __init__(self, path, read_only=False, postings_per_term=500):
+        self.path = path
+        self.read_only = read_only
+        self.postings_per_term = postings_per_term
+        self._lock = threading.Lock()
+        if read_only:
+            self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Postings are inserted in term order, not file order; a larger page cache keeps that fast
+        self._conn.execute("PRAGMA cache_size=-65536")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS terms (id INTEGER PRIMARY KEY, term TEXT UNIQUE, df INTEGER);"
+            "CREATE TABLE IF NOT EXISTS postings ("
+            "term_id INTEGER, weight INTEGER, chunk_id INTEGER, PRIMARY KEY (term_id, weight, chunk_id)) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, length INTEGER, avg_length REAL);"
+            "CREATE TABLE IF NOT EXISTS stats (key TEXT PRIMARY KEY, value INTEGER);"
+            "INSERT OR IGNORE INTO stats VALUES ('chunks', 0), ('length', 0);")
+        self._conn.commit()
+
+    @staticmethod
+    def path_for(faiss_index_path):
+        return os.path.splitext(faiss_index_path)[0] + '_lexical.sqlite'
+
+    @classmethod
+    def for_index(cls, faiss_index_path, read_only=False):
+        path = cls.path_for(faiss_index_path)
+        if read_only and not os.path.exists(path):
+            return None
+        return cls(path, read_only=read_only)
+
+    def __len__(self):
+        with self._lock:
+            return self._stats()[0]
+
+    def _stats(self):
+        stats = dict(self._conn.execute("SELECT key, value FROM stats"))
+        return stats.get('chunks', 0), stats.get('length', 0)
+
+    def add_many(self, items):
+        """Index ``(chunk_id, text)`` pairs for new chunks; call ``commit`` to make them durable."""
+        chunks = [(int(chunk_id), Counter(tokenize(text or ''))) for chunk_id, text in items]
+        if not chunks:
+            return
+        with self._lock:
+            n_chunks, total_length = self._stats()
+            lengths = [sum(counts.values()) for _, counts in chunks]
+            avg_length = (total_length + sum(lengths)) / (n_chunks + len(chunks)) or 1.0
+            term_ids = self._term_ids({term for _, counts in chunks for term in counts})
+            postings, df = [], Counter()
+            for chunk_id, counts in chunks:
+                postings.extend(self._postings(chunk_id, counts, term_ids, avg_length))
+                df.update(term_ids[term] for term in counts)
+            self._conn.executemany("INSERT INTO postings VALUES (?, ?, ?)", postings)
+            self._conn.executemany("INSERT INTO chunks VALUES (?, ?, ?)",
+                                   [(chunk_id, length, avg_length) for (chunk_id, _), length in zip(chunks, lengths)])
+            self._conn.executemany("UPDATE terms SET df = df + ? WHERE id = ?", [(n, t) for t, n in df.items()])
+            self._update_stats(len(chunks), sum(lengths))
+
+    def delete_many(self, items):
+        """Remove chunks given as the same ``(chunk_id, text)`` pairs they were added with."""
+        chunks = {int(chunk_id): Counter(tokenize(text or '')) for chunk_id, text in items}
+        if not chunks:
+            return
+        with self._lock:
+            # Postings are keyed by weight, so they are recomputed with the average length used on insert
+            ids = list(chunks)
+            rows = []
+            for i in range(0, len(ids), _LOOKUP_BATCH):
+                batch = ids[i:i + _LOOKUP_BATCH]
+                rows.extend(self._conn.execute(
+                    f"SELECT id, length, avg_length FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch))
+            if not rows:
+                return
+            term_ids = self._term_ids({term for chunk_id, _, _ in rows for term in chunks[chunk_id]}, create=False)
+            postings, df = [], Counter()
+            for chunk_id, _, avg_length in rows:
+                counts = {term: tf for term, tf in chunks[chunk_id].items() if term in term_ids}
+                postings.extend(self._postings(chunk_id, counts, term_ids, avg_length))
+                df.update(term_ids[term] for term in counts)
+            self._conn.executemany("DELETE FROM postings WHERE term_id = ? AND weight = ? AND chunk_id = ?", postings)
+            self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(row[0],) for row in rows])
+            self._conn.executemany("UPDATE terms SET df = df - ? WHERE id = ?", [(n, t) for t, n in df.items()])
+            self._update_stats(-len(rows), -sum(row[1] for row in rows))
+
+    @staticmethod
+    def _postings(chunk_id, counts, term_ids, avg_length):
+        length = sum(counts.values())
+        return [(term_ids[term], _weight(tf, length, avg_length), chunk_id) for term, tf in counts.items()]
+
+    def _term_ids(self, terms, create=True):
+        terms = list(terms)
+        if create:
+            self._conn.executemany("INSERT OR IGNORE INTO terms (term, df) VALUES (?, 0)", [(t,) for t in terms])
+        ids = {}
+        for i in range(0, len(terms), _LOOKUP_BATCH):
+            batch = terms[i:i + _LOOKUP_BATCH]
+            ids.update((term, term_id) for term_id, term in self._conn.execute(
+                f"SELECT id, term FROM terms WHERE term IN ({','.join('?' * len(batch))})", batch))
+        return ids
+
+    def _update_stats(self, chunks, length):
+        self._conn.execute("UPDATE stats SET value = value + ? WHERE key = 'chunks'", (chunks,))
+        self._conn.execute("UPDATE stats SET value = value + ? WHERE key = 'length'", (length,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.executescript(
+                "DELETE FROM postings; DELETE FROM terms; DELETE FROM chunks; UPDATE stats SET value = 0;")
+            self._conn.commit()
+
+    def rebuild(self, items, batch_size=1000):
+        """Replace the whole index with ``(chunk_id, text)`` pairs, e.g. from the metadata store."""
+        self.clear()
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                self.add_many(batch)
+                batch = []
+        self.add_many(batch)
+        self.commit()
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def term_stats(self, query_text):
+        """``(n_chunks, {term: df})`` for the terms of ``query_text``, to be summed across shards."""
+        query_terms = set(tokenize(query_text))
+        if not query_terms:
+            return 0, {}
+        with self._lock:
+            n_chunks, _ = self._stats()
+            rows = self._conn.execute(
+                f"SELECT term, df FROM terms WHERE df > 0 AND term IN ({','.join('?' * len(query_terms))})",
+                list(query_terms)).fetchall()
+        return n_chunks, dict(rows)
+
+    def search(self, query_text, k=10, corpus_stats=None):
+        """
+        Rank chunks against ``query_text`` with BM25.
+
+        Args:
+            query_text (str): The query
+            k (int): Number of chunks returned
+            corpus_stats (tuple): ``(n_chunks, {term: df})`` of the whole corpus when
+                this index is one shard of it, so scores are comparable across
+                shards; defaults to this index's own statistics
+
+        Returns:
+            list: ``(chunk_id, score)`` pairs, best first
+        """
+        query_terms = Counter(tokenize(query_text))
+        if not query_terms:
+            return []
+        with self._lock:
+            n_chunks, _ = self._stats()
+            terms = self._conn.execute(
+                f"SELECT id, term, df FROM terms WHERE df > 0 AND term IN ({','.join('?' * len(query_terms))})",
+                list(query_terms)).fetchall()
+            if corpus_stats is not None:
+                n_chunks, corpus_df = corpus_stats
+                terms = [(term_id, term, corpus_df.get(term, df)) for term_id, term, df in terms]
+            rare = [term for term in terms if term[2] <= MAX_DF_RATIO * n_chunks]
+            # Only very common terms matched; score on them rather than return nothing
+            scores = Counter()
+            for term_id, term, df in rare or terms:
+                idf = math.log(1 + (n_chunks - df + 0.5) / (df + 0.5)) * query_terms[term] / _WEIGHT_SCALE
+                for weight, chunk_id in self._conn.execute(
+                        "SELECT weight, chunk_id FROM postings WHERE term_id = ? ORDER BY weight DESC LIMIT ?",
+                        (term_id, self.postings_per_term)):
+                    scores[chunk_id] += idf * weight
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+def _weight(tf, length, avg_length):
+    # BM25 term-frequency saturation with length normalisation, as a small integer
+    norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+    return int(round(_WEIGHT_SCALE * tf * (BM25_K1 + 1) / norm))
+
+
+def reciprocal_rank_fusion(rankings, k=60, weights=None):
+    """
+    Fuse several rankings of IDs into one with reciprocal rank fusion.
+
+    Args:
+        rankings (list): Lists of IDs, each ordered best first
+        k (int): RRF constant; larger values flatten the contribution of top ranks
+        weights (list): Optional weight per ranking
+
+    Returns:
+        list: ``(id, score)`` pairs, best first
+    """
+    weights = weights or [1.0] * len(rankings)
+    scores = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, item in enumerate(ranking):
+            scores[item] = scores.get(item, 0.0) + weight / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
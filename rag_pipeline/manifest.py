@@ -0,0 +1,127 @@
+import os
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def replace_durably(tmp_path, path):
+    """
+    Rename a fully written ``tmp_path`` over ``path`` so the change survives a power loss.
+
+    The file is flushed to disk before the rename, and the directory after it,
+    so a crash leaves either the complete old or the complete new version.
+    """
+    with open(tmp_path, 'r+b') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        # Directories cannot be opened on Windows, where the rename needs no separate flush
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class IndexManifest:
+    """
+    Records which vectors each source file contributed to the index.
+
+    Maps file_id -> {checksum, modified_time, ids} where ``ids`` is a list of
+    ``[start, end)`` vector-ID ranges. IDs are allocated from a monotonically
+    increasing counter and never reused, so a FAISS ID always refers to the same
+    chunk in the metadata.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.next_id = 0
+        self.files = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                data = json.load(f)
+            self.next_id = data.get('next_id', 0)
+            self.files = data.get('files', {})
+
+    @staticmethod
+    def path_for(faiss_index_path):
+        return os.path.splitext(faiss_index_path)[0] + '_manifest.json'
+
+    def is_unchanged(self, file):
+        """True if the file was indexed before and its checksum/modifiedTime still match."""
+        entry = self.files.get(file['id'])
+        if entry is None:
+            return False
+        # Google Docs Editors files have no md5Checksum, so fall back to modifiedTime
+        if file.get('md5Checksum') or entry.get('checksum'):
+            return file.get('md5Checksum') == entry.get('checksum')
+        return file.get('modifiedTime') is not None and file.get('modifiedTime') == entry.get('modified_time')
+
+    def allocate_ids(self, count):
+        """Reserve ``count`` consecutive vector IDs and return them as a range."""
+        start = self.next_id
+        self.next_id += count
+        return range(start, self.next_id)
+
+    def reset_file(self, file, root=None):
+        """Start a fresh entry for a file that is being (re-)indexed."""
+        self.files[file['id']] = {
+            'checksum': file.get('md5Checksum'),
+            'modified_time': file.get('modifiedTime'),
+            'root': root,
+            'ids': [],
+        }
+
+    def add_ids(self, file_id, ids):
+        """Append vector IDs to a file's entry, merging contiguous ranges."""
+        _extend_ranges(self.files[file_id]['ids'], ids)
+
+    def ids_of(self, file_id):
+        entry = self.files.get(file_id)
+        if entry is None:
+            return []
+        return [vector_id for start, end in entry['ids'] for vector_id in range(start, end)]
+
+    def remove(self, file_id):
+        """Forget a file and return the vector IDs it owned."""
+        ids = self.ids_of(file_id)
+        self.files.pop(file_id, None)
+        return ids
+
+    def files_under(self, root):
+        return [file_id for file_id, entry in self.files.items() if entry.get('root') == root]
+
+    def save(self, incomplete=None):
+        """
+        Write the manifest; a resumed ingest trusts exactly what it records.
+
+        ``incomplete`` maps files whose (re-)indexing is still in progress to the
+        vector IDs they are replacing. Such files are saved without a checksum and
+        owning both their old and new IDs, so the next run indexes them again and
+        drops everything they left behind.
+        """
+        files = self.files
+        if incomplete:
+            files = dict(files)
+            for file_id, old_ids in incomplete.items():
+                entry = files.get(file_id) or {}
+                ranges = []
+                _extend_ranges(ranges, sorted(set(old_ids) | set(self.ids_of(file_id))))
+                files[file_id] = {'checksum': None, 'modified_time': None, 'root': entry.get('root'),
+                                  'ids': ranges}
+        # Write-then-rename so a crash never leaves a half-written manifest
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'next_id': self.next_id, 'files': files}, f)
+        replace_durably(tmp_path, self.path)
+
+
+def _extend_ranges(ranges, ids):
+    for vector_id in ids:
+        if ranges and ranges[-1][1] == vector_id:
+            ranges[-1][1] = vector_id + 1
+        else:
+            ranges.append([vector_id, vector_id + 1])
@@ -0,0 +1,152 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# SQLite limits the number of bound parameters per statement
+_LOOKUP_BATCH = 500
+
+# Columns stored directly; any other metadata keys go into the JSON 'extra' column
+_COLUMNS = ('text', 'file_id', 'mime_type')
+
+
+class MetadataStore:
+    """
+    Chunk metadata keyed by integer FAISS vector ID, stored in SQLite.
+
+    Lookups read only the requested rows, so opening the store is O(1) no matter
+    how many chunks it holds. Writes are batched into a transaction that is
+    made durable by ``commit``.
+
+    Args:
+        path (str): SQLite database file
+        read_only (bool): Open without write access, e.g. for query processes
+    """
+
+    def __init__(self, path, read_only=False):
+        self.path = path
+        self.read_only = read_only
+        self._lock = threading.Lock()
+        if read_only:
+            self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                "id INTEGER PRIMARY KEY, file_id TEXT, mime_type TEXT, text TEXT, extra TEXT)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_file_id ON chunks (file_id)")
+            self._conn.commit()
+
+    @staticmethod
+    def path_for(faiss_index_path):
+        return os.path.splitext(faiss_index_path)[0] + '_metadata.sqlite'
+
+    @classmethod
+    def for_index(cls, faiss_index_path, read_only=False):
+        """
+        Open the store next to ``faiss_index_path``, migrating a legacy
+        ``_metadata.json`` into it the first time.
+        """
+        path = cls.path_for(faiss_index_path)
+        json_path = os.path.splitext(faiss_index_path)[0] + '_metadata.json'
+        if os.path.exists(json_path) and not os.path.exists(path):
+            cls(path).migrate_from_json(json_path)
+        if read_only and not os.path.exists(path):
+            # Nothing was ever indexed; an empty writable store keeps lookups working
+            read_only = False
+        return cls(path, read_only=read_only)
+
+    def migrate_from_json(self, json_path):
+        """One-time import of a legacy ``{str(id): metadata}`` JSON file."""
+        logger.info("Migrating metadata from %s to %s", json_path, self.path)
+        with open(json_path, 'r') as f:
+            metadata = json.load(f)
+        self.add_many((int(k), v) for k, v in metadata.items())
+        self.commit()
+        os.replace(json_path, json_path + '.migrated')
+        logger.info("Migrated %d metadata entries", len(metadata))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def __contains__(self, vector_id):
+        return self.get(vector_id) is not None
+
+    def get(self, vector_id):
+        return self.get_many([vector_id])[0]
+
+    def get_many(self, vector_ids):
+        """Return the metadata dict for each ID, or None for unknown IDs."""
+        vector_ids = [int(vector_id) for vector_id in vector_ids]
+        rows = {}
+        with self._lock:
+            for i in range(0, len(vector_ids), _LOOKUP_BATCH):
+                batch = vector_ids[i:i + _LOOKUP_BATCH]
+                for row in self._conn.execute(
+                        f"SELECT id, text, file_id, mime_type, extra FROM chunks "
+                        f"WHERE id IN ({','.join('?' * len(batch))})", batch):
+                    rows[row[0]] = row
+        return [self._to_dict(rows[vector_id]) if vector_id in rows else None for vector_id in vector_ids]
+
+    def ids_for_file(self, file_id):
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT id FROM chunks WHERE file_id = ?", (file_id,))]
+
+    def ids_from(self, start):
+        """IDs of all chunks with an ID of at least ``start``."""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT id FROM chunks WHERE id >= ? ORDER BY id",
+                                                         (int(start),))]
+
+    def iter_texts(self, batch_size=1000):
+        """Yield ``(vector_id, text)`` for every chunk in ID order, a batch at a time."""
+        last_id = -1
+        while True:
+            with self._lock:
+                rows = self._conn.execute("SELECT id, text FROM chunks WHERE id > ? ORDER BY id LIMIT ?",
+                                          (last_id, batch_size)).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last_id = rows[-1][0]
+
+    def add_many(self, items):
+        """Insert ``(vector_id, metadata)`` pairs; call ``commit`` to make them durable."""
+        rows = []
+        for vector_id, metadata in items:
+            extra = {k: v for k, v in metadata.items() if k not in _COLUMNS}
+            rows.append((int(vector_id), metadata.get('file_id'), metadata.get('mime_type'),
+                         metadata.get('text'), json.dumps(extra) if extra else None))
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?)", rows)
+
+    def delete_ids(self, vector_ids):
+        with self._lock:
+            self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(int(i),) for i in vector_ids])
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.commit()
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _to_dict(row):
+        _, text, file_id, mime_type, extra = row
+        metadata = {'text': text, 'file_id': file_id, 'mime_type': mime_type}
+        if extra:
+            metadata.update(json.loads(extra))
+        return metadata
@@ -0,0 +1,295 @@
+import os
+import time
+import bisect
+import logging
+import threading
+import contextvars
+
+logger = logging.getLogger(__name__)
+
+# Prefix of every exported metric name
+NAMESPACE = 'docurag'
+
+# Upper bounds, in seconds, of the span duration histogram buckets
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_enabled = os.getenv('DOCURAG_METRICS', '').lower() in ('1', 'true', 'yes')
+_current_trace = contextvars.ContextVar('docurag_trace', default=None)
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'count', 'sum')
+
+    def __init__(self):
+        self.buckets = [0] * (len(DURATION_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(DURATION_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Registry:
+    """Process-wide counters, gauges and span duration histograms, keyed by name and labels."""
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount, labels):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name, value, labels):
+        with self._lock:
+            self.gauges[(name, labels)] = value
+
+    def observe(self, name, seconds, labels):
+        key = (name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = _Histogram()
+            histogram.observe(seconds)
+
+    def clear(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def render(self, openmetrics=False):
+        """The registry in the Prometheus text exposition format, or OpenMetrics with ``openmetrics``."""
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted((key, (list(h.buckets), h.count, h.sum)) for key, h in self.histograms.items())
+
+        declared = set()
+
+        def declare(name, kind):
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            # OpenMetrics names the counter family without the _total suffix its samples carry
+            family = f"{NAMESPACE}_{name}"
+            declare(family if openmetrics else f"{family}_total", 'counter')
+            lines.append(f"{family}_total{_format_labels(labels)} {_format_value(value)}")
+        for (name, labels), value in gauges:
+            declare(f"{NAMESPACE}_{name}", 'gauge')
+            lines.append(f"{NAMESPACE}_{name}{_format_labels(labels)} {_format_value(value)}")
+        for (name, labels), (buckets, count, total) in histograms:
+            family = f"{NAMESPACE}_{name}_seconds"
+            declare(family, 'histogram')
+            cumulative = 0
+            for bound, n in zip(DURATION_BUCKETS + (float('inf'),), buckets):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{family}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{family}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{family}_count{_format_labels(labels)} {count}")
+        if openmetrics:
+            lines.append("# EOF")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Trace:
+    """Spans recorded while answering one request, with their start offsets and durations."""
+
+    def __init__(self, name):
+        self.name = name
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+        self.spans = []
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    @property
+    def seconds(self):
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    def add_span(self, name, start, seconds, labels):
+        with self._lock:
+            self.spans.append({'name': name, 'start_ms': round((start - self.started_at) * 1000, 3),
+                               'ms': round(seconds * 1000, 3), **dict(labels)})
+
+    def add_count(self, name, amount):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def breakdown(self):
+        """Total time per span name, plus the request's counters."""
+        totals = {}
+        for span in self.spans:
+            totals[span['name']] = round(totals.get(span['name'], 0.0) + span['ms'], 3)
+        return {'request': self.name, 'total_ms': round(self.seconds * 1000, 3), 'spans': totals,
+                'counters': dict(self.counters)}
+
+    def as_dict(self):
+        return dict(self.breakdown(), timeline=sorted(self.spans, key=lambda span: span['start_ms']))
+
+
+class _Span:
+    __slots__ = ('name', 'labels', 'trace', 'start')
+
+    def __init__(self, name, labels, trace):
+        self.name = name
+        self.labels = labels
+        self.trace = trace
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        if _enabled:
+            REGISTRY.observe(self.name, seconds, self.labels)
+        if self.trace is not None:
+            self.trace.add_span(self.name, self.start, seconds, self.labels)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def enable(enabled=True):
+    """Turn process-wide metric collection on or off (``DOCURAG_METRICS=1`` enables it at startup)."""
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled():
+    return _enabled
+
+
+def span(name, **labels):
+    """
+    Time a block as ``with metrics.span('name'):``.
+
+    The duration goes to the ``<name>_seconds`` histogram when metrics are
+    enabled and to the current trace when one is active; otherwise this
+    returns a shared no-op context manager.
+    """
+    trace = _current_trace.get()
+    if not _enabled and trace is None:
+        return _NOOP_SPAN
+    return _Span(name, tuple(sorted(labels.items())), trace)
+
+
+def observe(name, seconds, **labels):
+    """Record a duration measured by the caller, e.g. one that spans several awaits or yields."""
+    if _enabled:
+        REGISTRY.observe(name, seconds, tuple(sorted(labels.items())))
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(name, time.perf_counter() - seconds, seconds, tuple(sorted(labels.items())))
+
+
+def inc(name, amount=1, **labels):
+    """Add ``amount`` to the ``<name>_total`` counter and the current trace."""
+    if _enabled:
+        REGISTRY.inc(name, amount, tuple(sorted(labels.items())))
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_count(name, amount)
+
+
+def set_gauge(name, value, **labels):
+    if _enabled:
+        REGISTRY.set(name, value, tuple(sorted(labels.items())))
+
+
+class trace:
+    """
+    Record a per-request breakdown of spans and counters, even with metrics disabled.
+
+    Usage::
+
+        with metrics.trace('answer') as t:
+            agent.answer_question(question)
+        print(t.breakdown())
+    """
+
+    def __init__(self, name='request'):
+        self.trace = Trace(name)
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current_trace.set(self.trace)
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        self.trace.finished_at = time.perf_counter()
+        _current_trace.reset(self._token)
+        return False
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def render(openmetrics=False):
+    return REGISTRY.render(openmetrics=openmetrics)
+
+
+def start_http_server(port=9464, host='0.0.0.0'):
+    """Serve ``/metrics`` on a daemon thread and return the server."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            openmetrics = 'application/openmetrics-text' in self.headers.get('Accept', '')
+            body = render(openmetrics=openmetrics).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+                             if openmetrics else 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logger.info("Serving metrics on http://%s:%d/metrics", host, port)
+    return server
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
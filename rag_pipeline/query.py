@@ -5,47 +5,217 @@ from dotenv import load_dotenv
 import logging
 import sys
 import json
-from openai import OpenAI
-from requests import HTTPError
+import contextvars
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 import truststore
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from data_extraction.gdrive_extraction import GoogleDriveClient
+from rag_pipeline.embeddings import BatchEmbedder, OpenAIEmbeddingBackend
+from rag_pipeline.embedding_cache import EmbeddingCache, CachedEmbeddingBackend
+from rag_pipeline.lexical_index import reciprocal_rank_fusion
+from rag_pipeline.sharding import open_shards, merge_top_k, split_id
+from rag_pipeline import metrics
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 logging.DEBUG = True
 class FaissQuery:
-    def __init__(self, faiss_index_path):
+    def __init__(self, faiss_index_path, embedding_backend=None, embedding_cache=None, use_embedding_cache=True,
+                 hybrid=True, rrf_k=60, mmap=False, drive_client=None):
         load_dotenv()
-        service_account_file = os.getenv("SERVICE_ACCOUNT_FILE")
-        scopes = os.getenv("SCOPES").split(',')
-        self.client = GoogleDriveClient(service_account_file, scopes)
-        self.index = faiss.read_index(faiss_index_path)
-        self.metadata_path = os.path.splitext(faiss_index_path)[0] + '_metadata.json'
-        self.metadata = self.load_metadata()
-
-    def load_metadata(self):
-        if os.path.exists(self.metadata_path):
-            with open(self.metadata_path, 'r') as f:
-                return json.load(f)
-        return {}
-
-    def query(self, query_text, k=5):
-        query_vector = self.text_to_vector(query_text)
-        distances, indices = self.index.search(np.array([query_vector]).astype('float32'), k)
-        
-        results = []
-        for idx in indices[0]:
-            if str(idx) in self.metadata:
-                result = self.metadata[str(idx)]
+        # Drive is only needed to fetch full documents, so the client is authenticated on first use
+        self._client = drive_client
+        self.faiss_index_path = faiss_index_path
+        # A plain index file is a single shard; a sharded store directory opens every shard.
+        # With mmap the index is paged in on demand and shared between processes.
+        self.shards = open_shards(faiss_index_path, hybrid=hybrid, mmap=mmap)
+        self._shards_by_number = {shard.number: shard for shard in self.shards}
+        self._executor = ThreadPoolExecutor(max_workers=len(self.shards)) if len(self.shards) > 1 else None
+        # Queries fuse BM25 and vector rankings when the index was built with a lexical index
+        self.hybrid = hybrid and any(shard.lexical is not None for shard in self.shards)
+        self.rrf_k = rrf_k
+        # The OpenAI client is created by the first request that needs an embedding
+        self.embedding_backend = embedding_backend or OpenAIEmbeddingBackend()
+        self.embedding_cache = None
+        if use_embedding_cache:
+            # Same cache the Preprocessor fills, so repeated queries skip the embeddings API
+            self.embedding_cache = embedding_cache or EmbeddingCache.for_index(faiss_index_path)
+            self.embedding_backend = CachedEmbeddingBackend(self.embedding_backend, self.embedding_cache)
+        self.embedder = BatchEmbedder(self.embedding_backend)
+
+    @property
+    def client(self):
+        if self._client is None:
+            from data_extraction.gdrive_extraction import GoogleDriveClient
+            self._client = GoogleDriveClient.from_env()
+        return self._client
+
+    @property
+    def index(self):
+        return self.shards[0].index
+
+    @property
+    def metadata(self):
+        return self.shards[0].metadata
+
+    @property
+    def lexical(self):
+        return self.shards[0].lexical
+
+    @property
+    def index_params(self):
+        return self.shards[0].index_params
+
+    @property
+    def index_version(self):
+        """Identifies the index builds being searched; it changes whenever a shard is rebuilt."""
+        return ','.join(f"{shard.number}:{shard.build_id}" for shard in self.shards)
+
+    def query(self, query_text, k=5, nprobe=None, ef_search=None, hybrid=None, vector=None):
+        vectors = None if vector is None else np.asarray(vector, dtype='float32').reshape(1, -1)
+        results = self.query_many([query_text], k=k, vectors=vectors, nprobe=nprobe, ef_search=ef_search,
+                                  hybrid=hybrid)[0]
+        return self.distances_of(results), results
+
+    @staticmethod
+    def distances_of(results):
+        # Chunks found only by keyword have no vector distance (NaN)
+        return np.array([np.nan if result['distance'] is None else result['distance'] for result in results],
+                        dtype='float32')
+
+    def query_many(self, texts=None, k=5, vectors=None, nprobe=None, ef_search=None, hybrid=None,
+                   candidates=None, return_vectors=False):
+        """
+        Answer several queries with one embeddings request and one FAISS search per shard.
+
+        Args:
+            texts (list): Query strings; embedded unless ``vectors`` is given, and
+                still used for the BM25 keyword match of hybrid search
+            k (int): Results per query
+            vectors (array-like): Precomputed query vectors, one row per query
+            nprobe (int): Optional IVF nprobe override for this call
+            ef_search (int): Optional HNSW efSearch override for this call
+            hybrid (bool): Fuse in BM25 keyword matches; defaults to on when a
+                lexical index exists and query texts are given
+            candidates (int): Hits taken from each ranking before fusion; defaults to 4 * k
+            return_vectors (bool): Also return the query vectors, so callers reuse
+                the embeddings instead of requesting them again
+
+        Returns:
+            list: For each query, a list of result dicts, best first. Each holds
+                the chunk's metadata (text, file_id, mime_type, ...) plus ``id``
+                (the vector ID, with the shard number in its high bits) and
+                ``distance`` (L2, lower is closer). Hybrid results also carry
+                ``score`` (the fused RRF score) and ``bm25``; chunks found only by
+                keyword have ``distance`` None. With ``return_vectors``, a tuple
+                of that list and the float32 matrix of query vectors.
+        """
+        hybrid = hybrid is not False and self.hybrid and texts is not None
+        if vectors is None:
+            with metrics.span('query_embed'):
+                vectors = self.embedder.embed(texts)
+        vectors = np.ascontiguousarray(vectors, dtype='float32')
+        if len(vectors) == 0:
+            return ([], vectors) if return_vectors else []
+        metrics.inc('queries', len(vectors))
+        candidates = candidates or 4 * k
+        with metrics.span('vector_search'):
+            distances, indices = self.search(vectors, candidates if hybrid else k, nprobe=nprobe,
+                                             ef_search=ef_search)
+
+        rankings = []
+        for i, (row_distances, row_indices) in enumerate(zip(distances, indices)):
+            # -1 marks empty slots
+            vector_hits = {int(idx): float(distance) for distance, idx in zip(row_distances, row_indices) if idx != -1}
+            lexical_hits = {}
+            if hybrid:
+                with metrics.span('lexical_search'):
+                    lexical_hits = dict(self.lexical_search(texts[i], candidates))
+                fused = reciprocal_rank_fusion([list(vector_hits), list(lexical_hits)], k=self.rrf_k)[:k]
+            else:
+                fused = [(idx, None) for idx in vector_hits]
+            rankings.append((fused, vector_hits, lexical_hits))
+
+        # Resolve the metadata of every hit across all queries in one lookup per shard
+        with metrics.span('metadata_lookup'):
+            metadata = self.get_metadata({idx for fused, _, _ in rankings for idx, _ in fused})
+
+        all_results = []
+        for fused, vector_hits, lexical_hits in rankings:
+            results = []
+            for idx, score in fused:
+                if metadata.get(idx) is None:
+                    continue
+                result = dict(metadata[idx])
+                result['id'] = idx
+                result['distance'] = vector_hits.get(idx)
+                if hybrid:
+                    result['score'] = score
+                    result['bm25'] = lexical_hits.get(idx)
                 results.append(result)
-        
-        return distances[0], results
+            all_results.append(results)
+        return (all_results, vectors) if return_vectors else all_results
+
+    def search(self, query_vectors, k, nprobe=None, ef_search=None):
+        """Search every shard in parallel and merge the per-shard results into the top ``k``."""
+        results = self._map_shards(lambda shard: shard.search(query_vectors, k, nprobe=nprobe, ef_search=ef_search))
+        return merge_top_k(results, k)
+
+    def lexical_search(self, query_text, k):
+        corpus_stats = None
+        if len(self.shards) > 1:
+            # Each shard scores with the document counts of all shards, so BM25 scores from
+            # different shards are on one scale and can be merged by a single sort
+            stats = self._map_shards(lambda shard: shard.lexical_stats(query_text))
+            corpus_df = Counter()
+            for _, df in stats:
+                corpus_df.update(df)
+            corpus_stats = (sum(n_chunks for n_chunks, _ in stats), corpus_df)
+        shard_hits = self._map_shards(lambda shard: shard.lexical_search(query_text, k, corpus_stats=corpus_stats))
+        hits = [hit for hits in shard_hits for hit in hits]
+        return sorted(hits, key=lambda hit: hit[1], reverse=True)[:k]
+
+    def get_metadata(self, ids):
+        by_shard = {}
+        for idx in ids:
+            by_shard.setdefault(split_id(idx)[0], []).append(idx)
+        metadata = {}
+        for number, shard_ids in by_shard.items():
+            shard = self._shards_by_number.get(number)
+            if shard is not None:
+                metadata.update(zip(shard_ids, shard.get_many(shard_ids)))
+        return metadata
+
+    def vectors_of(self, results):
+        """
+        Embeddings of result chunks, one row per result.
+
+        Vectors are read back from their shard's index; those it cannot
+        reconstruct are embedded from the chunk text (usually an embedding cache hit).
+        """
+        vectors = []
+        for result in results:
+            shard = self._shards_by_number.get(split_id(result['id'])[0])
+            vectors.append(shard.reconstruct(result['id']) if shard is not None else None)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            with metrics.span('query_embed'):
+                embedded = self.embedder.embed([results[i].get('text') or '' for i in missing])
+            for i, vector in zip(missing, embedded):
+                vectors[i] = vector
+        return np.asarray(vectors, dtype='float32')
+
+    def _map_shards(self, fn):
+        # FAISS releases the GIL while searching, so shards are searched concurrently
+        if self._executor is None:
+            return [fn(shard) for shard in self.shards]
+        # Each task runs in a copy of the caller's context so spans reach the request's trace
+        contexts = [contextvars.copy_context() for _ in self.shards]
+        return list(self._executor.map(lambda context, shard: context.run(fn, shard), contexts, self.shards))
 
     def get_file_content(self, file_id, mime_type):
         """Get text content from various file types."""
@@ -88,10 +258,7 @@ class FaissQuery:
             return None
 
     def text_to_vector(self, text):
-        # Use OpenAI API to get the embeddings
-        response = client.embeddings.create(input=text, model="text-embedding-ada-002")
-        vector = response.data[0].embedding
-        return vector
+        return self.embedding_backend.embed([text])[0]
 
 if __name__ == "__main__":
     truststore.inject_into_ssl()
@@ -105,17 +272,11 @@ if __name__ == "__main__":
     # Convert user input to query vector
     query_vector = faiss_query.text_to_vector(user_input)
 
-    distances, results = faiss_query.query(user_input, k=5)
+    distances, results = faiss_query.query(user_input, k=5, vector=query_vector)
 
     logger.info("Query results:")
-    files = faiss_query.client.list_files()
     for i, (dist, result) in enumerate(zip(distances, results)):
-        logger.info("Result %d: Distance %f", i, dist)
-        file_id = result['file_id']
-        mime_type = result['mime_type']
-        file_content = faiss_query.get_file_content(file_id, mime_type)
-        if file_content:
-            logger.info("File Content: %s", file_content)
-        else:
-            logger.info("File Content: Not found")
+        logger.info("Result %d: Distance %f (file %s)", i, dist, result['file_id'])
+        # The matching chunk is stored in the metadata, so nothing is downloaded here
+        logger.info("Chunk Content: %s", result.get('text', 'Not found'))
 
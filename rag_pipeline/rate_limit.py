@@ -0,0 +1,356 @@
+import re
+import time
+import random
+import logging
+import threading
+import contextvars
+from email.utils import parsedate_to_datetime
+
+from rag_pipeline import metrics
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth retrying: throttling, timeouts and transient server errors
+RETRYABLE_STATUSES = (408, 409, 429, 500, 502, 503, 504)
+THROTTLE_STATUSES = (429,)
+
+# Client errors raised without an HTTP status that are still transient
+_TRANSIENT_ERRORS = ('APIConnectionError', 'APITimeoutError', 'ServerNotFoundError')
+
+# The scheduler whose call is running on this thread, for report_headers
+_current_scheduler = contextvars.ContextVar('docurag_scheduler', default=None)
+
+
+class RequestError(Exception):
+    """An HTTP error that carries the status and response headers a scheduler reads."""
+
+    def __init__(self, message, status_code, headers=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def parse_duration(value):
+    """
+    Seconds in a rate-limit header value: ``"1.5"``, ``"20ms"``, ``"6m0s"``, ``"1h2m3s"``.
+
+    Returns None if the value cannot be parsed.
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value)
+    if not parts or ''.join(number + unit for number, unit in parts) != value:
+        return None
+    scale = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+    return sum(float(number) * scale[unit] for number, unit in parts)
+
+
+def retry_after(headers):
+    """Seconds the server asked us to wait, from ``retry-after-ms`` or ``retry-after``."""
+    if not headers:
+        return None
+    milliseconds = parse_duration(headers.get('retry-after-ms'))
+    if milliseconds is not None:
+        return milliseconds / 1000
+    value = headers.get('retry-after')
+    seconds = parse_duration(value)
+    if seconds is None and value:
+        # Retry-After may also be an HTTP date
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return max(0.0, seconds) if seconds is not None else None
+
+
+def error_status(error):
+    """HTTP status of an OpenAI, googleapiclient or RequestError exception, or None."""
+    status = getattr(error, 'status_code', None)
+    if status is None and getattr(error, 'resp', None) is not None:
+        # googleapiclient's HttpError wraps an httplib2 response
+        status = getattr(error.resp, 'status', None)
+    return int(status) if status is not None else None
+
+
+def error_headers(error):
+    headers = getattr(error, 'headers', None)
+    if headers is None:
+        headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if headers is None:
+        # httplib2 responses are dicts of lower-cased headers
+        headers = getattr(error, 'resp', None)
+    return headers if hasattr(headers, 'get') else None
+
+
+def is_throttled(error):
+    status = error_status(error)
+    if status in THROTTLE_STATUSES:
+        return True
+    # Drive reports exceeded quotas as 403 rateLimitExceeded / userRateLimitExceeded
+    content = getattr(error, 'content', None)
+    return status == 403 and isinstance(content, bytes) and b'ratelimitexceeded' in content.lower()
+
+
+def is_retryable(error):
+    if is_throttled(error) or error_status(error) in RETRYABLE_STATUSES:
+        return True
+    if error_status(error) is not None:
+        return False
+    return isinstance(error, (ConnectionError, TimeoutError)) or type(error).__name__ in _TRANSIENT_ERRORS
+
+
+def report_headers(headers):
+    """
+    Pass a successful response's headers to the scheduler running this call.
+
+    Backends call this so the scheduler can follow the server's own count of
+    remaining requests and tokens; outside a scheduled call it does nothing.
+    """
+    scheduler = _current_scheduler.get()
+    if scheduler is not None and headers is not None:
+        scheduler.update_from_headers(headers)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at ``rate`` units per minute.
+
+    It holds at most ``capacity`` units, one second's worth by default, so a
+    per-minute budget is spent evenly instead of in a burst at the start of each
+    minute. Callers reserve units up front and sleep for however long the
+    reservation says, which keeps waiting callers in arrival order. A bucket
+    without a rate never makes anyone wait until a limit is learned from
+    response headers.
+
+    Args:
+        rate (float): Units per minute; None for no limit
+        capacity (float): Most units available at once
+    """
+
+    def __init__(self, rate=None, capacity=None):
+        self._lock = threading.Lock()
+        self._configure(rate, capacity)
+
+    def _configure(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or (max(1.0, rate / 60.0) if rate else None)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def __getstate__(self):
+        # Buckets are copied into shard ingest processes; each copy gets its own lock
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if self.rate:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate / 60.0)
+        self.updated = now
+
+    def reserve(self, amount=1):
+        """Take ``amount`` units and return the seconds to wait before using them."""
+        with self._lock:
+            if not self.rate:
+                return 0.0
+            self._refill(time.monotonic())
+            # A request larger than the bucket waits for a full bucket, not forever
+            self.tokens -= min(amount, self.capacity)
+            return 0.0 if self.tokens >= 0 else -self.tokens * 60.0 / self.rate
+
+    def take(self, amount=1):
+        """Take ``amount`` units only if they are available now; returns whether they were."""
+        with self._lock:
+            if not self.rate:
+                return True
+            self._refill(time.monotonic())
+            amount = min(amount, self.capacity)
+            if self.tokens < amount:
+                return False
+            self.tokens -= amount
+            return True
+
+    def seconds_until(self, amount=1):
+        """Seconds until ``amount`` units are available; 0 if they already are."""
+        with self._lock:
+            if not self.rate:
+                return 0.0
+            self._refill(time.monotonic())
+            return max(0.0, min(amount, self.capacity) - self.tokens) * 60.0 / self.rate
+
+    def update(self, limit=None, remaining=None, reset=None):
+        """
+        Follow the server's view of this budget.
+
+        An unlimited bucket adopts the server's ``limit``. If the server has
+        fewer units ``remaining`` than the bucket holds, e.g. because other
+        clients share the key, the bucket drops to that; once nothing remains,
+        new reservations wait until ``reset`` seconds from now.
+        """
+        with self._lock:
+            if limit and (not self.rate or limit < self.rate):
+                self._configure(float(limit))
+            if not self.rate or remaining is None:
+                return
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, float(remaining))
+            if remaining <= 0 and reset:
+                self.tokens = min(self.tokens, -reset * self.rate / 60.0)
+
+
+class RequestScheduler:
+    """
+    Throttles, retries and paces calls to one rate-limited API.
+
+    Every call first reserves a request, plus its estimated tokens, from
+    requests-per-minute and tokens-per-minute token buckets, then takes one of
+    ``concurrency`` in-flight slots. The reservation is made once per call, not
+    again for each retry. The buckets follow OpenAI-style
+    ``x-ratelimit-*`` headers, so limits the server reports are respected even
+    when none were configured.
+
+    Failed calls that are worth retrying (429, 5xx, timeouts, dropped
+    connections) are retried with full-jitter exponential backoff, waiting at
+    least as long as a ``Retry-After`` header asks. Concurrency adapts AIMD-style:
+    each success raises it by ``1 / concurrency`` and a throttled call halves
+    it, at most once per ``base_delay``, so it settles just under the point
+    where the server starts refusing requests.
+
+    Share one scheduler between everything that uses the same API key.
+
+    Args:
+        requests_per_minute (float): Request budget; None to only follow headers
+        tokens_per_minute (float): Token budget; None to only follow headers
+        max_concurrency (int): Most calls in flight, and the starting concurrency
+        min_concurrency (int): Concurrency is never reduced below this
+        max_retries (int): Retries of one call before its error is raised
+        base_delay (float): First backoff, in seconds; doubles with each retry
+        max_delay (float): Longest backoff, in seconds
+        name (str): Label for metrics and logs
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, max_concurrency=8, min_concurrency=1,
+                 max_retries=8, base_delay=0.5, max_delay=60.0, name='api'):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = float(max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.name = name
+        self.retries = 0
+        self.throttled = 0
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._resume_at = 0.0
+        self._cond = threading.Condition()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_cond']
+        state['_in_flight'] = 0
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cond = threading.Condition()
+
+    def call(self, fn, *args, tokens=0, **kwargs):
+        """
+        Call ``fn(*args, **kwargs)`` within the budgets, retrying transient failures.
+
+        Args:
+            fn (callable): The API call
+            tokens (int): Estimated tokens the call consumes
+
+        Returns:
+            Whatever ``fn`` returns; the last error is raised once retries run out
+        """
+        for attempt in range(self.max_retries + 1):
+            # After a throttled call everyone waits out the server's Retry-After, not just its caller
+            with self._cond:
+                wait = max(self._resume_at - time.monotonic(), 0.0)
+            if attempt == 0:
+                # The budget is reserved once per call; retries are paced by backoff and Retry-After
+                wait = max(wait, self.requests.reserve(1), self.tokens.reserve(tokens) if tokens else 0.0)
+            if wait > 0:
+                metrics.observe('rate_limit_wait', wait, api=self.name)
+                time.sleep(wait)
+            self._acquire_slot()
+            scheduled = _current_scheduler.set(self)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                throttled = is_throttled(e)
+                self._release_slot(throttled)
+                headers = error_headers(e)
+                if headers is not None:
+                    self.update_from_headers(headers)
+                if not is_retryable(e) or attempt == self.max_retries:
+                    raise
+                server_delay = retry_after(headers)
+                if throttled and server_delay:
+                    with self._cond:
+                        self._resume_at = max(self._resume_at,
+                                              time.monotonic() + min(server_delay, self.max_delay))
+                delay = self.backoff(attempt, server_delay)
+                self.retries += 1
+                metrics.inc('rate_limit_retries', api=self.name, status=str(error_status(e) or 'error'))
+                logger.warning("%s call failed (%s); retry %d/%d in %.2fs", self.name, e, attempt + 1,
+                               self.max_retries, delay)
+                time.sleep(delay)
+                continue
+            finally:
+                _current_scheduler.reset(scheduled)
+            self._release_slot(False)
+            return result
+
+    def backoff(self, attempt, server_delay=None):
+        # Full jitter spreads out clients that were throttled at the same moment
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if server_delay is not None:
+            delay = max(delay, min(server_delay, self.max_delay))
+        return delay
+
+    def update_from_headers(self, headers):
+        """Apply OpenAI-style ``x-ratelimit-{limit,remaining,reset}-{requests,tokens}`` headers."""
+        for kind, bucket in (('requests', self.requests), ('tokens', self.tokens)):
+            limit = parse_duration(headers.get(f'x-ratelimit-limit-{kind}'))
+            remaining = parse_duration(headers.get(f'x-ratelimit-remaining-{kind}'))
+            if limit is None and remaining is None:
+                continue
+            bucket.update(limit=limit, remaining=remaining,
+                          reset=parse_duration(headers.get(f'x-ratelimit-reset-{kind}')))
+
+    def _acquire_slot(self):
+        with self._cond:
+            while self._in_flight >= max(self.min_concurrency, int(self.concurrency)):
+                self._cond.wait()
+            self._in_flight += 1
+
+    def _release_slot(self, throttled):
+        with self._cond:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                self.throttled += 1
+                metrics.inc('rate_limit_throttled', api=self.name)
+                # Calls already in flight when the limit was hit fail together; back off once for all of them
+                if now - self._last_decrease >= self.base_delay:
+                    self.concurrency = max(float(self.min_concurrency), self.concurrency / 2)
+                    self._last_decrease = now
+            else:
+                self.concurrency = min(float(self.max_concurrency), self.concurrency + 1 / self.concurrency)
+            metrics.set_gauge('rate_limit_concurrency', self.concurrency, api=self.name)
+            self._cond.notify_all()
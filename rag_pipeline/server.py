@@ -0,0 +1,287 @@
+import os
+import sys
+import json
+import time
+import queue
+import logging
+import argparse
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from rag_pipeline.agent import RAGAgent
+from rag_pipeline import metrics
+
+logger = logging.getLogger(__name__)
+
+# Tells a batcher thread to exit
+_STOP = object()
+
+
+class MicroBatcher:
+    """
+    Gathers concurrently submitted items into small batches for one processing call.
+
+    A batch starts with the first waiting item and closes after ``max_batch_size``
+    items or ``max_wait`` seconds, whichever comes first. While a batch is being
+    processed new items queue up, so under load batches grow on their own and
+    ``max_wait`` only bounds the delay added when traffic is light.
+
+    Items carry a key; items with different keys in the same batch are processed
+    in separate calls, since they cannot share one (e.g. different ``k``).
+
+    Args:
+        process (callable): ``process(key, items) -> results``, one result per item
+        max_batch_size (int): Most items per batch
+        max_wait (float): Longest time, in seconds, a batch waits to fill
+        workers (int): Batches processed concurrently
+    """
+
+    def __init__(self, process, max_batch_size=32, max_wait=0.002, workers=1):
+        self.process = process
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._threads = [threading.Thread(target=self._run, name=f'micro-batcher-{i}', daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, key, item):
+        """Queue ``item`` and return a Future for its result."""
+        future = Future()
+        self._queue.put((key, item, future))
+        return future
+
+    def _next_batch(self):
+        first = self._queue.get()
+        if first is _STOP:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                timeout = deadline - time.monotonic()
+                entry = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                # Finish this batch; the next loop sees the stop marker again
+                self._queue.put(_STOP)
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            groups = {}
+            for key, item, future in batch:
+                groups.setdefault(key, []).append((item, future))
+            metrics.inc('batches')
+            metrics.inc('batched_items', len(batch))
+            for key, entries in groups.items():
+                futures = [future for _, future in entries]
+                try:
+                    with metrics.span('batch_process'):
+                        results = list(self.process(key, [item for item, _ in entries]))
+                except Exception as e:
+                    logger.error(f"Failed to process batch of {len(entries)} items: {str(e)}")
+                    for future in futures:
+                        future.set_exception(e)
+                    continue
+                if len(results) != len(futures):
+                    logger.error(f"Batch of {len(futures)} items returned {len(results)} results")
+                for future, result in zip(futures, results):
+                    future.set_result(result)
+                # Items left without a result fail rather than wait forever
+                for future in futures[len(results):]:
+                    future.set_exception(RuntimeError(f"No result for item in batch of {len(futures)}"))
+
+    def close(self):
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+
+
+class _BatchedAgent(RAGAgent):
+    # Retrieval, and so embedding the question, goes through the service's
+    # micro-batcher instead of one request per question
+    service = None
+
+    def _search(self, question, k, vector=None):
+        return self.service.search(question, k=k, vector=vector)
+
+
+class QueryService:
+    """
+    Loads a store once and answers queries with micro-batched retrieval.
+
+    Concurrent queries with the same parameters are embedded in one request and
+    searched with one FAISS search per shard via ``FaissQuery.query_many``.
+
+    Args:
+        faiss_index_path (str): Index file or sharded store directory
+        max_batch_size (int): Most queries per batch
+        max_wait (float): Longest time, in seconds, a query waits for others to batch with
+        batch_workers (int): Batches searched concurrently
+        request_timeout (float): Longest, in seconds, a query waits for its batch's results
+        **agent_options: Passed to RAGAgent (model, mmap_index, chat_client, ...)
+    """
+
+    def __init__(self, faiss_index_path, max_batch_size=32, max_wait=0.002, batch_workers=1, request_timeout=60.0,
+                 **agent_options):
+        self.request_timeout = request_timeout
+        self.agent = _BatchedAgent(faiss_index_path, **agent_options)
+        self.agent.service = self
+        self.faiss_query = self.agent.faiss_query
+        self.batcher = MicroBatcher(self._search, max_batch_size=max_batch_size, max_wait=max_wait,
+                                    workers=batch_workers)
+
+    def _search(self, key, items):
+        k, hybrid, nprobe, ef_search, embedded = key
+        texts = [text for text, _ in items]
+        # Queries embedded by the caller are not embedded again
+        vectors = np.vstack([vector for _, vector in items]) if embedded else None
+        results, vectors = self.faiss_query.query_many(texts, k=k, vectors=vectors, hybrid=hybrid, nprobe=nprobe,
+                                                       ef_search=ef_search, return_vectors=True)
+        return list(zip(results, vectors))
+
+    def search(self, text, k=5, hybrid=None, nprobe=None, ef_search=None, vector=None):
+        """Search for ``text``, batched with concurrent queries; returns the result dicts and its vector."""
+        key = (k, hybrid, nprobe, ef_search, vector is not None)
+        return self.batcher.submit(key, (text, vector)).result(timeout=self.request_timeout)
+
+    def query(self, text, k=5, hybrid=None, nprobe=None, ef_search=None, vector=None):
+        """Search for ``text``, batched with concurrent queries; returns the result dicts."""
+        results, _ = self.search(text, k=k, hybrid=hybrid, nprobe=nprobe, ef_search=ef_search, vector=vector)
+        return results
+
+    def answer(self, question, k=5, temperature=0.7):
+        return self.agent.answer_question(question, k=k, temperature=temperature)
+
+    def close(self):
+        self.batcher.close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive connections, so clients do not pay a TCP handshake per query
+    protocol_version = 'HTTP/1.1'
+    service = None
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/health':
+            self._send_json(200, {'status': 'ok', 'vectors': sum(shard.index.ntotal
+                                                                 for shard in self.service.faiss_query.shards)})
+        elif path == '/metrics':
+            body = metrics.render().encode('utf-8')
+            self._send(200, body, 'text/plain; version=0.0.4; charset=utf-8')
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        path = self.path.split('?')[0]
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send_json(400, {'error': 'request body must be JSON'})
+            return
+        try:
+            if path == '/query':
+                if not isinstance(request.get('query'), str):
+                    self._send_json(400, {'error': "missing 'query'"})
+                    return
+                with metrics.span('http_query'):
+                    results = self.service.query(request['query'], k=int(request.get('k', 5)),
+                                                 hybrid=request.get('hybrid'), nprobe=request.get('nprobe'),
+                                                 ef_search=request.get('ef_search'))
+                self._send_json(200, {'results': results})
+            elif path == '/answer':
+                if not isinstance(request.get('question'), str):
+                    self._send_json(400, {'error': "missing 'question'"})
+                    return
+                with metrics.span('http_answer'):
+                    answer = self.service.answer(request['question'], k=int(request.get('k', 5)),
+                                                 temperature=float(request.get('temperature', 0.7)))
+                self._send_json(200, {'answer': answer})
+            else:
+                self._send_json(404, {'error': 'not found'})
+        except TimeoutError:
+            logger.error(f"Timed out handling {path}")
+            self._send_json(504, {'error': 'timed out waiting for results'})
+        except Exception as e:
+            logger.error(f"Error handling {path}: {str(e)}")
+            self._send_json(500, {'error': str(e)})
+
+    def _send_json(self, status, payload):
+        self._send(status, json.dumps(payload).encode('utf-8'), 'application/json')
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def make_server(service, host='127.0.0.1', port=8080):
+    """
+    HTTP server for a QueryService; call ``serve_forever()`` on it.
+
+    Endpoints:
+        POST /query   {"query": str, "k": int, "hybrid": bool, "nprobe": int, "ef_search": int}
+        POST /answer  {"question": str, "k": int, "temperature": float}
+        GET  /health
+        GET  /metrics (Prometheus text format)
+    """
+    handler = type('Handler', (_Handler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve queries and answers over HTTP from a loaded index")
+    parser.add_argument('--index', default='./vector_store/faiss_index.index',
+                        help="Index file or sharded store directory")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--model', default='gpt-4o')
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-wait-ms', type=float, default=2.0, help="Longest a query waits to be batched")
+    parser.add_argument('--batch-workers', type=int, default=1, help="Batches searched concurrently")
+    parser.add_argument('--request-timeout', type=float, default=60.0,
+                        help="Longest, in seconds, a query waits for its results")
+    parser.add_argument('--mmap', action='store_true', help="Memory-map the index instead of reading it into RAM")
+    parser.add_argument('--metrics', action='store_true', help="Collect metrics for GET /metrics")
+    parser.add_argument('--answer-cache', action='store_true', help="Reuse answers to near-identical questions")
+    parser.add_argument('--context-tokens', type=int, default=3000, help="Token budget of each answer's context")
+    args = parser.parse_args()
+
+    if args.metrics:
+        metrics.enable()
+    service = QueryService(args.index, max_batch_size=args.max_batch_size, max_wait=args.max_wait_ms / 1000,
+                           batch_workers=args.batch_workers, request_timeout=args.request_timeout,
+                           model=args.model, mmap_index=args.mmap,
+                           use_answer_cache=args.answer_cache, context_tokens=args.context_tokens)
+    server = make_server(service, host=args.host, port=args.port)
+    logger.info("Serving %s on http://%s:%d", args.index, args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
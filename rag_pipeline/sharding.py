@@ -0,0 +1,271 @@
+import os
+import sys
+import json
+import zlib
+import shutil
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from rag_pipeline.index_factory import load_index, load_params, search_parameters, set_search_params
+from rag_pipeline.metadata_store import MetadataStore
+from rag_pipeline.manifest import replace_durably
+from rag_pipeline.lexical_index import LexicalIndex
+from rag_pipeline import metrics
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_FILE = 'shards.json'
+SHARD_INDEX_FILE = 'faiss_index.index'
+
+# Result IDs carry the shard number in their high bits so they stay unique across shards
+SHARD_ID_BITS = 48
+LOCAL_ID_MASK = (1 << SHARD_ID_BITS) - 1
+
+
+def global_id(shard_number, vector_id):
+    return (shard_number << SHARD_ID_BITS) | int(vector_id)
+
+
+def split_id(result_id):
+    """Return ``(shard_number, vector_id)`` for a result ID."""
+    return int(result_id) >> SHARD_ID_BITS, int(result_id) & LOCAL_ID_MASK
+
+
+def in_partition(file_id, partition):
+    """True if ``file_id`` belongs to ``partition``, an ``(index, count)`` pair or None."""
+    if partition is None:
+        return True
+    index, count = partition
+    return zlib.crc32(file_id.encode('utf-8')) % count == index
+
+
+def is_sharded(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, REGISTRY_FILE))
+
+
+class ShardedStore:
+    """
+    A vector store split into independently built shards.
+
+    Each shard is a complete index (FAISS file plus manifest, metadata and
+    lexical sidecars) in its own directory under ``root``, holding one source
+    folder or one hash partition of a folder. ``shards.json`` lists the shards;
+    it is only ever replaced atomically, so readers always see a consistent set.
+
+    Args:
+        root (str): Directory holding the registry and the shard directories
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.path = os.path.join(root, REGISTRY_FILE)
+        self.next_number = 0
+        self.shards = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            self.next_number = data.get('next_number', 0)
+            self.shards = data.get('shards', {})
+
+    def save(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'next_number': self.next_number, 'shards': self.shards}, f, indent=2)
+        replace_durably(tmp_path, self.path)
+
+    def index_path(self, name):
+        return os.path.join(self.root, self.shards[name]['dir'], SHARD_INDEX_FILE)
+
+    def add_shard(self, name, folder_id=None, partition=None):
+        """Register a shard for ``folder_id`` (or one hash ``partition`` of it)."""
+        if name in self.shards:
+            raise ValueError(f"Shard {name!r} already exists")
+        self.shards[name] = {
+            'number': self.next_number,
+            'dir': name,
+            'folder_id': folder_id,
+            'partition': list(partition) if partition else None,
+        }
+        # Numbers are never reused, so result IDs of a removed shard cannot resolve to another
+        self.next_number += 1
+        self.save()
+        return self.shards[name]
+
+    def remove_shard(self, name):
+        shard = self.shards.pop(name)
+        self.save()
+        shutil.rmtree(os.path.join(self.root, shard['dir']), ignore_errors=True)
+
+    def staging_path(self, name):
+        """Index path for a replacement of shard ``name``, built next to the live one."""
+        generation = self.shards[name].get('generation', 0) + 1
+        return os.path.join(self.root, f"{name}.{generation}", SHARD_INDEX_FILE)
+
+    def replace_shard(self, name, staged_index_path):
+        """Swap in a shard rebuilt at ``staged_index_path`` and delete the old one."""
+        shard = self.shards[name]
+        old_dir = shard['dir']
+        shard['dir'] = os.path.basename(os.path.dirname(staged_index_path))
+        shard['generation'] = shard.get('generation', 0) + 1
+        self.save()
+        shutil.rmtree(os.path.join(self.root, old_dir), ignore_errors=True)
+
+
+def folder_shards(folder_ids):
+    """Shard specs with one shard per source folder."""
+    return [{'name': f"folder-{folder_id}", 'folder_id': folder_id} for folder_id in folder_ids]
+
+
+def partition_shards(folder_id, count, prefix='part'):
+    """Shard specs splitting one folder into ``count`` shards of similar size by file ID hash."""
+    return [{'name': f"{prefix}-{i}", 'folder_id': folder_id, 'partition': (i, count)} for i in range(count)]
+
+
+def ingest_shards(store, specs, processes=1, client_factory=None, rebuild=False, **preprocessor_options):
+    """
+    Build or update shards, each in its own process when ``processes`` > 1.
+
+    Each shard is ingested by an independent Preprocessor writing only its own
+    files, so shards never contend. The registry is only written here, in the
+    parent process.
+
+    Args:
+        store (ShardedStore): Store the shards belong to
+        specs (list): Dicts with ``name``, ``folder_id`` and optional ``partition``
+        processes (int): Concurrent worker processes
+        client_factory (callable): Picklable zero-argument callable returning the
+            drive client inside a worker; the client is built from the environment
+            when omitted
+        rebuild (bool): Build each shard from scratch next to the live one and
+            swap it in when done, leaving the live shard searchable meanwhile
+        **preprocessor_options: Passed to every Preprocessor
+
+    Returns:
+        dict: Shard name -> the ingest's stage statistics
+    """
+    jobs = []
+    for spec in specs:
+        if spec['name'] not in store.shards:
+            store.add_shard(spec['name'], spec.get('folder_id'), spec.get('partition'))
+        shard = store.shards[spec['name']]
+        if rebuild:
+            path = store.staging_path(spec['name'])
+            # Leftovers of an interrupted rebuild are discarded
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+        else:
+            path = store.index_path(spec['name'])
+        partition = tuple(shard['partition']) if shard['partition'] else None
+        jobs.append((spec['name'], path, shard['folder_id'], partition))
+
+    args = [(path, folder_id, partition, client_factory, preprocessor_options)
+            for _, path, folder_id, partition in jobs]
+    if processes > 1:
+        # Spawned, not forked: the parent may already hold threads and SQLite connections
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn')) as executor:
+            results = list(executor.map(_ingest_shard, *zip(*args)))
+    else:
+        results = [_ingest_shard(*arg) for arg in args]
+
+    stats = {}
+    for (name, path, _, _), result in zip(jobs, results):
+        if rebuild:
+            store.replace_shard(name, path)
+        stats[name] = result
+    return stats
+
+
+def _ingest_shard(faiss_index_path, folder_id, partition, client_factory, options):
+    from preprocessing.preprocessing import Preprocessor
+
+    os.makedirs(os.path.dirname(faiss_index_path), exist_ok=True)
+    if client_factory is not None:
+        options = dict(options, drive_client=client_factory())
+    preprocessor = Preprocessor(faiss_index_path, **options)
+    preprocessor.run(folder_id=folder_id, partition=partition)
+    return preprocessor.stage_stats
+
+
+class IndexShard:
+    """
+    Read-only view of one index and its sidecars, as searched by FaissQuery.
+
+    Args:
+        faiss_index_path (str): The shard's FAISS index file
+        number (int): Shard number placed in the high bits of result IDs
+        hybrid (bool): Open the lexical index too, if there is one
+        mmap (bool): Memory-map the index read-only instead of reading it into RAM
+    """
+
+    def __init__(self, faiss_index_path, number=0, hybrid=True, mmap=False):
+        self.faiss_index_path = faiss_index_path
+        self.number = number
+        # nprobe/efSearch default to the values chosen when the index was built
+        self.index_params = load_params(faiss_index_path)
+        self.index = load_index(faiss_index_path, self.index_params, mmap=mmap)
+        # Indexes built before build IDs were recorded are identified by their file instead
+        stat = os.stat(faiss_index_path)
+        self.build_id = self.index_params.get('build_id') or f"{stat.st_mtime_ns}-{stat.st_size}"
+        set_search_params(self.index, nprobe=self.index_params.get('nprobe'),
+                          ef_search=self.index_params.get('ef_search'))
+        # Rows are read on demand, so startup cost does not grow with the corpus
+        self.metadata = MetadataStore.for_index(faiss_index_path, read_only=True)
+        self.lexical = LexicalIndex.for_index(faiss_index_path, read_only=True) if hybrid else None
+
+    def search(self, query_vectors, k, nprobe=None, ef_search=None):
+        """Search the index, returning result IDs; nprobe/efSearch overrides apply to this call only."""
+        with metrics.span('shard_search', shard=self.number):
+            # Per-query overrides trade recall for latency on IVF/HNSW indexes; they are
+            # passed with the call, so concurrent searches never see each other's
+            params = search_parameters(self.index, nprobe=nprobe, ef_search=ef_search)
+            distances, indices = self.index.search(query_vectors, k, params=params)
+        if self.number:
+            indices = np.where(indices == -1, -1, (self.number << SHARD_ID_BITS) | indices)
+        return distances, indices
+
+    def lexical_search(self, query_text, k, corpus_stats=None):
+        if self.lexical is None:
+            return []
+        return [(global_id(self.number, chunk_id), score)
+                for chunk_id, score in self.lexical.search(query_text, k, corpus_stats=corpus_stats)]
+
+    def lexical_stats(self, query_text):
+        return self.lexical.term_stats(query_text) if self.lexical is not None else (0, {})
+
+    def get_many(self, vector_ids):
+        return self.metadata.get_many([vector_id & LOCAL_ID_MASK for vector_id in vector_ids])
+
+    def reconstruct(self, vector_id):
+        """The stored vector of a result ID, or None if the index cannot reconstruct it."""
+        try:
+            return self.index.reconstruct(int(vector_id) & LOCAL_ID_MASK)
+        except RuntimeError:
+            # IVF indexes without a direct map cannot look vectors up by ID
+            return None
+
+
+def open_shards(path, hybrid=True, mmap=False):
+    """IndexShards for a sharded store directory, or a single shard for a plain index file."""
+    if not is_sharded(path):
+        return [IndexShard(path, hybrid=hybrid, mmap=mmap)]
+    store = ShardedStore(path)
+    return [IndexShard(store.index_path(name), number=shard['number'], hybrid=hybrid, mmap=mmap)
+            for name, shard in sorted(store.shards.items(), key=lambda item: item[1]['number'])
+            if os.path.exists(store.index_path(name))]
+
+
+def merge_top_k(results, k):
+    """Merge per-shard ``(distances, ids)`` search results into the overall top ``k`` per query."""
+    if len(results) == 1:
+        return results[0]
+    distances = np.hstack([d for d, _ in results])
+    indices = np.hstack([i for _, i in results])
+    # Empty slots (-1) sort last
+    distances = np.where(indices == -1, np.inf, distances)
+    order = np.argsort(distances, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(distances, order, axis=1), np.take_along_axis(indices, order, axis=1)
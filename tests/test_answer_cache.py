@@ -0,0 +1,87 @@
+import os
+import sys
+import time
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from rag_pipeline.answer_cache import AnswerCache
+
+
+def _vector(i, dimension=16):
+    vector = np.zeros(dimension, dtype='float32')
+    vector[i % dimension] = 1.0
+    vector[(i // dimension) % dimension] += 0.5
+    return vector
+
+
+def test_similar_question_with_same_chunks_hits(tmp_path):
+    cache = AnswerCache(str(tmp_path / 'answers.sqlite'), threshold=0.95)
+    cache.put('gpt-4o', _vector(1), [3, 4], 'answer one')
+    nearby = _vector(1) + np.full(16, 0.01, dtype='float32')
+    assert cache.get('gpt-4o', nearby, [3, 4]) == 'answer one'
+    assert cache.get('gpt-4o', nearby, [3, 5]) is None
+    assert cache.get('gpt-4', nearby, [3, 4]) is None
+    assert cache.get('gpt-4o', _vector(2), [3, 4]) is None
+    assert (cache.hits, cache.misses) == (1, 3)
+    cache.close()
+
+
+def test_entries_expire_after_the_ttl(tmp_path):
+    cache = AnswerCache(str(tmp_path / 'answers.sqlite'), ttl=0.2)
+    cache.put('gpt-4o', _vector(1), [1], 'old')
+    assert cache.get('gpt-4o', _vector(1), [1]) == 'old'
+    time.sleep(0.3)
+    assert cache.get('gpt-4o', _vector(1), [1]) is None
+    cache.put('gpt-4o', _vector(2), [2], 'new')
+    assert len(cache) == 1
+    cache.close()
+    with sqlite3.connect(str(tmp_path / 'answers.sqlite')) as conn:
+        assert conn.execute("SELECT answer FROM answers").fetchall() == [('new',)]
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = AnswerCache(str(tmp_path / 'answers.sqlite'), max_entries=3)
+    for i in range(3):
+        cache.put('gpt-4o', _vector(i), [i], f"answer {i}")
+        time.sleep(0.01)
+    # Using the oldest entry keeps it; the next put evicts the least recently used instead
+    assert cache.get('gpt-4o', _vector(0), [0]) == 'answer 0'
+    cache.put('gpt-4o', _vector(3), [3], 'answer 3')
+    assert len(cache) == 3
+    assert cache.get('gpt-4o', _vector(0), [0]) == 'answer 0'
+    assert cache.get('gpt-4o', _vector(1), [1]) is None
+    cache.close()
+
+
+def test_cache_is_cleared_for_a_new_index_build(tmp_path):
+    path = str(tmp_path / 'answers.sqlite')
+    cache = AnswerCache(path, index_version='build-a')
+    cache.put('gpt-4o', _vector(1), [1], 'answer')
+    cache.close()
+    reopened = AnswerCache(path, index_version='build-a')
+    assert reopened.get('gpt-4o', _vector(1), [1]) == 'answer'
+    reopened.close()
+    rebuilt = AnswerCache(path, index_version='build-b')
+    assert len(rebuilt) == 0 and rebuilt.get('gpt-4o', _vector(1), [1]) is None
+    rebuilt.close()
+
+
+def test_many_entries_and_concurrent_lookups(tmp_path):
+    cache = AnswerCache(str(tmp_path / 'answers.sqlite'), max_entries=200, threshold=0.99)
+    for i in range(250):
+        cache.put('gpt-4o', _vector(i), [i], f"answer {i}")
+    assert len(cache) == 200
+    # Entries reload from disk in the same order
+    cache.close()
+    cache = AnswerCache(str(tmp_path / 'answers.sqlite'), max_entries=200, threshold=0.99)
+    assert len(cache) == 200
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        answers = list(pool.map(lambda i: cache.get('gpt-4o', _vector(i), [i]), range(50, 250)))
+    assert answers == [f"answer {i}" for i in range(50, 250)]
+    assert cache.hits + cache.misses == 200 and cache.hit_rate == 1.0
+    cache.close()
@@ -0,0 +1,108 @@
+import os
+import sys
+import asyncio
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.corpus import SyntheticCorpus
+from data_extraction.gdrive_extraction import GoogleDriveClient
+from preprocessing.preprocessing import Preprocessor
+from rag_pipeline.agent import RAGAgent
+from rag_pipeline.async_agent import AsyncRAGAgent
+from rag_pipeline.embeddings import FakeEmbeddingBackend
+from rag_pipeline.fake_chat import AsyncFakeChatClient, FakeChatClient
+
+
+@pytest.fixture(scope='module')
+def faiss_index_path(tmp_path_factory):
+    faiss_index_path = str(tmp_path_factory.mktemp('index') / 'faiss_index.index')
+    corpus = SyntheticCorpus(20)
+    Preprocessor(faiss_index_path, embedding_backend=FakeEmbeddingBackend(),
+                 drive_client=GoogleDriveClient(service=corpus.service), use_embedding_cache=False).run()
+    return faiss_index_path
+
+
+class _BrokenStreamClient(AsyncFakeChatClient):
+    """Streams ``fail_after`` words and then loses the connection."""
+
+    def __init__(self, fail_after):
+        super().__init__(response_words=20)
+        self.fail_after = fail_after
+
+    async def _stream(self, model, messages, include_usage):
+        count = 0
+        async for chunk in super()._stream(model, messages, include_usage):
+            if count == self.fail_after:
+                raise ConnectionError("stream interrupted")
+            count += 1
+            yield chunk
+
+
+def _agent(faiss_index_path, chat_client, **options):
+    return AsyncRAGAgent(faiss_index_path, chat_client=chat_client, embedding_backend=FakeEmbeddingBackend(),
+                         **options)
+
+
+async def _stream(agent, question):
+    return [text async for text in agent.stream_answer(question)]
+
+
+def test_stream_matches_the_synchronous_answer(faiss_index_path):
+    question = "What does the quarterly report say about revenue?"
+    agent = _agent(faiss_index_path, AsyncFakeChatClient(response_words=30))
+    try:
+        pieces = asyncio.run(_stream(agent, question))
+    finally:
+        agent.close()
+    expected = RAGAgent(faiss_index_path, chat_client=FakeChatClient(response_words=30),
+                        embedding_backend=FakeEmbeddingBackend()).answer_question(question)
+    # One piece per word, streamed as generated
+    assert len(pieces) == 30
+    assert ''.join(pieces) == expected
+
+
+def test_answer_many_answers_concurrently_in_order(faiss_index_path):
+    client = AsyncFakeChatClient(response_words=10, latency=0.2)
+    agent = _agent(faiss_index_path, client)
+    questions = [f"question {i} about the roadmap" for i in range(6)]
+    try:
+        answers = asyncio.run(agent.answer_many(questions))
+        expected = [asyncio.run(agent.answer_question_async(question)) for question in questions]
+    finally:
+        agent.close()
+    assert answers == expected
+    assert all(len(answer.split()) == 10 for answer in answers)
+    assert client.calls == 12
+
+
+def test_answer_question_keeps_the_synchronous_signature(faiss_index_path):
+    agent = _agent(faiss_index_path, AsyncFakeChatClient(response_words=10), trace_requests=True)
+    try:
+        answer = agent.answer_question("What is the travel policy?")
+    finally:
+        agent.close()
+    assert isinstance(answer, str) and len(answer.split()) == 10
+    assert 'retrieve' in agent.last_trace['spans']
+
+
+def test_mid_stream_error_is_raised_not_appended(faiss_index_path):
+    agent = _agent(faiss_index_path, _BrokenStreamClient(fail_after=5), use_answer_cache=True)
+    pieces = []
+
+    async def consume():
+        async for text in agent.stream_answer("What is the travel policy?"):
+            pieces.append(text)
+
+    try:
+        with pytest.raises(ConnectionError):
+            asyncio.run(consume())
+        answer = asyncio.run(agent.answer_question_async("What is the travel policy?"))
+    finally:
+        agent.close()
+    assert len(pieces) == 5
+    assert not any('I encountered an error' in text for text in pieces)
+    # The whole answer is the error, without the partial text before it
+    assert answer == "I encountered an error while trying to answer your question: stream interrupted"
+    assert len(agent.answer_cache) == 0
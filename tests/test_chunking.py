@@ -0,0 +1,64 @@
+import os
+import re
+import sys
+import time
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.corpus import SyntheticCorpus
+from rag_pipeline.chunking import iter_chunks
+from rag_pipeline.embeddings import estimate_tokens
+
+_PIECE = re.compile(r'\w+|[^\w\s]|\s+')
+
+
+def count_words(text):
+    # A word-level counter, where joined text counts about the same as its parts
+    return len(_PIECE.findall(text))
+
+
+def _documents():
+    corpus = SyntheticCorpus(3)
+    return {
+        'repeated words': 'word ' * 2000,
+        'sentences': ' '.join(corpus.sentence() for _ in range(400)),
+        'paragraphs': '\n\n'.join(corpus.paragraph(i) for i in range(40)),
+        'long word': 'x' * 5000,
+        'digits': '1234567890' * 300,
+    }
+
+
+DOCUMENTS = _documents()
+
+
+@pytest.mark.parametrize('count_tokens', [estimate_tokens, count_words], ids=['estimate', 'words'])
+@pytest.mark.parametrize('max_tokens', [16, 64, 256])
+@pytest.mark.parametrize('name', sorted(DOCUMENTS))
+def test_chunks_stay_within_max_tokens(name, max_tokens, count_tokens):
+    document = DOCUMENTS[name]
+    chunks = list(iter_chunks(document, max_tokens=max_tokens, overlap_tokens=max_tokens // 8,
+                              count_tokens=count_tokens))
+    assert chunks
+    for chunk in chunks:
+        assert count_tokens(chunk.text) <= max_tokens
+        assert document[chunk.start:chunk.end] == chunk.text
+
+
+@pytest.mark.parametrize('piece_size', [1, 7, 100])
+@pytest.mark.parametrize('name', ['sentences', 'paragraphs'])
+def test_streamed_pieces_chunk_like_the_whole_document(name, piece_size):
+    document = DOCUMENTS[name][:20000]
+    pieces = (document[i:i + piece_size] for i in range(0, len(document), piece_size))
+    assert list(iter_chunks(pieces, max_tokens=64, count_tokens=estimate_tokens)) == \
+        list(iter_chunks(document, max_tokens=64, count_tokens=estimate_tokens))
+
+
+def test_long_stream_without_boundaries_is_linear():
+    # 400k pieces and no sentence boundary until the forced split at max_buffer_chars
+    pieces = ('word ' for _ in range(400000))
+    start = time.perf_counter()
+    chunks = list(iter_chunks(pieces, max_tokens=256, count_tokens=estimate_tokens))
+    assert time.perf_counter() - start < 20
+    assert chunks[0].start == 0 and chunks[-1].end == 5 * 400000 - 1
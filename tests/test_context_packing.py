@@ -0,0 +1,54 @@
+import os
+import sys
+import random
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from rag_pipeline.context_packing import ContextPacker
+
+DOCUMENT = ' '.join(f"w{i}" for i in range(600))
+
+
+def _passage(file_id, start, end, distance=0.1, document=DOCUMENT):
+    return {'text': document[start:end], 'file_id': file_id, 'mime_type': 'text/plain', 'start': start, 'end': end,
+            'distance': distance}
+
+
+def test_duplicates_dropped_and_overlaps_merged():
+    passages = [_passage('a', 0, 200), _passage('a', 180, 380, 0.2), _passage('b', 0, 200, 0.3),
+                _passage('a', 50, 100, 0.3)]
+    context, report = ContextPacker(max_tokens=1000).pack(passages)
+    assert DOCUMENT[0:380] in context
+    assert report['duplicates'] == 2 and report['merged'] == 1 and report['passages'] == 1
+    assert report['tokens_saved'] > 0 and report['tokens_dropped'] == 0
+
+
+def test_first_passage_over_budget_is_truncated():
+    passages = [_passage('a', 0, len(DOCUMENT)), _passage('b', 0, 300, 0.2, document=DOCUMENT.upper())]
+    packer = ContextPacker(max_tokens=100)
+    context, report = packer.pack(passages)
+    assert report['passages'] == 1 and report['truncated'] == 1 and report['over_budget'] == 1
+    assert report['tokens'] <= 100 and packer.count_tokens(context) <= 100
+    assert 'Content: w0 w1' in context and DOCUMENT[:len(DOCUMENT) // 2] not in context
+    # The budget accounts for what was cut; deduplication and merging saved nothing
+    assert report['tokens_saved'] == 0
+    assert report['tokens_dropped'] == report['unpacked_tokens'] - report['tokens']
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_context_never_exceeds_budget(seed):
+    rng = random.Random(seed)
+    documents = {file_id: ' '.join(f"{file_id}{i}" for i in range(rng.randint(50, 600))) for file_id in 'abcd'}
+    passages = []
+    for _ in range(rng.randint(1, 10)):
+        file_id = rng.choice('abcd')
+        start = rng.randint(0, len(documents[file_id]) - 10)
+        end = min(len(documents[file_id]), start + rng.randint(10, 800))
+        passages.append(_passage(file_id, start, end, rng.random(), document=documents[file_id]))
+    max_tokens = rng.choice([60, 100, 300, 1000])
+    packer = ContextPacker(max_tokens=max_tokens)
+    context, report = packer.pack(passages)
+    assert packer.count_tokens(context) <= max_tokens
+    assert report['passages'] >= 1
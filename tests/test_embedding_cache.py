@@ -0,0 +1,63 @@
+import os
+import sys
+import time
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from rag_pipeline.embedding_cache import EmbeddingCache
+from rag_pipeline.sharding import ShardedStore
+
+
+def test_counters_exact_under_concurrent_lookups(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / 'embedding_cache.sqlite'))
+    cached = [f"cached {i}" for i in range(10)]
+    cache.put_many('model', cached, np.ones((10, 4), dtype='float32'))
+    texts = cached + [f"missing {i}" for i in range(10)]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda _: cache.get_many('model', texts), range(200)))
+
+    assert (cache.hits, cache.misses) == (2000, 2000)
+    assert cache.hit_rate == 0.5
+    cache.close()
+
+
+def _last_used(path):
+    with sqlite3.connect(path) as conn:
+        return dict(conn.execute("SELECT key, last_used FROM embeddings"))
+
+
+def test_hits_are_recorded_without_writing_until_the_next_put(tmp_path):
+    path = str(tmp_path / 'embedding_cache.sqlite')
+    # Room for three 16-byte vectors; a fourth evicts one
+    cache = EmbeddingCache(path, max_bytes=60)
+    for i in range(3):
+        cache.put_many('model', [f"text {i}"], np.ones((1, 4), dtype='float32'))
+        time.sleep(0.01)
+    before = _last_used(path)
+    assert cache.get_many('model', ['text 0'])[0] is not None
+    assert _last_used(path) == before
+
+    # The put writes the hit first, so the least recently used entry is 'text 1', not 'text 0'
+    cache.put_many('model', ['text 3'], np.ones((1, 4), dtype='float32'))
+    found = cache.get_many('model', [f"text {i}" for i in range(4)])
+    assert [vector is not None for vector in found] == [True, False, True, True]
+    cache.close()
+
+
+def test_sharded_store_and_its_shards_share_one_cache(tmp_path):
+    root = str(tmp_path / 'store')
+    store = ShardedStore(root)
+    store.add_shard('part-0')
+    expected = os.path.join(root, 'embedding_cache.sqlite')
+    assert EmbeddingCache.path_for(root) == expected
+    assert EmbeddingCache.path_for(root + os.sep) == expected
+    assert EmbeddingCache.path_for(store.index_path('part-0')) == expected
+    assert EmbeddingCache.path_for(store.staging_path('part-0')) == expected
+    plain = str(tmp_path / 'plain' / 'faiss_index.index')
+    assert EmbeddingCache.path_for(plain) == str(tmp_path / 'plain' / 'embedding_cache.sqlite')
+    assert EmbeddingCache.path_for('faiss_index.index') == 'embedding_cache.sqlite'
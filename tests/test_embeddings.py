@@ -0,0 +1,91 @@
+import os
+import sys
+import time
+import threading
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from rag_pipeline.embeddings import BatchEmbedder, FakeEmbeddingBackend, estimate_tokens
+from rag_pipeline.ingest_pipeline import IngestPipeline
+
+
+class _ConcurrencyProbe:
+    """Wraps a backend and records the most requests that were in flight at once."""
+
+    def __init__(self, backend, latency=0.02, fail=None):
+        self.backend = backend
+        self.latency = latency
+        self.fail = fail or (lambda texts: False)
+        self.in_flight = 0
+        self.peak = 0
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def embed(self, texts):
+        with self._lock:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            self.requests.append(list(texts))
+        try:
+            time.sleep(self.latency)
+            if self.fail(texts):
+                raise RuntimeError("request failed")
+            return self.backend.embed(texts)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def test_fake_vectors_are_deterministic_unit_vectors():
+    first = np.asarray(FakeEmbeddingBackend(dimension=64).embed(['alpha', 'beta', 'alpha']))
+    second = np.asarray(FakeEmbeddingBackend(dimension=64).embed(['alpha']))
+    assert first.shape == (3, 64)
+    assert np.allclose(np.linalg.norm(first, axis=1), 1.0)
+    assert np.array_equal(first[0], first[2]) and np.array_equal(first[0], second[0])
+    assert not np.allclose(first[0], first[1])
+
+
+def test_batches_respect_size_and_token_budget():
+    embedder = BatchEmbedder(FakeEmbeddingBackend(dimension=8), batch_size=3, max_batch_tokens=10)
+    texts = ['x' * 8] * 4 + ['y' * 48] + ['z' * 4] * 2
+    batches = list(embedder.batches(texts))
+    assert [text for batch in batches for text in batch] == texts
+    assert all(len(batch) <= 3 for batch in batches)
+    # A single text over the budget still gets a batch of its own
+    assert all(sum(map(estimate_tokens, batch)) <= 10 or len(batch) == 1 for batch in batches)
+    assert ['y' * 48] in batches
+
+
+def test_results_come_back_in_input_order_within_the_in_flight_bound():
+    probe = _ConcurrencyProbe(FakeEmbeddingBackend(dimension=8))
+    embedder = BatchEmbedder(probe, batch_size=2, max_in_flight=3)
+    texts = [f"text {i}" for i in range(40)]
+    results = list(embedder.embed_batches(texts))
+    assert [text for batch, _ in results for text in batch] == texts
+    assert np.array_equal(np.vstack([vectors for _, vectors in results]),
+                          np.asarray(FakeEmbeddingBackend(dimension=8).embed(texts)))
+    assert 1 < probe.peak <= 3
+
+    probe.peak = 0
+    list(embedder.embed_batches(texts, max_in_flight=1))
+    assert probe.peak == 1 and embedder.max_in_flight == 3
+
+
+def test_failed_request_drops_only_its_batch():
+    probe = _ConcurrencyProbe(FakeEmbeddingBackend(dimension=8), latency=0, fail=lambda texts: 'bad' in texts)
+    embedder = BatchEmbedder(probe, batch_size=2)
+    results = list(embedder.embed_batches(['a', 'b', 'bad', 'c', 'd', 'e']))
+    assert [vectors is None for _, vectors in results] == [False, True, False]
+
+
+def test_pipeline_leaves_the_callers_embedder_unchanged():
+    embedder = BatchEmbedder(FakeEmbeddingBackend(dimension=8), batch_size=4, max_in_flight=6)
+    stored = []
+    pipeline = IngestPipeline(download=lambda file: file,
+                              extract=lambda file, payload: (f"{file} chunk {i}" for i in range(20)),
+                              embedder=embedder, sink=lambda batch, vectors: stored.extend(batch),
+                              embed_workers=2)
+    pipeline.run(['a', 'b'])
+    assert len(stored) == 40 and embedder.max_in_flight == 6
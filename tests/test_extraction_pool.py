@@ -0,0 +1,106 @@
+import io
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from data_extraction.extraction_pool import ExtractionError, ExtractionPool
+
+SLOW_MIME_TYPE = 'application/x-test-slow'
+CRASH_MIME_TYPE = 'application/x-test-crash'
+RAISE_MIME_TYPE = 'application/x-test-raise'
+
+
+def _slow(file_stream, mime_type=None):
+    time.sleep(60)
+    yield file_stream.read().decode('utf-8')
+
+
+def _crash(file_stream, mime_type=None):
+    os._exit(1)
+
+
+def _raise(file_stream, mime_type=None):
+    raise ValueError("corrupt document")
+
+
+def _register_test_extractors():
+    # Runs in each spawned worker, which does not see registrations made in the tests
+    from data_extraction.extractors import register_extractor
+    register_extractor(SLOW_MIME_TYPE, _slow)
+    register_extractor(CRASH_MIME_TYPE, _crash)
+    register_extractor(RAISE_MIME_TYPE, _raise)
+
+
+def _hang_on_startup():
+    # As if a worker were stuck importing a parser
+    time.sleep(60)
+
+
+@pytest.fixture(scope='module')
+def pool():
+    pool = ExtractionPool(workers=2, timeout=1.0, initializer=_register_test_extractors)
+    yield pool
+    pool.close()
+
+
+def _extract(pool, text, mime_type='text/plain'):
+    return pool.extract(io.BytesIO(text.encode('utf-8')), mime_type)
+
+
+def test_extracts_and_chunks_in_workers(pool):
+    with ThreadPoolExecutor(max_workers=4) as threads:
+        results = list(threads.map(lambda i: _extract(pool, f"document {i}"), range(8)))
+    assert [[chunk.text for chunk in chunks] for chunks in results] == [[f"document {i}"] for i in range(8)]
+
+
+def test_extractor_error_fails_only_that_file(pool):
+    with pytest.raises(ExtractionError, match="ValueError: corrupt document"):
+        _extract(pool, "anything", RAISE_MIME_TYPE)
+    assert [chunk.text for chunk in _extract(pool, "hello world")] == ['hello world']
+
+
+def test_slow_file_times_out_and_worker_is_replaced(pool):
+    timeouts = pool.timeouts
+    start = time.monotonic()
+    with pytest.raises(ExtractionError, match="timed out"):
+        _extract(pool, "slow", SLOW_MIME_TYPE)
+    assert time.monotonic() - start < 10
+    assert pool.timeouts == timeouts + 1
+    with ThreadPoolExecutor(max_workers=2) as threads:
+        results = list(threads.map(lambda i: _extract(pool, f"after {i}"), range(4)))
+    assert [chunks[0].text for chunks in results] == [f"after {i}" for i in range(4)]
+
+
+def test_crashing_file_fails_and_worker_is_replaced(pool):
+    crashes = pool.crashes
+    with pytest.raises(ExtractionError, match="crashed"):
+        _extract(pool, "crash", CRASH_MIME_TYPE)
+    assert pool.crashes == crashes + 1
+    assert [chunk.text for chunk in _extract(pool, "hello world")] == ['hello world']
+
+
+def test_concurrent_failures_are_all_counted(pool):
+    timeouts, crashes = pool.timeouts, pool.crashes
+    mime_types = [SLOW_MIME_TYPE, CRASH_MIME_TYPE] * 2
+    with ThreadPoolExecutor(max_workers=len(mime_types)) as threads:
+        futures = [threads.submit(_extract, pool, "x", mime_type) for mime_type in mime_types]
+    assert all(isinstance(future.exception(), ExtractionError) for future in futures)
+    assert pool.timeouts == timeouts + 2
+    assert pool.crashes == crashes + 2
+
+
+def test_worker_that_never_starts_fails_the_file():
+    pool = ExtractionPool(workers=1, timeout=30, startup_timeout=0.5, initializer=_hang_on_startup)
+    try:
+        start = time.monotonic()
+        with pytest.raises(ExtractionError, match="did not start"):
+            _extract(pool, "hello world")
+        assert time.monotonic() - start < 10
+        assert pool.timeouts == 1
+    finally:
+        pool.close()
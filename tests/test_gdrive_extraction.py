@@ -0,0 +1,118 @@
+import os
+import sys
+import math
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.corpus import SyntheticCorpus
+from data_extraction import extractors, gdrive_extraction
+from data_extraction.fake_drive import FakeDriveService
+from data_extraction.gdrive_extraction import FOLDER_MIME_TYPE, GoogleDriveClient
+from rag_pipeline.rate_limit import RequestScheduler
+
+
+def _tree():
+    # root -> a -> b, with files at every level, and an unrelated folder beside root
+    service = FakeDriveService()
+    service.add_file('root', 'root', FOLDER_MIME_TYPE)
+    service.add_file('a', 'a', FOLDER_MIME_TYPE, parents=['root'])
+    service.add_file('b', 'b', FOLDER_MIME_TYPE, parents=['a'])
+    service.add_file('other', 'other', FOLDER_MIME_TYPE)
+    layout = {'root': 25, 'a': 12, 'b': 7, 'other': 5}
+    for parent, count in layout.items():
+        for i in range(count):
+            service.add_file(f"{parent}-{i}", f"{parent}-{i}.txt", 'text/plain', content='x', parents=[parent])
+    return service, layout
+
+
+def test_folder_listing_follows_pages_and_subfolders():
+    service, layout = _tree()
+    client = GoogleDriveClient(service=service)
+    files = list(client.iter_files(folder_id='root', page_size=10))
+    ids = [file['id'] for file in files]
+    assert len(ids) == len(set(ids)) == layout['root'] + layout['a'] + layout['b']
+    assert all(file['mimeType'] != FOLDER_MIME_TYPE for file in files)
+    # One request per page of each folder (folders count towards their parent's pages)
+    pages = math.ceil((layout['root'] + 1) / 10) + math.ceil((layout['a'] + 1) / 10) + math.ceil(layout['b'] / 10)
+    assert service.requests == pages
+
+
+def test_non_recursive_and_drive_wide_listings():
+    service, layout = _tree()
+    client = GoogleDriveClient(service=service)
+    direct = [file['id'] for file in client.iter_files(folder_id='root', recursive=False, page_size=7)]
+    assert sorted(direct) == sorted(f"root-{i}" for i in range(layout['root']))
+    everything = [file['id'] for file in client.iter_files(page_size=7)]
+    assert len(everything) == len(set(everything)) == sum(layout.values())
+
+
+def test_listing_is_lazy():
+    service, _ = _tree()
+    files = GoogleDriveClient(service=service).iter_files(folder_id='root', page_size=10)
+    next(files)
+    # The first page, and at most the prefetched second one, have been requested
+    assert service.requests <= 2
+
+
+def test_throttled_pages_are_retried():
+    service, layout = _tree()
+    service.error_rate = 0.3
+    client = GoogleDriveClient(service=service, scheduler=RequestScheduler(base_delay=0.001, max_delay=0.1))
+    ids = [file['id'] for file in client.iter_files(folder_id='root', page_size=5)]
+    assert service.rejected > 0
+    assert len(set(ids)) == layout['root'] + layout['a'] + layout['b']
+
+
+def test_large_downloads_spill_to_disk_in_range_requests(monkeypatch):
+    monkeypatch.setattr(gdrive_extraction, 'DOWNLOAD_CHUNK_BYTES', 50 * 1024)
+    content = bytes(range(256)) * 1200
+    service = FakeDriveService()
+    service.add_file('large', 'large.bin', 'application/octet-stream', content=content)
+    service.add_file('small', 'small.txt', 'text/plain', content=b'small file')
+    client = GoogleDriveClient(service=service, max_in_memory_bytes=64 * 1024)
+
+    with client.download_to_file('large') as fh:
+        assert fh._rolled and fh.read() == content
+    assert service.requests == math.ceil(len(content) / (50 * 1024))
+    with client.download_to_file('small') as fh:
+        assert not fh._rolled and fh.read() == b'small file'
+
+
+def test_google_docs_are_exported_in_memory():
+    service = FakeDriveService()
+    service.add_file('doc', 'doc', 'application/vnd.google-apps.document', content='Exported text.')
+    client = GoogleDriveClient(service=service)
+    file_stream, mime_type = client.fetch_file('doc', 'application/vnd.google-apps.document')
+    assert mime_type == 'text/plain' and file_stream.read() == b'Exported text.'
+
+
+def test_text_is_extracted_in_pieces_from_a_spilled_download(monkeypatch):
+    monkeypatch.setattr(extractors, 'TEXT_BLOCK_CHARS', 1000)
+    text = 'Grüße aus Köln. ' * 500
+    service = FakeDriveService()
+    service.add_file('text', 'text.txt', 'text/plain', content=text)
+    service.add_file('xml', 'doc.xml', 'application/xml',
+                     content='<doc>' + ''.join(f"<p>part {i}. </p>" for i in range(400)) + '</doc>')
+    client = GoogleDriveClient(service=service, max_in_memory_bytes=1024)
+
+    with client.download_to_file('text') as fh:
+        pieces = list(client.iter_text(fh, 'text/plain'))
+        # The download is left open for its owner to close
+        assert not fh.closed
+    assert len(pieces) > 1 and all(len(piece) <= 1000 for piece in pieces)
+    assert ''.join(pieces) == text
+
+    with client.download_to_file('xml') as fh:
+        pieces = list(client.iter_text(fh, 'application/xml'))
+    assert len(pieces) > 1
+    assert ''.join(pieces) == ''.join(f"part {i}. " for i in range(400))
+
+
+def test_file_content_helpers_use_the_extractor_registry():
+    corpus = SyntheticCorpus(12)
+    client = GoogleDriveClient(service=corpus.service)
+    files = {item['mimeType']: item['id'] for item in client.iter_files()}
+    pdf_text = client.get_pdf_text_content(files['application/pdf'])
+    assert pdf_text and pdf_text == client.extract_text(files['application/pdf'], 'application/pdf')
+    plain_text = client.get_file_content(files['text/plain'])
+    assert plain_text and plain_text == client.extract_text(files['text/plain'], 'text/plain')
@@ -0,0 +1,178 @@
+import os
+import sys
+import json
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from rag_pipeline import index_factory
+from rag_pipeline.index_factory import (IndexBuilder, default_params, load_index, search_parameters,
+                                        set_search_params)
+
+
+def _builder(kind, storage='float32'):
+    vectors = np.random.default_rng(0).random((200, 16), dtype='float32')
+    builder = IndexBuilder(default_params(kind, dimension=16, storage=storage))
+    builder.add_with_ids(vectors, np.arange(200))
+    builder.finish()
+    return builder, vectors
+
+
+@pytest.mark.parametrize('kind,storage', [('flat', 'float32'), ('hnsw', 'float32'), ('hnsw', 'fp16')])
+def test_remove_ids_from(kind, storage):
+    builder, vectors = _builder(kind, storage)
+    assert builder.remove_ids_from(150) == 50
+    assert sorted(faiss.vector_to_array(builder.index.id_map)) == list(range(150))
+    _, ids = builder.index.search(vectors[:5], 1)
+    assert ids[:, 0].tolist() == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.parametrize('kind', ['flat', 'hnsw'])
+def test_remove_ids(kind):
+    builder, vectors = _builder(kind)
+    builder.remove_ids(np.arange(0, 200, 2))
+    assert sorted(faiss.vector_to_array(builder.index.id_map)) == list(range(1, 200, 2))
+    _, ids = builder.index.search(vectors[1:2], 1)
+    assert ids[0, 0] == 1
+
+
+def _ivf():
+    vectors = np.random.default_rng(1).random((2000, 16), dtype='float32')
+    builder = IndexBuilder(default_params('ivf', n_vectors=2000, dimension=16))
+    builder.add_with_ids(vectors, np.arange(2000))
+    return builder.finish(), vectors
+
+
+def _reference(index, queries, k, nprobe):
+    set_search_params(index, nprobe=nprobe)
+    try:
+        return index.search(queries, k)[1]
+    finally:
+        set_search_params(index, nprobe=11)
+
+
+def test_search_parameters_leave_index_untouched():
+    index, vectors = _ivf()
+    queries = vectors[:20] + 0.05
+    ivf = faiss.extract_index_ivf(index)
+    for nprobe in (1, 64):
+        expected = _reference(index, queries, 10, nprobe)
+        _, ids = index.search(queries, 10, params=search_parameters(index, nprobe=nprobe))
+        assert (ids == expected).all()
+        assert ivf.nprobe == 11
+    assert search_parameters(index) is None
+
+
+def test_concurrent_searches_keep_their_own_nprobe():
+    index, vectors = _ivf()
+    queries = vectors[:50] + 0.05
+    expected = {nprobe: _reference(index, queries, 10, nprobe) for nprobe in (1, None)}
+
+    def search(nprobe):
+        return nprobe, index.search(queries, 10, params=search_parameters(index, nprobe=nprobe))[1]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        for nprobe, ids in pool.map(search, [1, None] * 100):
+            assert (ids == expected[nprobe]).all()
+
+
+def test_search_parameters_hnsw():
+    builder, vectors = _builder('hnsw')
+    params = search_parameters(builder.index, ef_search=16)
+    assert isinstance(params, faiss.SearchParametersHNSW) and params.efSearch == 16
+    _, ids = builder.index.search(vectors[:5], 1, params=params)
+    assert ids[:, 0].tolist() == [0, 1, 2, 3, 4]
+
+
+def test_ivf_remove_ids_keeps_ids_aligned():
+    index, vectors = _ivf()
+    builder = IndexBuilder(default_params('ivf', n_vectors=2000, dimension=16), index)
+    builder.remove_ids(np.arange(0, 100))
+    assert builder.remove_ids_from(1900) == 100
+    params = search_parameters(builder.index, nprobe=64)
+    _, ids = builder.index.search(vectors[[100, 500, 1500, 1899]], 1, params=params)
+    assert ids[:, 0].tolist() == [100, 500, 1500, 1899]
+
+
+def test_auto_index_is_replanned_as_it_grows(monkeypatch):
+    monkeypatch.setattr(index_factory, 'FLAT_MAX_VECTORS', 500)
+    monkeypatch.setattr(index_factory, 'IVF_MAX_VECTORS', 6000)
+    vectors = np.random.default_rng(2).random((8000, 64), dtype='float32')
+    # A small PQ keeps training fast
+    builder = IndexBuilder(dict(default_params('auto', dimension=64), pq_m=8, pq_nbits=6))
+    seen = []
+    for start in range(0, len(vectors), 250):
+        builder.add_with_ids(vectors[start:start + 250], np.arange(start, start + 250))
+        if builder.index is not None and (builder.params['kind'], builder.params['nlist']) not in seen:
+            seen.append((builder.params['kind'], builder.params['nlist']))
+    kinds = [kind for kind, _ in seen]
+    assert kinds[0] == 'ivf' and kinds[-1] == 'ivfpq'
+    # Lists are added as the corpus grows, rather than staying sized for the first buffer
+    assert len(seen) >= 3 and seen[-2][1] >= 2 * seen[0][1]
+    assert builder.ntotal == len(vectors)
+    params = search_parameters(builder.index, nprobe=builder.params['nlist'])
+    _, ids = builder.index.search(vectors[::500], 1, params=params)
+    assert ids[:, 0].tolist() == list(range(0, len(vectors), 500))
+
+
+def test_index_given_kind_is_not_replanned():
+    vectors = np.random.default_rng(3).random((3000, 16), dtype='float32')
+    builder = IndexBuilder(default_params('flat', dimension=16))
+    builder.add_with_ids(vectors, np.arange(3000))
+    assert builder.params['kind'] == 'flat' and not builder.params['auto']
+
+
+def test_recall_report_cli(tmp_path):
+    builder, _ = _builder('hnsw')
+    faiss_index_path = str(tmp_path / 'faiss_index.index')
+    builder.save(faiss_index_path)
+    script = os.path.join(os.path.dirname(__file__), '..', 'rag_pipeline', 'index_factory.py')
+    output = subprocess.run([sys.executable, script, faiss_index_path, '20'], capture_output=True, text=True,
+                            check=True).stdout
+    rows = [json.loads(line) for line in output.splitlines()]
+    assert rows[0]['setting'] == 'exact' and rows[0]['recall'] == 1.0
+    assert {row['setting'] for row in rows[1:4]} == {'ef_search=16', 'ef_search=64', 'ef_search=256'}
+    assert {row['storage'] for row in rows if 'storage' in row} == {'float32', 'fp16', 'int8'}
+    assert all(0 < row['recall'] <= 1 for row in rows)
+
+
+@pytest.mark.parametrize('storage', ['float32', 'fp16', 'int8'])
+@pytest.mark.parametrize('kind', ['flat', 'ivf', 'hnsw'])
+def test_saved_index_loads_memory_mapped(tmp_path, kind, storage):
+    vectors = np.random.default_rng(4).random((1000, 32), dtype='float32')
+    n_vectors = 1000 if kind == 'ivf' else 0
+    builder = IndexBuilder(default_params(kind, n_vectors=n_vectors, dimension=32, storage=storage))
+    builder.add_with_ids(vectors, np.arange(1000, 2000))
+    builder.finish()
+    faiss_index_path = str(tmp_path / 'faiss_index.index')
+    builder.save(faiss_index_path)
+
+    loaded = load_index(faiss_index_path)
+    mapped = load_index(faiss_index_path, mmap=True)
+    assert mapped.ntotal == loaded.ntotal == 1000
+    params = search_parameters(loaded, nprobe=builder.params['nlist'], ef_search=256)
+    _, expected = loaded.search(vectors[:20], 5, params=params)
+    _, ids = mapped.search(vectors[:20], 5, params=search_parameters(mapped, nprobe=builder.params['nlist'],
+                                                                   ef_search=256))
+    assert (ids == expected).all()
+    # Quantized storage still finds each vector itself
+    assert (ids[:, 0] == np.arange(1000, 1020)).mean() >= 0.9
+
+
+def test_quantized_storage_shrinks_the_index(tmp_path):
+    vectors = np.random.default_rng(5).random((2000, 64), dtype='float32')
+    sizes = {}
+    for storage in ('float32', 'fp16', 'int8'):
+        builder = IndexBuilder(default_params('flat', dimension=64, storage=storage))
+        builder.add_with_ids(vectors, np.arange(2000))
+        builder.finish()
+        path = str(tmp_path / f"{storage}.index")
+        builder.save(path)
+        sizes[storage] = os.path.getsize(path)
+    assert sizes['fp16'] < 0.6 * sizes['float32']
+    assert sizes['int8'] < 0.35 * sizes['float32']
@@ -0,0 +1,65 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from rag_pipeline.embeddings import BatchEmbedder, FakeEmbeddingBackend
+from rag_pipeline.ingest_pipeline import IngestPipeline
+
+
+def _pipeline(sink, text_of=None):
+    # Many files of many chunks, so every queue is full when storing stops
+    return IngestPipeline(download=lambda file: file,
+                          extract=lambda file, payload: (f"{file} chunk {i}" for i in range(500)),
+                          embedder=BatchEmbedder(FakeEmbeddingBackend(), batch_size=4),
+                          sink=sink, queue_size=2, text_of=text_of)
+
+
+def _run_with_watchdog(pipeline, files, timeout=10):
+    outcome = {}
+
+    def target():
+        try:
+            outcome['stats'] = pipeline.run(files)
+        except BaseException as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "IngestPipeline.run did not return after storing stopped"
+    return outcome
+
+
+def test_run_completes():
+    stored = []
+    outcome = _run_with_watchdog(_pipeline(lambda batch, vectors: stored.extend(batch)),
+                                 [f"file{i}" for i in range(4)])
+    assert 'error' not in outcome
+    assert len(stored) == 4 * 500
+
+
+def test_interrupt_in_sink_stops_workers():
+    def sink(batch, vectors):
+        raise KeyboardInterrupt
+
+    outcome = _run_with_watchdog(_pipeline(sink), [f"file{i}" for i in range(50)])
+    assert isinstance(outcome.get('error'), KeyboardInterrupt)
+
+
+@pytest.mark.parametrize('fail_after', [0, 100])
+def test_error_in_text_of_stops_workers(fail_after):
+    seen = []
+
+    def text_of(chunk):
+        seen.append(chunk)
+        if len(seen) > fail_after:
+            raise ValueError("bad chunk")
+        return chunk
+
+    outcome = _run_with_watchdog(_pipeline(lambda batch, vectors: None, text_of=text_of),
+                                 [f"file{i}" for i in range(50)])
+    assert isinstance(outcome.get('error'), ValueError)
@@ -0,0 +1,45 @@
+import os
+import sys
+import random
+from collections import Counter
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from rag_pipeline.lexical_index import LexicalIndex
+
+VOCABULARY = [f"term{i}" for i in range(40)]
+
+
+def _chunks(seed):
+    # Equal-length chunks, so length normalisation is the same in every shard
+    rng = random.Random(seed)
+    return [(i, ' '.join(rng.choice(VOCABULARY) for _ in range(8))) for i in range(600)]
+
+
+def _index(path, chunks):
+    index = LexicalIndex(str(path))
+    index.add_many(chunks)
+    index.commit()
+    return index
+
+
+@pytest.mark.parametrize('query', ['term1 term7', 'term3', 'term0 term5 term9'])
+def test_shards_scored_with_corpus_stats_match_one_index(tmp_path, query):
+    chunks = _chunks(0)
+    whole = _index(tmp_path / 'whole.sqlite', chunks)
+    # A small shard and a large one, whose own document frequencies differ a lot
+    shards = [_index(tmp_path / 'small.sqlite', chunks[:50]), _index(tmp_path / 'large.sqlite', chunks[50:])]
+
+    stats = [shard.term_stats(query) for shard in shards]
+    corpus_df = Counter()
+    for _, df in stats:
+        corpus_df.update(df)
+    corpus_stats = (sum(n_chunks for n_chunks, _ in stats), corpus_df)
+    assert corpus_stats == whole.term_stats(query)
+
+    merged = sorted((hit for shard in shards for hit in shard.search(query, 600, corpus_stats=corpus_stats)),
+                    key=lambda hit: hit[1], reverse=True)
+    expected = dict(whole.search(query, 600))
+    assert dict(merged) == pytest.approx(expected)
@@ -0,0 +1,115 @@
+import os
+import sys
+import stat
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from data_extraction.fake_drive import FakeDriveService
+from data_extraction.gdrive_extraction import GoogleDriveClient
+from preprocessing.preprocessing import Preprocessor
+from rag_pipeline.embeddings import FakeEmbeddingBackend
+from rag_pipeline.manifest import IndexManifest
+
+
+def test_ids_are_allocated_once_and_kept_as_ranges(tmp_path):
+    manifest = IndexManifest(str(tmp_path / 'manifest.json'))
+    manifest.reset_file({'id': 'a', 'md5Checksum': 'x'})
+    manifest.reset_file({'id': 'b', 'md5Checksum': 'y'})
+    first, second = manifest.allocate_ids(3), manifest.allocate_ids(2)
+    assert list(first) == [0, 1, 2] and list(second) == [3, 4]
+    manifest.add_ids('a', first)
+    manifest.add_ids('b', second)
+    manifest.add_ids('a', manifest.allocate_ids(2))
+    assert manifest.files['a']['ids'] == [[0, 3], [5, 7]]
+    assert manifest.ids_of('a') == [0, 1, 2, 5, 6]
+    assert manifest.remove('b') == [3, 4] and manifest.ids_of('b') == []
+    # Removed IDs are never handed out again
+    assert list(manifest.allocate_ids(1)) == [7]
+
+
+def test_changes_are_detected_by_checksum_or_modified_time(tmp_path):
+    manifest = IndexManifest(str(tmp_path / 'manifest.json'))
+    pdf = {'id': 'pdf', 'md5Checksum': 'abc', 'modifiedTime': '2024-01-01'}
+    doc = {'id': 'doc', 'modifiedTime': '2024-01-01'}
+    assert not manifest.is_unchanged(pdf)
+    manifest.reset_file(pdf)
+    manifest.reset_file(doc)
+    assert manifest.is_unchanged(pdf) and manifest.is_unchanged(dict(pdf, modifiedTime='2024-02-02'))
+    assert not manifest.is_unchanged(dict(pdf, md5Checksum='def'))
+    # Google Docs have no checksum, so their modified time decides
+    assert manifest.is_unchanged(doc) and not manifest.is_unchanged(dict(doc, modifiedTime='2024-02-02'))
+
+
+def test_incomplete_files_are_saved_to_be_indexed_again(tmp_path):
+    path = str(tmp_path / 'manifest.json')
+    manifest = IndexManifest(path)
+    manifest.reset_file({'id': 'done', 'md5Checksum': 'x'}, root='folder')
+    manifest.add_ids('done', manifest.allocate_ids(2))
+    manifest.reset_file({'id': 'partial', 'md5Checksum': 'y'}, root='folder')
+    manifest.add_ids('partial', manifest.allocate_ids(2))
+    # 'partial' is replacing vectors 10 and 11 from an earlier run
+    manifest.save({'partial': [10, 11]})
+
+    resumed = IndexManifest(path)
+    assert resumed.next_id == 4
+    assert resumed.is_unchanged({'id': 'done', 'md5Checksum': 'x'})
+    assert not resumed.is_unchanged({'id': 'partial', 'md5Checksum': 'y'})
+    assert resumed.ids_of('partial') == [2, 3, 10, 11]
+    assert resumed.files_under('folder') == ['done', 'partial']
+    # The in-memory manifest still describes the run in progress
+    assert manifest.files['partial']['checksum'] == 'y'
+
+
+def test_reindex_replaces_changed_files_and_drops_deleted_ones(tmp_path):
+    service = FakeDriveService()
+    for name in ('kept', 'changed', 'deleted'):
+        service.add_file(name, f"{name}.txt", 'text/plain', content=f"The {name} file. " * 40,
+                         modified_time='2024-01-01T00:00:00Z')
+    faiss_index_path = str(tmp_path / 'faiss_index.index')
+
+    def run():
+        backend = FakeEmbeddingBackend()
+        preprocessor = Preprocessor(faiss_index_path, embedding_backend=backend,
+                                    drive_client=GoogleDriveClient(service=service), use_embedding_cache=False)
+        preprocessor.run()
+        return preprocessor, backend
+
+    first, _ = run()
+    kept_ids = first.manifest.ids_of('kept')
+    changed_ids = first.manifest.ids_of('changed')
+    first.metadata.close()
+    first.lexical.close()
+
+    service.add_file('changed', 'changed.txt', 'text/plain', content="Now it says something else. " * 40,
+                     modified_time='2024-02-01T00:00:00Z')
+    service.remove_file('deleted')
+    second, backend = run()
+    assert set(second.manifest.files) == {'kept', 'changed'}
+    assert second.manifest.ids_of('kept') == kept_ids
+    assert not set(second.manifest.ids_of('changed')) & set(changed_ids)
+    # Only the changed file was embedded again
+    assert backend.calls == 1
+    stored = sorted(record['file_id'] for record in second.metadata.get_many(second.metadata.ids_from(0)))
+    assert stored == sorted(['kept'] * len(kept_ids) + ['changed'] * len(second.manifest.ids_of('changed')))
+    assert second.index_builder.ntotal == len(stored)
+    assert all('something else' in text for i, text in second.metadata.iter_texts()
+               if i in second.manifest.ids_of('changed'))
+
+
+def test_save_flushes_the_file_and_directory_before_trusting_them(tmp_path, monkeypatch):
+    synced = []
+    fsync = os.fsync
+
+    def recording_fsync(fd):
+        synced.append(stat.S_ISDIR(os.fstat(fd).st_mode))
+        fsync(fd)
+
+    monkeypatch.setattr(os, 'fsync', recording_fsync)
+    manifest = IndexManifest(str(tmp_path / 'manifest.json'))
+    manifest.reset_file({'id': 'a', 'md5Checksum': 'x'})
+    manifest.add_ids('a', manifest.allocate_ids(2))
+    manifest.save()
+    # The temp file before the rename, then its directory
+    assert synced == [False, True]
+    assert not os.path.exists(manifest.path + '.tmp')
+    assert IndexManifest(manifest.path).ids_of('a') == [0, 1]
@@ -0,0 +1,65 @@
+import os
+import sys
+import json
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from rag_pipeline.metadata_store import MetadataStore
+
+
+def test_legacy_json_is_migrated_once(tmp_path):
+    faiss_index_path = str(tmp_path / 'faiss_index.index')
+    json_path = str(tmp_path / 'faiss_index_metadata.json')
+    legacy = {
+        '0': {'text': 'first chunk', 'file_id': 'a', 'mime_type': 'text/plain', 'start': 0, 'end': 11},
+        '7': {'text': 'second chunk', 'file_id': 'b', 'mime_type': 'application/pdf'},
+    }
+    with open(json_path, 'w') as f:
+        json.dump(legacy, f)
+
+    store = MetadataStore.for_index(faiss_index_path)
+    assert len(store) == 2
+    assert store.get(0) == legacy['0'] and store.get(7) == legacy['7']
+    assert store.get(3) is None and 7 in store
+    assert not os.path.exists(json_path) and os.path.exists(json_path + '.migrated')
+    store.close()
+
+    # A later open reads the SQLite store and leaves a newer JSON file alone
+    with open(json_path, 'w') as f:
+        json.dump({'9': {'text': 'ignored'}}, f)
+    reopened = MetadataStore.for_index(faiss_index_path, read_only=True)
+    assert len(reopened) == 2 and reopened.get(9) is None
+    reopened.close()
+
+
+def test_ids_from_and_file_lookups(tmp_path):
+    store = MetadataStore(str(tmp_path / 'metadata.sqlite'))
+    store.add_many((i, {'text': f"chunk {i}", 'file_id': 'even' if i % 2 == 0 else 'odd'}) for i in range(10))
+    store.commit()
+    assert store.ids_from(6) == [6, 7, 8, 9]
+    assert store.ids_from(10) == []
+    assert store.ids_for_file('odd') == [1, 3, 5, 7, 9]
+    store.delete_ids(store.ids_from(6))
+    assert store.ids_from(0) == [0, 1, 2, 3, 4, 5]
+    assert list(store.iter_texts(batch_size=4)) == [(i, f"chunk {i}") for i in range(6)]
+    assert store.get_many([5, 6, 0]) == [{'text': 'chunk 5', 'file_id': 'odd', 'mime_type': None}, None,
+                                         {'text': 'chunk 0', 'file_id': 'even', 'mime_type': None}]
+    store.close()
+
+
+def test_uncommitted_rows_are_not_durable(tmp_path):
+    path = str(tmp_path / 'metadata.sqlite')
+    store = MetadataStore(path)
+    store.add_many([(1, {'text': 'kept'})])
+    store.commit()
+    store.add_many([(2, {'text': 'lost'})])
+    store.close()
+    reopened = MetadataStore(path, read_only=True)
+    assert reopened.ids_from(0) == [1]
+    reopened.close()
+
+
+def test_read_only_store_of_an_unindexed_path_is_empty(tmp_path):
+    store = MetadataStore.for_index(str(tmp_path / 'faiss_index.index'), read_only=True)
+    assert len(store) == 0 and store.get(0) is None
+    store.close()
@@ -0,0 +1,102 @@
+import os
+import sys
+import urllib.request
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from rag_pipeline import metrics
+
+
+@pytest.fixture
+def enabled():
+    was_enabled = metrics.is_enabled()
+    metrics.REGISTRY.clear()
+    metrics.enable()
+    yield metrics.REGISTRY
+    metrics.enable(was_enabled)
+    metrics.REGISTRY.clear()
+
+
+def test_render_prometheus_text(enabled):
+    metrics.inc('chunks', 3, stage='embed')
+    metrics.inc('chunks', 2, stage='embed')
+    metrics.set_gauge('queue_depth', 7)
+    metrics.observe('search', 0.003, kind='hnsw')
+    metrics.observe('search', 0.2, kind='hnsw')
+
+    lines = metrics.render().splitlines()
+    assert '# TYPE docurag_chunks_total counter' in lines
+    assert 'docurag_chunks_total{stage="embed"} 5' in lines
+    assert '# TYPE docurag_queue_depth gauge' in lines
+    assert 'docurag_queue_depth 7' in lines
+    assert '# TYPE docurag_search_seconds histogram' in lines
+    # Buckets are cumulative and end with +Inf
+    assert 'docurag_search_seconds_bucket{kind="hnsw",le="0.0025"} 0' in lines
+    assert 'docurag_search_seconds_bucket{kind="hnsw",le="0.005"} 1' in lines
+    assert 'docurag_search_seconds_bucket{kind="hnsw",le="0.25"} 2' in lines
+    assert 'docurag_search_seconds_bucket{kind="hnsw",le="+Inf"} 2' in lines
+    assert 'docurag_search_seconds_count{kind="hnsw"} 2' in lines
+    assert any(line.startswith('docurag_search_seconds_sum{kind="hnsw"} 0.203') for line in lines)
+    assert '# EOF' not in lines
+
+
+def test_render_openmetrics(enabled):
+    metrics.inc('queries')
+    lines = metrics.render(openmetrics=True).splitlines()
+    assert '# TYPE docurag_queries counter' in lines
+    assert 'docurag_queries_total 1' in lines
+    assert lines[-1] == '# EOF'
+
+
+def test_label_values_are_escaped(enabled):
+    metrics.inc('errors', error='bad "quote"\nnext\\line')
+    assert 'docurag_errors_total{error="bad \\"quote\\"\\nnext\\\\line"} 1' in metrics.render().splitlines()
+
+
+def test_span_records_histogram_and_trace(enabled):
+    with metrics.trace('answer') as t:
+        with metrics.span('retrieve'):
+            pass
+        metrics.inc('tokens', 12)
+    assert 'docurag_retrieve_seconds_count 1' in metrics.render().splitlines()
+    breakdown = t.breakdown()
+    assert breakdown['request'] == 'answer'
+    assert set(breakdown['spans']) == {'retrieve'}
+    assert breakdown['counters'] == {'tokens': 12}
+
+
+def test_disabled_metrics_record_nothing():
+    was_enabled = metrics.is_enabled()
+    metrics.enable(False)
+    metrics.REGISTRY.clear()
+    try:
+        metrics.inc('chunks')
+        metrics.set_gauge('queue_depth', 1)
+        with metrics.span('retrieve'):
+            pass
+        assert metrics.render() == '\n'
+        # Traces still collect their breakdown with process-wide metrics off
+        with metrics.trace() as t:
+            with metrics.span('retrieve'):
+                pass
+        assert set(t.breakdown()['spans']) == {'retrieve'}
+    finally:
+        metrics.enable(was_enabled)
+
+
+def test_http_endpoint_serves_metrics(enabled):
+    metrics.inc('queries')
+    server = metrics.start_http_server(port=0, host='127.0.0.1')
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url) as response:
+            assert response.headers['Content-Type'].startswith('text/plain')
+            assert 'docurag_queries_total 1' in response.read().decode('utf-8')
+        request = urllib.request.Request(url, headers={'Accept': 'application/openmetrics-text'})
+        with urllib.request.urlopen(request) as response:
+            assert response.read().decode('utf-8').endswith('# EOF\n')
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,99 @@
+import os
+import sys
+import json
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.corpus import SyntheticCorpus
+from data_extraction import extractors
+from data_extraction.fake_drive import FakeDriveService
+from data_extraction.gdrive_extraction import GoogleDriveClient
+from preprocessing.preprocessing import Preprocessor
+from rag_pipeline.embeddings import FakeEmbeddingBackend
+
+FLAKY_MIME_TYPE = 'text/x-flaky'
+
+
+def _paragraph(i):
+    return ' '.join(f"word{i}x{j}" for j in range(120)) + '.\n\n'
+
+
+@pytest.fixture
+def register_extractor(monkeypatch):
+    # Registrations made through this are dropped after the test
+    monkeypatch.setattr(extractors, '_EXTRACTORS', dict(extractors._EXTRACTORS))
+    return extractors.register_extractor
+
+
+def test_file_whose_extraction_fails_midway_is_indexed_again(tmp_path, register_extractor):
+    calls = []
+
+    def flaky(file_stream, mime_type):
+        # Yields enough text for several stored batches, then fails
+        calls.append(mime_type)
+        for i in range(8):
+            yield _paragraph(i)
+        if len(calls) == 1:
+            raise ValueError("corrupt stream")
+
+    register_extractor(FLAKY_MIME_TYPE, flaky)
+    service = FakeDriveService()
+    service.add_file('flaky', 'flaky.txt', FLAKY_MIME_TYPE, content=b'ignored')
+    service.add_file('plain', 'plain.txt', 'text/plain', content=_paragraph(0))
+    faiss_index_path = str(tmp_path / 'faiss_index.index')
+
+    def run():
+        preprocessor = Preprocessor(faiss_index_path, embedding_backend=FakeEmbeddingBackend(),
+                                    drive_client=GoogleDriveClient(service=service),
+                                    use_embedding_cache=False, batch_size=2)
+        preprocessor.run()
+        return preprocessor
+
+    first = run()
+    with open(first.manifest.path) as f:
+        saved = json.load(f)['files']
+    # The partially stored file is committed without a modified time, so it is not skipped
+    assert saved['flaky']['modified_time'] is None and saved['flaky']['ids']
+    assert saved['plain']['modified_time'] is not None
+    partial = len(first.metadata)
+
+    second = run()
+    assert len(calls) == 2
+    assert second.manifest.files['flaky']['modified_time'] is not None
+    assert len(second.metadata) > partial
+
+
+def _ingest(faiss_index_path, corpus, index_kind, interrupt_after=None):
+    preprocessor = Preprocessor(faiss_index_path, embedding_backend=FakeEmbeddingBackend(),
+                                drive_client=GoogleDriveClient(service=corpus.service),
+                                use_embedding_cache=False, batch_size=8, checkpoint_chunks=24,
+                                index_kind=index_kind)
+    if interrupt_after is not None:
+        store, batches = preprocessor._store_batch, []
+
+        def interrupted(batch, vectors):
+            store(batch, vectors)
+            batches.append(batch)
+            if len(batches) == interrupt_after:
+                raise KeyboardInterrupt
+
+        preprocessor._store_batch = interrupted
+        with pytest.raises(KeyboardInterrupt):
+            preprocessor.run()
+        # Closing without committing leaves the stores as a crashed process would
+        preprocessor.metadata.close()
+        preprocessor.lexical.close()
+        return None
+    preprocessor.run()
+    return sorted(text for _, text in preprocessor.metadata.iter_texts())
+
+
+@pytest.mark.parametrize('index_kind', ['flat', 'hnsw'])
+def test_interrupted_ingest_resumes(tmp_path, index_kind):
+    corpus = SyntheticCorpus(12)
+    expected = _ingest(str(tmp_path / 'clean.index'), corpus, index_kind)
+    faiss_index_path = str(tmp_path / 'resumed.index')
+    _ingest(faiss_index_path, corpus, index_kind, interrupt_after=7)
+    assert _ingest(faiss_index_path, corpus, index_kind) == expected
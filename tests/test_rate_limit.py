@@ -0,0 +1,130 @@
+import os
+import sys
+import time
+from email.utils import formatdate
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.corpus import SyntheticCorpus
+from data_extraction.gdrive_extraction import GoogleDriveClient
+from preprocessing.preprocessing import Preprocessor
+from rag_pipeline.embeddings import FakeEmbeddingBackend
+from rag_pipeline.rate_limit import RequestError, RequestScheduler, parse_duration, retry_after
+
+
+@pytest.mark.parametrize('value, seconds', [('1.5', 1.5), ('20ms', 0.02), ('6m0s', 360.0), ('1h2m3s', 3723.0),
+                                            ('soon', None), (None, None)])
+def test_parse_duration(value, seconds):
+    assert parse_duration(value) == seconds
+
+
+def test_retry_after_prefers_milliseconds_and_reads_http_dates():
+    assert retry_after({'retry-after-ms': '250', 'retry-after': '9'}) == 0.25
+    assert retry_after({'retry-after': '2'}) == 2.0
+    assert 25 < retry_after({'retry-after': formatdate(time.time() + 30, usegmt=True)}) <= 30
+    assert retry_after({'retry-after': 'garbage'}) is None
+    assert retry_after({}) is None
+
+
+def test_headers_set_the_request_and_token_budgets():
+    scheduler = RequestScheduler()
+    scheduler.update_from_headers({'x-ratelimit-limit-requests': '600', 'x-ratelimit-remaining-requests': '0',
+                                   'x-ratelimit-reset-requests': '2s', 'x-ratelimit-limit-tokens': '90000'})
+    assert scheduler.requests.rate == 600 and scheduler.tokens.rate == 90000
+    # Nothing remains, so the next request waits for the reset
+    assert 1.5 < scheduler.requests.seconds_until(1) <= 2.2
+
+
+def test_backoff_is_jittered_and_honours_retry_after():
+    scheduler = RequestScheduler(base_delay=0.5, max_delay=4.0)
+    delays = [scheduler.backoff(3) for _ in range(200)]
+    assert all(0 <= delay <= 4.0 for delay in delays) and len(set(delays)) > 1
+    assert scheduler.backoff(0, server_delay=2.0) >= 2.0
+    assert scheduler.backoff(0, server_delay=60.0) == 4.0
+
+
+def _flaky(failures, status=429, headers=None):
+    calls = []
+
+    def fn():
+        calls.append(time.monotonic())
+        if len(calls) <= failures:
+            raise RequestError("failed", status, headers)
+        return 'ok'
+
+    return fn, calls
+
+
+def test_throttled_calls_are_retried_after_retry_after():
+    scheduler = RequestScheduler(base_delay=0.001, max_delay=1.0)
+    fn, calls = _flaky(2, headers={'retry-after-ms': '100'})
+    assert scheduler.call(fn) == 'ok'
+    assert len(calls) == 3 and scheduler.retries == 2 and scheduler.throttled == 2
+    assert all(later - earlier >= 0.09 for earlier, later in zip(calls, calls[1:]))
+
+
+def test_errors_that_are_not_transient_or_outlast_the_retries_are_raised():
+    scheduler = RequestScheduler(max_retries=2, base_delay=0.001)
+    fn, calls = _flaky(1, status=400)
+    with pytest.raises(RequestError):
+        scheduler.call(fn)
+    assert len(calls) == 1
+    fn, calls = _flaky(10, status=503)
+    with pytest.raises(RequestError):
+        scheduler.call(fn)
+    assert len(calls) == 3
+
+
+def test_retries_do_not_reserve_the_budget_again():
+    scheduler = RequestScheduler(requests_per_minute=60, tokens_per_minute=6000, base_delay=0.001)
+    fn, calls = _flaky(3, status=503)
+    start = time.monotonic()
+    scheduler.call(fn, tokens=100)
+    # One request and 100 tokens were reserved, so the retries did not wait for more budget
+    assert time.monotonic() - start < 0.5
+    assert scheduler.requests.tokens == pytest.approx(0, abs=0.05)
+    assert scheduler.tokens.tokens == pytest.approx(0, abs=5)
+
+
+def test_concurrency_halves_when_throttled_and_recovers_additively():
+    scheduler = RequestScheduler(max_concurrency=8, base_delay=0.001)
+    scheduler._acquire_slot()
+    scheduler._release_slot(True)
+    assert scheduler.concurrency == 4
+    time.sleep(0.002)
+    scheduler._acquire_slot()
+    scheduler._release_slot(True)
+    assert scheduler.concurrency == 2
+    for _ in range(10):
+        scheduler._acquire_slot()
+        scheduler._release_slot(False)
+    assert 4 < scheduler.concurrency < 5
+
+
+def _ingest(faiss_index_path, error_rate=0.0, requests_per_minute=None):
+    corpus = SyntheticCorpus(12)
+    corpus.service.error_rate = error_rate
+    # Without rate-limit headers the scheduler only learns the limit from 429s
+    backend = FakeEmbeddingBackend(requests_per_minute=requests_per_minute, rate_limit_headers=False)
+    preprocessor = Preprocessor(faiss_index_path, embedding_backend=backend,
+                                drive_client=GoogleDriveClient(service=corpus.service),
+                                use_embedding_cache=False, batch_size=8,
+                                embedding_scheduler=RequestScheduler(max_concurrency=4, base_delay=0.01,
+                                                                     max_delay=0.5, name='embeddings'),
+                                drive_scheduler=RequestScheduler(max_concurrency=5, base_delay=0.01,
+                                                                 max_delay=0.5, name='drive'))
+    preprocessor.run()
+    return preprocessor, backend, corpus.service
+
+
+def test_rate_limited_ingest_drops_no_chunks(tmp_path):
+    unlimited, _, _ = _ingest(str(tmp_path / 'unlimited.index'))
+    limited, backend, service = _ingest(str(tmp_path / 'limited.index'), error_rate=0.3,
+                                        requests_per_minute=300)
+    # Both fakes refused requests, and every refused request was retried
+    assert backend.rejected > 0 and service.rejected > 0
+    assert limited.index_builder.ntotal == unlimited.index_builder.ntotal
+    assert sorted(text for _, text in limited.metadata.iter_texts()) == \
+        sorted(text for _, text in unlimited.metadata.iter_texts())
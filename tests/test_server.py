@@ -0,0 +1,135 @@
+import os
+import sys
+import json
+import time
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.corpus import SyntheticCorpus
+from data_extraction.gdrive_extraction import GoogleDriveClient
+from preprocessing.preprocessing import Preprocessor
+from rag_pipeline.embeddings import FakeEmbeddingBackend
+from rag_pipeline.fake_chat import FakeChatClient
+from rag_pipeline.server import MicroBatcher, QueryService, make_server
+
+
+@pytest.fixture(scope='module')
+def faiss_index_path(tmp_path_factory):
+    faiss_index_path = str(tmp_path_factory.mktemp('index') / 'faiss_index.index')
+    corpus = SyntheticCorpus(20)
+    Preprocessor(faiss_index_path, embedding_backend=FakeEmbeddingBackend(),
+                 drive_client=GoogleDriveClient(service=corpus.service), use_embedding_cache=False).run()
+    return faiss_index_path
+
+
+@pytest.mark.parametrize('use_answer_cache', [False, True])
+def test_concurrent_answers_share_one_embeddings_request(faiss_index_path, use_answer_cache):
+    backend = FakeEmbeddingBackend()
+    service = QueryService(faiss_index_path, max_batch_size=16, max_wait=0.5, model='gpt-4o',
+                           embedding_backend=backend, chat_client=FakeChatClient(),
+                           use_answer_cache=use_answer_cache)
+    try:
+        # Distinct per case, as the embedding cache next to the index is shared
+        questions = [f"question {i} about the quarterly report ({use_answer_cache})" for i in range(8)]
+        with ThreadPoolExecutor(max_workers=len(questions)) as pool:
+            answers = list(pool.map(service.answer, questions))
+    finally:
+        service.close()
+    assert all(not answer.startswith('I encountered') for answer in answers)
+    # Questions are embedded in the batched search, and packing reads chunk vectors from the index
+    assert backend.calls < len(questions)
+
+
+def _post(server, path, payload):
+    connection = http.client.HTTPConnection(*server.server_address[:2], timeout=10)
+    try:
+        connection.request('POST', path, json.dumps(payload), {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def test_query_endpoint_answers_concurrent_queries(faiss_index_path):
+    service = QueryService(faiss_index_path, max_batch_size=16, max_wait=0.2,
+                           embedding_backend=FakeEmbeddingBackend(),
+                           chat_client=FakeChatClient())
+    server = make_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        queries = [f"part number {i} inventory" for i in range(6)]
+        with ThreadPoolExecutor(max_workers=len(queries)) as pool:
+            responses = list(pool.map(lambda query: _post(server, '/query', {'query': query, 'k': 3}), queries))
+        assert _post(server, '/query', {'k': 3}) == (400, {'error': "missing 'query'"})
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()
+    assert all(status == 200 and len(body['results']) == 3 for status, body in responses)
+    # Each result matches what FaissQuery returns for the query on its own
+    _, expected = service.faiss_query.query(queries[0], k=3)
+    assert [r['id'] for r in responses[0][1]['results']] == [r['id'] for r in expected]
+
+
+def _batcher(max_batch_size=32, max_wait=0.002, process=None):
+    batches = []
+
+    def record(key, items):
+        batches.append(list(items))
+        return [item * 10 for item in items]
+
+    return MicroBatcher(process or record, max_batch_size=max_batch_size, max_wait=max_wait), batches
+
+
+def test_batches_are_split_at_max_batch_size():
+    batcher, batches = _batcher(max_batch_size=4, max_wait=0.5)
+    try:
+        futures = [batcher.submit('key', i) for i in range(10)]
+        assert [future.result(timeout=5) for future in futures] == [i * 10 for i in range(10)]
+    finally:
+        batcher.close()
+    assert all(len(batch) <= 4 for batch in batches)
+    assert sorted(item for batch in batches for item in batch) == list(range(10))
+
+
+def test_partial_batch_is_flushed_after_max_wait():
+    batcher, batches = _batcher(max_batch_size=32, max_wait=0.1)
+    try:
+        start = time.monotonic()
+        futures = [batcher.submit('key', i) for i in range(3)]
+        assert [future.result(timeout=5) for future in futures] == [0, 10, 20]
+        assert 0.05 <= time.monotonic() - start < 2
+    finally:
+        batcher.close()
+    assert batches == [[0, 1, 2]]
+
+
+def test_items_without_a_result_fail():
+    batcher, _ = _batcher(max_wait=0.1, process=lambda key, items: [item * 10 for item in items][:1])
+    try:
+        futures = [batcher.submit('key', i) for i in range(3)]
+        assert futures[0].result(timeout=5) == 0
+        for future in futures[1:]:
+            with pytest.raises(RuntimeError, match="No result"):
+                future.result(timeout=5)
+    finally:
+        batcher.close()
+
+
+def test_search_times_out_when_a_batch_never_finishes(faiss_index_path):
+    service = QueryService(faiss_index_path, embedding_backend=FakeEmbeddingBackend(),
+                           chat_client=FakeChatClient(), request_timeout=0.2)
+    release = threading.Event()
+    service.batcher.process = lambda key, items: release.wait()
+    try:
+        with pytest.raises(TimeoutError):
+            service.query("quarterly report")
+    finally:
+        release.set()
+        service.close()